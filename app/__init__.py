@@ -4,6 +4,12 @@ Flask アプリケーションファクトリー
 from flask import Flask
 from config import get_config
 from app.common.utils import init_logger
+from app.common.template_cache import init_template_cache
+from app.common.storage import init_storage
+from app.common.metrics import init_metrics
+from app.common.cache import init_cache
+from app.common.assets import init_assets
+from app.common.prerender import init_prerender
 from flask import send_from_directory
 
 def create_app(config_name='development'):
@@ -26,11 +32,27 @@ def create_app(config_name='development'):
     # ロギング初期化
     init_logger(app)
     
+    # テンプレートのバイトコードキャッシュ
+    init_template_cache(app)
+    
+    # データベース（DB_BACKEND）の選択とスキーマ作成・更新
+    init_storage(app)
+    
+    # リクエストのメトリクス計測（/metrics）
+    init_metrics(app)
+    
+    # プロセスをまたいで共有するキャッシュ
+    init_cache(app)
+    
+    # ハッシュ付きアセットの配信と asset_url（manage.py build-assets でビルド）
+    init_assets(app)
+    
     # Blueprint登録
     from app.portal import portal_bp
     from app.kuku import kuku_bp
     from app.shisoku import shisoku_bp
     from app.tankanji import tankanji_bp
+    from app.rireki import register_blueprint as register_rireki
     
     # ポータル画面（ルート）
     app.register_blueprint(portal_bp, url_prefix='/')
@@ -40,6 +62,9 @@ def create_app(config_name='development'):
     app.register_blueprint(shisoku_bp)
     app.register_blueprint(tankanji_bp)
     
+    # 履歴管理アプリ
+    register_rireki(app)
+    
     # グローバルエラーハンドラ
     register_error_handlers(app)
     
@@ -50,6 +75,9 @@ def create_app(config_name='development'):
         mimetype='image/svg+xml'
     ))
 
+    # 事前レンダリングしたページの更新（manage.py prerender）
+    init_prerender(app)
+
     app.logger.info(f'Flask application created in {config_name} mode')
     
     return app
@@ -0,0 +1,472 @@
+"""
+静的アセット（JS / CSS）のビルドと配信
+
+manage.py build-assets で次のファイルを app/static/dist/ に出力します。
+- 縮小（コメント・インデント・空行の削除）した内容のハッシュを含むファイル名
+  （例: js/main.js -> dist/js/main.3f2a9c1b7e04.js）
+- 事前圧縮した .gz（brotli がある場合は .br も）
+- 元のファイル名 -> 出力先の対応表（dist/manifest.json。ビルドごとの控えを dist/manifests/ に保存）
+- CACHE_NAME とキャッシュ対象をビルドに合わせて書き換えた Service Worker（dist/sw.js）
+
+以前のビルドのハッシュ付きファイルは、書き出し済みの HTML・常駐ワーカーが読み込んだ
+マニフェスト・端末のキャッシュから参照され続けるため、ビルドでは削除しません。
+manage.py prune-assets で、直近のビルドと保持期間内のビルドが参照しないものだけを削除します。
+
+テンプレートでは url_for の代わりに asset_url を使うと、マニフェストがあれば
+ハッシュ付きのファイル名に置き換えます（ない場合は元のファイルを参照）。
+ハッシュ付きのファイルは内容が変わらないため、immutable で1年間キャッシュさせます。
+"""
+import glob
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import time
+
+from flask import current_app, request, send_from_directory, url_for
+
+from app.common.responses import ENCODINGS, compress
+
+# ビルド対象（static フォルダからの相対パスのパターン）
+ASSET_PATTERNS = ('js/*.js', 'css/*.css')
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_HISTORY_DIR = 'manifests'
+SERVICE_WORKER = 'sw.js'
+
+# prune-assets の既定: 直近のビルド数と、これより新しいビルドは残す（秒）
+PRUNE_KEEP_BUILDS = 5
+PRUNE_MIN_AGE = 7 * 24 * 60 * 60
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# 拡張子 -> 事前圧縮ファイルの拡張子
+COMPRESSED_SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+
+_REGEX_PREFIX_CHARS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_PREFIX_WORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void',
+                       'yield', 'delete', 'throw', 'new', 'await')
+
+
+# ---------------------------------------------------------------------------
+# 縮小
+# ---------------------------------------------------------------------------
+
+def _skip_quoted(source, i, quote):
+    """文字列リテラルの終わりの位置（引用符の次）"""
+    n = len(source)
+    i += 1
+    while i < n:
+        c = source[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == quote or (c == '\n' and quote != '`'):
+            return i + 1
+        if quote == '`' and c == '$' and source.startswith('{', i + 1):
+            i = _skip_code_block(source, i + 2)
+            continue
+        i += 1
+    return n
+
+
+def _skip_code_block(source, i):
+    """テンプレートリテラルの ${ ... } の終わりの位置（} の次）"""
+    n = len(source)
+    depth = 1
+    while i < n:
+        c = source[i]
+        if c in '\'"`':
+            i = _skip_quoted(source, i, c)
+            continue
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return n
+
+
+def _skip_regex(source, i):
+    """正規表現リテラルの終わりの位置（改行に達した場合は None）"""
+    n = len(source)
+    j = i + 1
+    in_class = False
+    while j < n:
+        c = source[j]
+        if c == '\\':
+            j += 2
+            continue
+        if c == '\n':
+            return None
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            j += 1
+            while j < n and (source[j].isalnum() or source[j] == '_'):
+                j += 1
+            return j
+        j += 1
+    return None
+
+
+def _regex_allowed(out):
+    """直前のトークンから、/ が正規表現の開始かどうかを判定"""
+    tail = ''.join(out[-4:]).rstrip()
+    if not tail:
+        return True
+    if tail[-1] in _REGEX_PREFIX_CHARS:
+        return True
+    match = re.search(r'([A-Za-z_$][\w$]*)$', ''.join(out[-32:]).rstrip())
+    return bool(match) and match.group(1) in _REGEX_PREFIX_WORDS
+
+
+def minify_js(source):
+    """
+    JavaScript を縮小
+
+    コメント、行頭のインデント、行末の空白、空行のみを削除します。
+    改行は残すため、自動セミコロン挿入に依存するコードの意味は変わりません。
+    文字列・テンプレートリテラル・正規表現の中身はそのまま保持します。
+    """
+    out = []
+    i = 0
+    n = len(source)
+    line_start = True
+
+    while i < n:
+        c = source[i]
+
+        if line_start and c in ' \t\r':
+            i += 1
+            continue
+
+        if c in '\'"`':
+            j = _skip_quoted(source, i, c)
+            out.append(source[i:j])
+            i = j
+            line_start = False
+            continue
+
+        if c == '/' and i + 1 < n:
+            following = source[i + 1]
+            if following == '/':
+                end = source.find('\n', i)
+                i = n if end < 0 else end
+                continue
+            if following == '*':
+                end = source.find('*/', i + 2)
+                comment = source[i:n if end < 0 else end + 2]
+                i = n if end < 0 else end + 2
+                # 改行を含むコメントは改行に置き換える（自動セミコロン挿入を保つ）
+                out.append('\n' if '\n' in comment else ' ')
+                if '\n' in comment:
+                    line_start = True
+                continue
+            if _regex_allowed(out):
+                j = _skip_regex(source, i)
+                if j is not None:
+                    out.append(source[i:j])
+                    i = j
+                    line_start = False
+                    continue
+
+        if c == '\n' or c == '\r':
+            while out and out[-1] in (' ', '\t', '\r'):
+                out.pop()
+            if out and out[-1] != '\n':
+                out.append('\n')
+            line_start = True
+            i += 1
+            continue
+
+        out.append(c)
+        line_start = False
+        i += 1
+
+    return ''.join(out).strip() + '\n'
+
+
+def minify_css(source):
+    """CSS を縮小（コメント・余分な空白を削除、文字列の中身は保持）"""
+    out = []
+    i = 0
+    n = len(source)
+    while i < n:
+        c = source[i]
+        if c in '\'"':
+            j = _skip_quoted(source, i, c)
+            out.append(source[i:j])
+            i = j
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            out.append(' ')
+            continue
+        if c.isspace():
+            while i < n and source[i].isspace():
+                i += 1
+            out.append(' ')
+            continue
+        out.append(c)
+        i += 1
+
+    # 文字列以外の区切り記号の前後の空白を削除
+    result = []
+    for chunk in re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', ''.join(out)):
+        if chunk[:1] in ('"', "'"):
+            result.append(chunk)
+            continue
+        chunk = re.sub(r'\s*([{};,>])\s*', r'\1', chunk)
+        chunk = chunk.replace(';}', '}')
+        result.append(chunk)
+    return ''.join(result).strip() + '\n'
+
+
+MINIFIERS = {
+    '.js': minify_js,
+    '.css': minify_css,
+}
+
+
+# ---------------------------------------------------------------------------
+# ビルド
+# ---------------------------------------------------------------------------
+
+def iter_asset_sources(static_folder):
+    """ビルド対象のファイル（static フォルダからの相対パス、/ 区切り）"""
+    for pattern in ASSET_PATTERNS:
+        for path in sorted(glob.glob(os.path.join(static_folder, pattern))):
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/')
+
+
+def fingerprint(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def _write(path, content):
+    """一時ファイルに書き込んでから置き換える（配信中のファイルが途中の状態にならない）"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _variant_paths(path):
+    return [path + COMPRESSED_SUFFIXES[encoding] for encoding in ENCODINGS if encoding in COMPRESSED_SUFFIXES]
+
+
+def _write_with_variants(path, content):
+    """本文と事前圧縮ファイル（.gz / .br）を書き込む（同じハッシュのファイルがあれば何もしない）"""
+    if all(os.path.exists(p) for p in [path] + _variant_paths(path)):
+        return
+    _write(path, content)
+    for encoding in ENCODINGS:
+        if encoding in COMPRESSED_SUFFIXES:
+            _write(path + COMPRESSED_SUFFIXES[encoding], compress(content, encoding))
+
+
+def build_service_worker(static_folder, manifest, version):
+    """
+    Service Worker の CACHE_NAME をビルドのバージョンにし、
+    キャッシュ対象の '/static/...' をハッシュ付きの URL に置き換える
+    """
+    with open(os.path.join(static_folder, SERVICE_WORKER), encoding='utf-8') as f:
+        source = f.read()
+
+    source = re.sub(
+        r"const CACHE_NAME = '[^']*';",
+        f"const CACHE_NAME = 'study-{version}';",
+        source
+    )
+
+    def replace(match):
+        name = match.group(2)
+        if name in manifest:
+            return f'{match.group(1)}/static/{manifest[name]}{match.group(1)}'
+        return match.group(0)
+
+    return re.sub(r"(['\"])/static/([^'\"]+)\1", replace, source)
+
+
+def build_assets(static_folder):
+    """
+    アセットをビルドしてマニフェストを返す
+
+    以前のビルドのファイルは残し、新しいハッシュのファイルを追加します（削除は prune_assets）。
+
+    Returns:
+        dict: {"version": ..., "assets": {元のパス: dist 内のパス}}
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+
+    assets = {}
+    for name in iter_asset_sources(static_folder):
+        with open(os.path.join(static_folder, name), encoding='utf-8') as f:
+            source = f.read()
+        stem, ext = os.path.splitext(name)
+        content = MINIFIERS[ext](source).encode('utf-8')
+        hashed = f'{DIST_DIR}/{stem}.{fingerprint(content)}{ext}'
+        _write_with_variants(os.path.join(static_folder, hashed), content)
+        assets[name] = hashed
+
+    version = fingerprint(json.dumps(assets, sort_keys=True).encode('utf-8'))
+    manifest = {'version': version, 'assets': assets}
+
+    if os.path.exists(os.path.join(static_folder, SERVICE_WORKER)):
+        worker = build_service_worker(static_folder, assets, version)
+        _write(os.path.join(dist, SERVICE_WORKER), worker.encode('utf-8'))
+
+    content = json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8')
+    # 控えの更新日時をビルド日時として prune_assets の保持期間に使う
+    _write(os.path.join(dist, MANIFEST_HISTORY_DIR, f'{version}.json'), content)
+    _write(os.path.join(dist, MANIFEST_NAME), content)
+    return manifest
+
+
+def prune_assets(static_folder, keep=PRUNE_KEEP_BUILDS, min_age=PRUNE_MIN_AGE, now=None):
+    """
+    古いビルドのハッシュ付きファイルを削除
+
+    現在のビルド・直近 keep 回のビルド・min_age 秒以内のビルドのマニフェストが
+    参照するファイルは残します。どのマニフェストにもないファイル（控えを残す前のビルド等）は、
+    更新日時が min_age 秒より古い場合のみ削除します。
+
+    Returns:
+        dict: {"builds": 残したビルド数, "removed_builds": ..., "removed_files": ...}
+    """
+    now = time.time() if now is None else now
+    dist = os.path.join(static_folder, DIST_DIR)
+    history_dir = os.path.join(dist, MANIFEST_HISTORY_DIR)
+    current = load_manifest(static_folder)
+
+    builds = []
+    for path in glob.glob(os.path.join(history_dir, '*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                builds.append((os.path.getmtime(path), path, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    builds.sort(key=lambda build: build[0], reverse=True)
+
+    referenced = set((current or {}).get('assets', {}).values())
+    kept = 0
+    removed_builds = 0
+    for i, (mtime, path, manifest) in enumerate(builds):
+        is_current = current is not None and manifest.get('version') == current.get('version')
+        if is_current or i < keep or now - mtime < min_age:
+            referenced.update(manifest.get('assets', {}).values())
+            kept += 1
+        else:
+            os.remove(path)
+            removed_builds += 1
+
+    suffixes = tuple(COMPRESSED_SUFFIXES.values())
+    removed_files = 0
+    for root, dirs, files in os.walk(dist):
+        if os.path.abspath(root) == os.path.abspath(dist):
+            dirs[:] = [d for d in dirs if d != MANIFEST_HISTORY_DIR]
+        for name in files:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if rel in (f'{DIST_DIR}/{MANIFEST_NAME}', f'{DIST_DIR}/{SERVICE_WORKER}'):
+                continue
+            base = rel[:-len(rel.rsplit('.', 1)[-1]) - 1] if rel.endswith(suffixes) else rel
+            if base in referenced:
+                continue
+            try:
+                if now - os.path.getmtime(path) < min_age:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            removed_files += 1
+
+    return {'builds': kept, 'removed_builds': removed_builds, 'removed_files': removed_files}
+
+
+def load_manifest(static_folder):
+    """ビルド済みのマニフェスト（ない場合は None）"""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# テンプレート・配信
+# ---------------------------------------------------------------------------
+
+def _assets():
+    # マニフェストはページを描画するリクエストで初めて読み込む（API のみの CGI プロセスでは読まない）
+    extensions = current_app.extensions
+    if 'assets' not in extensions:
+        extensions['assets'] = load_manifest(current_app.static_folder)
+    manifest = extensions['assets']
+    return manifest['assets'] if manifest else {}
+
+
+def asset_url(endpoint, **values):
+    """
+    url_for と同じ引数で、ビルド済みのアセットはハッシュ付きの URL を返す
+
+    例: {{ asset_url('static', filename='js/main.js') }}
+    """
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = _assets().get(values['filename'], values['filename'])
+    return url_for(endpoint, **values)
+
+
+def serve_dist(filename):
+    """ハッシュ付きのアセットを事前圧縮ファイルから配信（immutable）"""
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    encoding = 'identity'
+    for candidate in ENCODINGS:
+        suffix = COMPRESSED_SUFFIXES.get(candidate)
+        if suffix and request.accept_encodings[candidate] \
+                and os.path.isfile(os.path.join(dist, filename + suffix)):
+            encoding = candidate
+            break
+
+    if encoding != 'identity':
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(dist, filename + COMPRESSED_SUFFIXES[encoding], mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(dist, filename)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def serve_service_worker():
+    """ビルド済みの Service Worker（なければ元のファイル）をサイト全体のスコープで、毎回検証させて配信"""
+    path = os.path.join(current_app.static_folder, DIST_DIR, SERVICE_WORKER)
+    folder = os.path.dirname(path) if os.path.exists(path) else current_app.static_folder
+    response = send_from_directory(folder, SERVICE_WORKER, mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    # /static/ 以外（各アプリのページ・API）もスコープに含められるようにする
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
+
+
+def init_assets(app):
+    """asset_url とアセット配信のルートを登録（マニフェストは最初の asset_url で読み込む）"""
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.add_url_rule(f'{app.static_url_path}/{DIST_DIR}/<path:filename>', 'static_dist', serve_dist)
+    app.add_url_rule(f'{app.static_url_path}/{SERVICE_WORKER}', 'service_worker', serve_service_worker)
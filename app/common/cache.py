@@ -0,0 +1,438 @@
+"""
+プロセスをまたいで共有する応答・データのキャッシュ
+
+CGI ではリクエストごとにプロセスが終了し、クラス変数等のメモ化は残らないため、
+既定では SQLite ファイル（CACHE_DATABASE）に保存します。
+
+- 有効期限（TTL）: 期限切れのエントリは参照時・追い出し時に削除
+- 容量（CACHE_MAX_BYTES）: 超えた場合は最終参照の古いものから削除（LRU）
+- タグ: invalidate_tags('history:kuku') のように関連するエントリをまとめて削除
+- リクエスト内の層: 同じリクエストでの2回目以降の参照は g に保持した値を返す
+
+使い方:
+    @cached('kanji_query', ttl=3600, tags=('kanji',))
+    def query(...): ...
+
+    @cached_view('kanji_api', ttl=3600, tags=('kanji',))
+    def view(): ...
+
+値は marshal で保存するため、dict / list / str / bytes / 数値等の組み込み型に限ります。
+"""
+import functools
+import hashlib
+import marshal
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+
+from app.common import db
+from app.common.metrics import record_cache
+from app.common.stamps import file_identity, is_stamped, write_stamp
+
+# 保存形式のバージョン（marshal の形式は Python のバージョンごとに異なる）
+CACHE_FORMAT = f'1:{marshal.version}'
+
+# 最終参照日時を更新する最短間隔（秒）。参照のたびに書き込まないための近似 LRU
+TOUCH_INTERVAL = 30
+
+# 容量を超えた場合に、この割合まで減らす
+EVICT_TARGET_RATIO = 0.9
+
+# 保存する応答ヘッダー
+VIEW_HEADERS = ('Content-Type', 'Content-Encoding', 'ETag', 'Cache-Control', 'Vary', 'Last-Modified')
+
+_MISSING = object()
+
+
+class MemoryStore:
+    """プロセス内で保持（常駐サーバーの単一プロセス・開発用）"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            blob, expires_at, tags = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return blob
+
+    def set(self, key, blob, expires_at, tags, now):
+        with self._lock:
+            self._entries[key] = (blob, expires_at, tuple(tags))
+            self._entries.move_to_end(key)
+            total = sum(len(entry[0]) for entry in self._entries.values())
+            while total > self.max_bytes and self._entries:
+                _, (old, _, _) = self._entries.popitem(last=False)
+                total -= len(old)
+
+    def delete_tags(self, tags):
+        tags = set(tags)
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if tags & set(entry[2])]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(len(entry[0]) for entry in self._entries.values()),
+            }
+
+
+class SQLiteStore:
+    """
+    SQLite ファイルで保持（複数プロセス・CGI 用）
+
+    キャッシュは失っても困らないため synchronous=OFF で書き込みます。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at);
+        CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries (expires_at);
+        CREATE TABLE IF NOT EXISTS cache_tags (
+            tag TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY (tag, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_cache_tags_key ON cache_tags (key);
+    """
+
+    # スキーマの作成済みを記録するスタンプ（STAMP_DIR/<STAMP>.stamp。スキーマを変えると作り直す）
+    STAMP = 'cache-schema'
+    SCHEMA_HASH = hashlib.sha1(SCHEMA.encode('utf-8')).hexdigest()[:12]
+
+    def __init__(self, path, max_bytes, stamp_dir=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stamp_dir = stamp_dir
+        self._local = threading.local()
+
+    def _stamp_key(self):
+        identity = file_identity(self.path)
+        if identity is None:
+            return None
+        return f'{os.path.abspath(self.path)}:{identity}:{self.SCHEMA_HASH}'
+
+    def _connect(self):
+        # fork 後は親の接続を使わずに作り直す
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        stamped = is_stamped(self.stamp_dir, self.STAMP, self._stamp_key())
+        conn = sqlite3.connect(self.path, timeout=db.BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute('PRAGMA synchronous=OFF')
+        if not stamped:
+            # WAL はファイルに記録されるため、スキーマと合わせて最初の1回だけ設定する
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.SCHEMA)
+            write_stamp(self.stamp_dir, self.STAMP, self._stamp_key())
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, now):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        blob, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            self._delete_keys(conn, [key])
+            return None
+        if now - accessed_at >= TOUCH_INTERVAL:
+            conn.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?', (now, key))
+        return blob
+
+    def set(self, key, blob, expires_at, tags, now):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, size, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, blob, len(blob), expires_at, now)
+            )
+            conn.executemany(
+                'INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)',
+                [(tag, key) for tag in tags]
+            )
+            self._evict(conn, now)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _evict(self, conn, now):
+        """期限切れを削除し、容量を超えていれば最終参照の古いものから削除"""
+        expired = [row[0] for row in conn.execute(
+            'SELECT key FROM cache_entries WHERE expires_at <= ?', (now,)
+        )]
+        self._delete_keys(conn, expired)
+
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM cache_entries ORDER BY accessed_at'):
+            if total <= target:
+                break
+            victims.append(key)
+            total -= size
+        self._delete_keys(conn, victims)
+
+    @staticmethod
+    def _delete_keys(conn, keys):
+        params = [(key,) for key in keys]
+        conn.executemany('DELETE FROM cache_entries WHERE key = ?', params)
+        conn.executemany('DELETE FROM cache_tags WHERE key = ?', params)
+
+    def delete_tags(self, tags):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            keys = set()
+            for tag in tags:
+                keys.update(row[0] for row in conn.execute('SELECT key FROM cache_tags WHERE tag = ?', (tag,)))
+            self._delete_keys(conn, keys)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return len(keys)
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute('DELETE FROM cache_entries')
+        conn.execute('DELETE FROM cache_tags')
+
+    def stats(self):
+        entries, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries'
+        ).fetchone()
+        return {'entries': entries, 'bytes': size}
+
+
+class SharedCache:
+    """ストアの前にリクエスト内の層を置いたキャッシュ"""
+
+    def __init__(self, store, default_ttl, logger=None):
+        self.store = store
+        self.default_ttl = default_ttl
+        self.logger = logger
+
+    @staticmethod
+    def _local():
+        if not has_request_context():
+            return None
+        local = g.get('_shared_cache')
+        if local is None:
+            local = g._shared_cache = {}
+        return local
+
+    def _warn(self, action, error):
+        # キャッシュの失敗でリクエストを失敗させない
+        if self.logger is not None:
+            self.logger.warning(f'Shared cache {action} failed: {error}')
+
+    def get(self, key, default=None):
+        """値を取得（ない場合は default）"""
+        local = self._local()
+        if local is not None and key in local:
+            return local[key]
+
+        try:
+            blob = self.store.get(f'{CACHE_FORMAT}:{key}', time.time())
+        except (sqlite3.Error, OSError) as e:
+            self._warn('get', e)
+            return default
+        if blob is None:
+            return default
+        try:
+            value = marshal.loads(blob)
+        except (EOFError, ValueError, TypeError):
+            return default
+        if local is not None:
+            local[key] = value
+        return value
+
+    def set(self, key, value, ttl=None, tags=()):
+        """値を保存（ttl 秒後に期限切れ。0 以下は期限なし）"""
+        ttl = self.default_ttl if ttl is None else ttl
+        try:
+            blob = marshal.dumps(value)
+        except ValueError as e:
+            self._warn('serialize', e)
+            return False
+
+        local = self._local()
+        if local is not None:
+            local[key] = value
+        now = time.time()
+        try:
+            self.store.set(f'{CACHE_FORMAT}:{key}', blob, now + ttl if ttl > 0 else None, tags, now)
+        except (sqlite3.Error, OSError) as e:
+            self._warn('set', e)
+            return False
+        return True
+
+    def invalidate_tags(self, *tags):
+        """タグの付いたエントリを削除して件数を返す"""
+        local = self._local()
+        if local is not None:
+            local.clear()
+        try:
+            return self.store.delete_tags(tags)
+        except (sqlite3.Error, OSError) as e:
+            self._warn('invalidate', e)
+            return 0
+
+    def clear(self):
+        local = self._local()
+        if local is not None:
+            local.clear()
+        self.store.clear()
+
+    def stats(self):
+        return self.store.stats()
+
+
+def get_cache():
+    """設定されたキャッシュ（無効・アプリ外の場合は None）"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('cache')
+
+
+def invalidate_tags(*tags):
+    """タグの付いたエントリを削除（キャッシュが無効の場合は何もしない）"""
+    cache = get_cache()
+    if cache is None:
+        return 0
+    return cache.invalidate_tags(*tags)
+
+
+def make_key(*parts):
+    """引数からキャッシュキーを作る（長い場合はハッシュ化）"""
+    text = '\x1f'.join(repr(part) for part in parts)
+    if len(text) > 200:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    return text
+
+
+def _resolve(value, *args, **kwargs):
+    return value(*args, **kwargs) if callable(value) else value
+
+
+def cached(name, ttl=None, tags=(), key=None):
+    """
+    関数の戻り値をキャッシュするデコレーター
+
+    Args:
+        name: キャッシュ名（キーの接頭辞・メトリクスのラベル）
+        ttl: 有効期限（秒、省略時は CACHE_DEFAULT_TTL）
+        tags: タグ、または引数からタグを返す関数
+        key: 引数からキーを返す関数（省略時は全引数）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+            cache_key = f'{name}:' + (key(*args, **kwargs) if key else make_key(args, sorted(kwargs.items())))
+            value = cache.get(cache_key, _MISSING)
+            record_cache(name, value is not _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.set(cache_key, value, ttl, _resolve(tags, *args, **kwargs))
+            return value
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def cached_view(name, ttl=None, tags=(), key=None):
+    """
+    ビューの応答（200 のみ）をキャッシュするデコレーター
+
+    キーはパス・クエリ文字列・選択される Content-Encoding（と key 関数の戻り値）です。
+    キャッシュから返す場合も If-None-Match が一致すれば 304 を返します。
+    """
+    from app.common.responses import choose_encoding
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return view(*args, **kwargs)
+            parts = [request.path, sorted(request.args.items(multi=True)), choose_encoding()]
+            if key is not None:
+                parts.append(key(*args, **kwargs))
+            cache_key = f'{name}:{make_key(*parts)}'
+
+            entry = cache.get(cache_key)
+            record_cache(name, entry is not None)
+            if entry is not None:
+                status, headers, body = entry
+                response = Response(body, status=status, headers=list(headers))
+                return response.make_conditional(request)
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                headers = tuple((header, value) for header, value in response.headers.items()
+                                if header in VIEW_HEADERS)
+                cache.set(cache_key, (200, headers, response.get_data()), ttl,
+                          _resolve(tags, *args, **kwargs))
+            return response
+        return wrapper
+    return decorator
+
+
+def create_cache(config, logger=None):
+    kind = config.get('CACHE_BACKEND', '')
+    max_bytes = config.get('CACHE_MAX_BYTES', 16 * 1024 * 1024)
+    if kind == 'memory':
+        store = MemoryStore(max_bytes)
+    elif kind == 'sqlite':
+        store = SQLiteStore(config['CACHE_DATABASE'], max_bytes, config.get('STAMP_DIR'))
+    else:
+        return None
+    return SharedCache(store, config.get('CACHE_DEFAULT_TTL', 300), logger)
+
+
+def init_cache(app):
+    """共有キャッシュを設定（CACHE_BACKEND が空なら何もしない）"""
+    cache = create_cache(app.config, app.logger)
+    app.extensions['cache'] = cache
+    return cache
@@ -0,0 +1,419 @@
+"""
+データベース接続管理（SQLite）
+
+- 接続はプロセス・スレッドごとに1本を再利用します（fork 後は作り直し）
+- WAL モード、synchronous=NORMAL、busy_timeout を設定します
+- SQL は固定文字列 + パラメータで渡すことで、sqlite3 のステートメントキャッシュが再利用されます
+- スキーマは PRAGMA user_version によるマイグレーションで作成・更新します
+  （更新済みはスタンプファイルに記録し、CGI の各プロセスで確認し直さない）
+- 接続の execute / executemany の回数と時間をスレッドごとに集計します（メトリクス用）
+"""
+import calendar
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+
+from app.common.stamps import file_identity, is_stamped, write_stamp
+from app.common.warmup import register_after_fork
+
+DEFAULT_DATABASE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'data',
+    'study.db'
+)
+
+# ロック待ちの上限（ミリ秒）
+BUSY_TIMEOUT_MS = 5000
+
+# 接続ごとにキャッシュするプリペアドステートメント数
+CACHED_STATEMENTS = 128
+
+# スキーマの更新済みを記録するスタンプの名前（STAMP_DIR/sqlite-schema.stamp）
+SCHEMA_STAMP = 'sqlite-schema'
+
+# 移行前の quiz_sessions の列（古いスキーマにない列は NULL として扱う）
+_LEGACY_SESSION_COLUMNS = (
+    'id', 'app_type', 'levels', 'mode', 'status',
+    'correct_count', 'total_count', 'created_at', 'completed_at',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _compact_quiz_sessions(conn):
+    """
+    quiz_sessions をコンパクトな形式に変換
+
+    - id: UUID 文字列（36バイト）-> 16バイトの BLOB（WITHOUT ROWID の主キー）
+    - levels: JSON 配列 -> 9ビットのマスク（段 n をビット n-1）
+    - app_type / mode / status: 文字列 -> 整数コード（app.kuku.models の定義と同じ）
+    - created_at / completed_at: 文字列 -> UNIX 秒（UTC）
+    """
+    app_types = {'kuku': 1, 'shisoku': 2, 'tankanji': 3}
+    modes = {'sequential': 0, 'random': 1}
+    statuses = {'active': 0, 'completed': 1}
+
+    def to_epoch(value):
+        if not value:
+            return None
+        return calendar.timegm(time.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S'))
+
+    def convert(row):
+        mask = 0
+        for level in json.loads(row['levels']):
+            mask |= 1 << (int(level) - 1)
+        if not mask or mask >> 9:
+            raise ValueError('levels out of range')
+        return (
+            uuid.UUID(str(row['id'])).bytes,
+            app_types.get(row['app_type'], 0),
+            mask,
+            modes.get(row['mode'], 0),
+            statuses.get(row['status'], 0),
+            row['correct_count'] or 0,
+            row['total_count'] or 0,
+            to_epoch(row['created_at']) or 0,
+            to_epoch(row['completed_at']),
+        )
+
+    conn.execute("""
+        CREATE TABLE quiz_sessions_compact (
+            id BLOB PRIMARY KEY,
+            app_type INTEGER NOT NULL,
+            levels INTEGER NOT NULL,
+            mode INTEGER NOT NULL,
+            status INTEGER NOT NULL DEFAULT 0,
+            correct_count INTEGER NOT NULL DEFAULT 0,
+            total_count INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER NOT NULL,
+            completed_at INTEGER
+        ) WITHOUT ROWID
+    """)
+    # 古い環境の表には completed_at などがない場合があるため、ない列は NULL として読む
+    existing = {row['name'] for row in conn.execute('PRAGMA table_info(quiz_sessions)')}
+    columns = ', '.join(
+        column if column in existing else f'NULL AS {column}'
+        for column in _LEGACY_SESSION_COLUMNS
+    )
+    rows = conn.execute(f'SELECT {columns} FROM quiz_sessions')
+    skipped = 0
+    while True:
+        batch = rows.fetchmany(1000)
+        if not batch:
+            break
+        converted = []
+        for row in batch:
+            try:
+                converted.append(convert(row))
+            except (TypeError, ValueError, AttributeError):
+                # id が UUID でない・levels が壊れている行は移行しない
+                skipped += 1
+        conn.executemany(
+            'INSERT OR IGNORE INTO quiz_sessions_compact VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            converted
+        )
+    if skipped:
+        logger.warning(f'Skipped {skipped} malformed quiz_sessions rows during migration')
+    conn.execute('DROP TABLE quiz_sessions')
+    conn.execute('ALTER TABLE quiz_sessions_compact RENAME TO quiz_sessions')
+    conn.execute("""
+        CREATE INDEX idx_quiz_sessions_app_created
+        ON quiz_sessions (app_type, created_at)
+    """)
+    conn.execute("""
+        CREATE INDEX idx_quiz_sessions_status_created
+        ON quiz_sessions (status, created_at)
+    """)
+
+
+# マイグレーション: (バージョン, [SQL または conn を受け取る関数, ...]) を昇順に並べる
+MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS quiz_sessions (
+            id TEXT PRIMARY KEY,
+            app_type TEXT NOT NULL DEFAULT 'kuku',
+            levels TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'active',
+            correct_count INTEGER NOT NULL DEFAULT 0,
+            total_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP
+        )
+        """,
+    ]),
+    (2, [
+        """
+        CREATE TABLE IF NOT EXISTS history_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_id TEXT NOT NULL UNIQUE,
+            user_id TEXT,
+            app_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT,
+            timestamp INTEGER,
+            correct_count INTEGER NOT NULL DEFAULT 0,
+            total_count INTEGER NOT NULL DEFAULT 0,
+            correct_rate INTEGER,
+            time_spent INTEGER NOT NULL DEFAULT 0,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_history_records_app_date
+        ON history_records (app_id, date)
+        """,
+    ]),
+    (3, [
+        """
+        CREATE TABLE IF NOT EXISTS history_daily_rollups (
+            app_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            correct_sum INTEGER NOT NULL DEFAULT 0,
+            total_sum INTEGER NOT NULL DEFAULT 0,
+            best_rate INTEGER NOT NULL DEFAULT 0,
+            time_spent INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (app_id, date)
+        ) WITHOUT ROWID
+        """,
+        # 既存の履歴から集計を作成
+        """
+        INSERT OR REPLACE INTO history_daily_rollups
+        (app_id, date, attempts, correct_sum, total_sum, best_rate, time_spent)
+        SELECT app_id, date, COUNT(*), SUM(correct_count), SUM(total_count),
+               MAX(COALESCE(correct_rate, 0)), SUM(time_spent)
+        FROM history_records
+        GROUP BY app_id, date
+        """,
+    ]),
+    (4, [
+        # 利用者ごとの差分同期（user_id = ? AND id > ?）用
+        """
+        CREATE INDEX IF NOT EXISTS idx_history_records_user_id
+        ON history_records (user_id, id)
+        """,
+    ]),
+    (5, [
+        _compact_quiz_sessions,
+    ]),
+    (6, [
+        # 結果保存時に受け取った正答率と、回答ログ（app.kuku.answers の形式の BLOB）
+        'ALTER TABLE quiz_sessions ADD COLUMN correct_rate INTEGER',
+        'ALTER TABLE quiz_sessions ADD COLUMN answers BLOB',
+    ]),
+]
+
+_local = threading.local()
+_stats = threading.local()
+_initialized = set()
+_init_lock = threading.Lock()
+
+# fork 前の接続は子プロセスで使用も close もしない（親のロック状態を壊さないため保持のみ）
+_inherited = []
+
+
+@register_after_fork
+def _reset_after_fork():
+    global _local
+    _inherited.append(_local)
+    _local = threading.local()
+
+
+class TimedConnection(sqlite3.Connection):
+    """execute / executemany の回数と時間を記録する接続"""
+
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            record_query(time.perf_counter() - start)
+
+
+def record_query(elapsed):
+    """クエリ1回分の時間を集計に加える（MySQL のバックエンドからも呼ぶ）"""
+    _stats.count = getattr(_stats, 'count', 0) + 1
+    _stats.seconds = getattr(_stats, 'seconds', 0.0) + elapsed
+
+
+def query_stats():
+    """現在のスレッドで実行したクエリの (回数, 合計秒数)（差分を取って使う）"""
+    return getattr(_stats, 'count', 0), getattr(_stats, 'seconds', 0.0)
+
+
+def get_database_path():
+    """設定されたデータベースファイルのパス"""
+    if has_app_context():
+        return current_app.config.get('DATABASE', DEFAULT_DATABASE)
+    return DEFAULT_DATABASE
+
+
+def connect(db_path):
+    """新しい接続を作成してチューニング用の PRAGMA を設定"""
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+
+    # isolation_level=None: 暗黙の BEGIN を行わず、transaction() で明示的に制御
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False,
+        factory=TimedConnection
+    )
+    conn.row_factory = sqlite3.Row
+    # 新規作成した DB では削除で空いたページを incremental_vacuum で返却できるようにする
+    # （既存の DB は VACUUM するまで変わらない。manage.py purge-sessions が一度だけ実行）
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+def get_db(db_path=None):
+    """現在のスレッドで再利用する接続を取得"""
+    db_path = db_path or get_database_path()
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connections[db_path] = connect(db_path)
+    return conn
+
+
+def close_db(db_path=None):
+    """現在のスレッドの接続を閉じる"""
+    connections = getattr(_local, 'connections', {})
+    paths = [db_path] if db_path else list(connections)
+    for path in paths:
+        conn = connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+
+def query(sql, params=()):
+    """SELECT を実行して全行を返す"""
+    return get_db().execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    """SELECT を実行して先頭行（なければ None）を返す"""
+    return get_db().execute(sql, params).fetchone()
+
+
+def execute(sql, params=()):
+    """単一の更新文を実行（トランザクション外では即時コミット）"""
+    return get_db().execute(sql, params)
+
+
+def executemany(sql, seq_of_params):
+    """同じ文を複数のパラメータで実行"""
+    return get_db().executemany(sql, seq_of_params)
+
+
+@contextmanager
+def transaction(db_path=None):
+    """
+    書き込みトランザクション（BEGIN IMMEDIATE）
+
+    開始時に書き込みロックを取得するため、読み取りから書き込みへの
+    昇格によるデッドロックが起きません。入れ子の場合は外側に合流します。
+    """
+    conn = get_db(db_path)
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
+
+
+def migrate(conn):
+    """未適用のマイグレーションを適用し、適用後のバージョンを返す"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = conn.execute('PRAGMA user_version').fetchone()[0]
+        for version, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version={int(version)}')
+            current = version
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return current
+
+
+def _schema_stamp_key(db_path):
+    identity = file_identity(db_path)
+    if identity is None:
+        return None
+    return f'{os.path.abspath(db_path)}:{identity}:{MIGRATIONS[-1][0]}'
+
+
+def init_db(app=None, force=False):
+    """
+    スキーマを作成・更新（プロセスごとに一度だけ実行、何度呼んでも安全）
+
+    最新のバージョンへの更新が済んでいることをスタンプファイル（STAMP_DIR）に記録し、
+    同じ DB ファイルであれば以降のプロセスでは接続を開かずに済ませます。
+    force=True（manage.py migrate）の場合はスタンプに関わらず確認します。
+
+    DB が開けない場合はエラーを記録して続行し、次回の呼び出しで再試行します。
+    """
+    if app is None:
+        app = current_app
+    db_path = app.config.get('DATABASE', DEFAULT_DATABASE)
+    stamp_dir = app.config.get('STAMP_DIR')
+
+    with _init_lock:
+        if db_path in _initialized and not force:
+            return True
+        if not force and is_stamped(stamp_dir, SCHEMA_STAMP, _schema_stamp_key(db_path)):
+            _initialized.add(db_path)
+            return True
+        try:
+            latest = MIGRATIONS[-1][0]
+            conn = get_db(db_path)
+            if conn.execute('PRAGMA user_version').fetchone()[0] < latest:
+                version = migrate(conn)
+                app.logger.info(f'Database migrated to version {version}: {db_path}')
+        except (sqlite3.Error, OSError) as e:
+            app.logger.error(f'Database initialization failed: {e}')
+            return False
+        write_stamp(stamp_dir, SCHEMA_STAMP, _schema_stamp_key(db_path))
+        _initialized.add(db_path)
+        return True
@@ -1,46 +1,385 @@
 """
 漢字データローダー - CSVファイルから漢字データを読み込み
+
+CSVを解析した結果は列形式で marshal したバイナリ（data/cache/es_kanji.marshal）に
+保存し、次回以降のプロセスはCSVを解析せずに読み込みます。
+CSVの更新日時・サイズが変わった場合はハッシュを比較し、内容が変わっていれば
+CSVから再構築します。
+
+差分配信（/tankanji/api/kanji-diff）のため、データセットのバージョンごとの
+スナップショットを data/cache/kanji_snapshots/ に保存します。
 """
 import csv
+import hashlib
+import io
+import marshal
 import os
+import sys
+import tempfile
+
+# CSVの列名（JSON出力時のキーとしても使用）
+COLUMNS = ('ID', '学年', '漢字', '画数', '音読み', '訓読み', 'ヒント音読み', 'ヒント訓読み')
+
+# コンパイル済みデータの形式バージョン（形式を変えたら上げる）
+ARTIFACT_FORMAT = 1
+
+# 保持するスナップショットの数（古いものから削除）
+SNAPSHOT_KEEP = 20
+
+
+class KanjiRecord:
+    """
+    漢字1件分のレコード
+
+    ID・学年・画数は整数で保持します。従来の辞書形式との互換のため、
+    record['学年'] のように列名でアクセスするとCSVと同じ文字列を返します。
+    """
+    __slots__ = ('id', 'grade', 'kanji', 'strokes',
+                 'on_reading', 'kun_reading', 'on_hint', 'kun_hint')
+
+    def __init__(self, id, grade, kanji, strokes,
+                 on_reading, kun_reading, on_hint, kun_hint):
+        self.id = id
+        self.grade = grade
+        self.kanji = kanji
+        self.strokes = strokes
+        self.on_reading = on_reading
+        self.kun_reading = kun_reading
+        self.on_hint = on_hint
+        self.kun_hint = kun_hint
+
+    @classmethod
+    def from_row(cls, row):
+        """CSVの1行（列名 -> 文字列）からレコードを生成"""
+        return cls(
+            int(row['ID']),
+            int(row['学年']),
+            row['漢字'],
+            int(row['画数']),
+            row['音読み'],
+            row['訓読み'],
+            row['ヒント音読み'],
+            row['ヒント訓読み'],
+        )
+
+    def values(self):
+        """列順の値（CSVと同じ文字列表現）"""
+        return (
+            str(self.id), str(self.grade), self.kanji, str(self.strokes),
+            self.on_reading, self.kun_reading, self.on_hint, self.kun_hint,
+        )
+
+    def to_dict(self):
+        """従来形式（列名 -> 文字列）の辞書に変換"""
+        return dict(zip(COLUMNS, self.values()))
+
+    def __getitem__(self, key):
+        try:
+            return self.values()[COLUMNS.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f'<KanjiRecord {self.id} {self.kanji}>'
+
+
+class KanjiStore:
+    """
+    漢字レコードと検索用インデックス
+
+    - by_id: ID -> レコード
+    - by_grade: 学年 -> レコードのタプル（CSV順）
+    - by_grade_strokes: (学年, 画数) -> レコードのタプル（CSV順）
+    """
+
+    def __init__(self, records, version=None):
+        self.records = tuple(records)
+        # データセットのバージョン（CSVのハッシュ）
+        self.version = version
+        self.by_id = {}
+        by_grade = {}
+        by_grade_strokes = {}
+
+        for record in self.records:
+            self.by_id[record.id] = record
+            by_grade.setdefault(record.grade, []).append(record)
+            by_grade_strokes.setdefault((record.grade, record.strokes), []).append(record)
+
+        self.by_grade = {grade: tuple(items) for grade, items in by_grade.items()}
+        self.by_grade_strokes = {
+            key: tuple(items) for key, items in by_grade_strokes.items()
+        }
+        self.grades = tuple(sorted(self.by_grade))
+
+        # 学年ごとに存在する画数（昇順）
+        strokes_by_grade = {}
+        for grade, strokes in self.by_grade_strokes:
+            strokes_by_grade.setdefault(grade, []).append(strokes)
+        self.strokes_by_grade = {
+            grade: tuple(sorted(values)) for grade, values in strokes_by_grade.items()
+        }
+
+    def __len__(self):
+        return len(self.records)
 
 
 class KanjiLoader:
     """漢字データをCSVから読み込んで提供するクラス"""
-    _data = None
+    _store = None
+
+    # 直近の読み込み元（'artifact' / 'csv'）
+    last_source = None
+
+    @classmethod
+    def data_dir(cls):
+        return os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            'data'
+        )
+
+    @classmethod
+    def csv_path(cls):
+        """漢字CSVファイルのパス"""
+        return os.path.join(cls.data_dir(), 'es_kanji.csv')
+
+    @classmethod
+    def artifact_path(cls):
+        """コンパイル済みデータのパス"""
+        return os.path.join(cls.data_dir(), 'cache', 'es_kanji.marshal')
+
+    @classmethod
+    def snapshot_dir(cls):
+        """バージョンごとのスナップショットの保存先"""
+        return os.path.join(cls.data_dir(), 'cache', 'kanji_snapshots')
+
+    @classmethod
+    def snapshot_path(cls, version):
+        return os.path.join(cls.snapshot_dir(), f'{version}.marshal')
+
+    @classmethod
+    def save_snapshot(cls, store=None):
+        """
+        データセットのスナップショットを保存（保存済みなら何もしない）
+
+        Returns:
+            bool: 新しく保存した場合は True
+        """
+        store = store or cls.get_store()
+        if not _is_version(store.version) or os.path.exists(cls.snapshot_path(store.version)):
+            return False
+        signature = {'sha1': store.version}
+        _write_artifact(cls.snapshot_path(store.version), signature, _records_to_columns(store.records))
+        _prune_snapshots(cls.snapshot_dir(), SNAPSHOT_KEEP)
+        return True
+
+    @classmethod
+    def load_snapshot(cls, version):
+        """指定バージョンのデータストア（現在のバージョンまたは保存済みのもの、ない場合は None）"""
+        store = cls.get_store()
+        if version == store.version:
+            return store
+        if not _is_version(version):
+            return None
+        artifact = _read_artifact(cls.snapshot_path(version))
+        if artifact is None:
+            return None
+        return _store_from_columns(artifact[1], version)
+
+    @classmethod
+    def parse_csv(cls, text):
+        """CSVテキストを解析してレコードのリストを返す"""
+        reader = csv.DictReader(io.StringIO(text))
+        # キー名から余分な空白を削除
+        return [
+            KanjiRecord.from_row({key.strip(): value for key, value in row.items()})
+            for row in reader
+        ]
+
+    @classmethod
+    def read_csv(cls, csv_path):
+        """CSVファイルを読み込んでレコードのリストを返す"""
+        with open(csv_path, 'rb') as f:
+            return cls.parse_csv(f.read().decode('utf-8-sig'))
+
+    @classmethod
+    def get_store(cls):
+        """インデックス付きのデータストアを取得（初回のみ読み込み）"""
+        if cls._store is None:
+            cls._store = cls._load_store()
+        return cls._store
+
+    @classmethod
+    def source_signature(cls):
+        """CSVの更新日時・サイズ（データを読み込まずに変更を検出する。共有キャッシュのキー用）"""
+        stat = os.stat(cls.csv_path())
+        return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+    @classmethod
+    def version(cls):
+        """データセットのバージョン（CSV内容のハッシュ）"""
+        return cls.get_store().version
+
+    @classmethod
+    def reload(cls):
+        """キャッシュを破棄して読み込み直す"""
+        cls._store = None
+        return cls.get_store()
+
+    @classmethod
+    def _load_store(cls, force=False):
+        csv_path = cls.csv_path()
+        stat = os.stat(csv_path)
+
+        artifact = None if force else _read_artifact(cls.artifact_path())
+        if artifact is not None:
+            signature, columns = artifact
+            if (signature['mtime_ns'], signature['size']) == (stat.st_mtime_ns, stat.st_size):
+                cls.last_source = 'artifact'
+                return _store_from_columns(columns, signature['sha1'])
+
+        with open(csv_path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()
+
+        if artifact is not None and artifact[0]['sha1'] == digest:
+            # 更新日時のみ変わった場合（touch、再アップロード等）は署名だけ更新
+            columns = artifact[1]
+            records = None
+            cls.last_source = 'artifact'
+        else:
+            records = cls.parse_csv(raw.decode('utf-8-sig'))
+            columns = _records_to_columns(records)
+            cls.last_source = 'csv'
+
+        signature = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': digest}
+        try:
+            _write_artifact(cls.artifact_path(), signature, columns)
+            if records is not None or force:
+                cls.save_snapshot(_store_from_columns(columns, digest))
+        except OSError:
+            # 書き込めない環境ではCSVからの読み込みのみで動作
+            if force:
+                raise
+
+        if records is None:
+            return _store_from_columns(columns, digest)
+        return KanjiStore(records, version=digest)
+
+    @classmethod
+    def build_artifact(cls):
+        """CSVからコンパイル済みデータを強制的に再生成"""
+        cls._store = cls._load_store(force=True)
+        return cls._store
 
     @classmethod
     def load(cls):
-        """CSVファイルを読み込んでデータを返す"""
-        if cls._data is None:
-            csv_path = os.path.join(
-                os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
-                'data',
-                'es_kanji.csv'
-            )
-            with open(csv_path, 'r', encoding='utf-8-sig') as f:
-                reader = csv.DictReader(f)
-                # キー名から余分な空白を削除
-                cls._data = [
-                    {key.strip(): value for key, value in row.items()}
-                    for row in reader
-                ]
-        return cls._data
+        """全レコードを返す"""
+        return cls.get_store().records
+
+    @classmethod
+    def get_by_id(cls, kanji_id):
+        """IDで漢字データを取得（存在しない場合は None）"""
+        return cls.get_store().by_id.get(int(kanji_id))
 
     @classmethod
     def get_by_grade(cls, grade):
         """学年別に漢字データを取得"""
-        data = cls.load()
-        return [item for item in data if item['学年'] == str(grade)]
+        return list(cls.get_store().by_grade.get(int(grade), ()))
+
+    @classmethod
+    def get_by_grade_and_strokes(cls, grade, strokes):
+        """学年・画数を指定して漢字データを取得"""
+        return list(cls.get_store().by_grade_strokes.get((int(grade), int(strokes)), ()))
 
     @classmethod
     def sort_by_strokes(cls, kanji_list):
         """画数でソート"""
-        return sorted(kanji_list, key=lambda x: int(x['画数']))
+        return sorted(kanji_list, key=_stroke_count)
 
     @classmethod
     def get_all_grades(cls):
         """利用可能な全学年を取得"""
-        data = cls.load()
-        grades = sorted(set(int(item['学年']) for item in data))
-        return grades
+        return list(cls.get_store().grades)
+
+
+def _records_to_columns(records):
+    """レコードのリストを列ごとのタプルに変換"""
+    if not records:
+        return tuple(() for _ in KanjiRecord.__slots__)
+    return tuple(
+        tuple(getattr(record, name) for record in records)
+        for name in KanjiRecord.__slots__
+    )
+
+
+def _store_from_columns(columns, version):
+    return KanjiStore(
+        [KanjiRecord(*values) for values in zip(*columns)],
+        version=version
+    )
+
+
+def _artifact_header():
+    # marshal の形式は Python のバージョンごとに異なる
+    return (ARTIFACT_FORMAT, marshal.version, sys.version_info[:2])
+
+
+def _read_artifact(path):
+    """コンパイル済みデータを読み込む（存在しない・形式不一致は None）"""
+    try:
+        with open(path, 'rb') as f:
+            header, signature, columns = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if tuple(header) != _artifact_header():
+        return None
+    return signature, columns
+
+
+def _write_artifact(path, signature, columns):
+    """コンパイル済みデータを書き出す（一時ファイル経由で置き換え）"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.es_kanji.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(marshal.dumps((_artifact_header(), signature, columns)))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _is_version(version):
+    """バージョン（SHA-1 の16進文字列）の形式か（ファイル名に使うため検証する）"""
+    return isinstance(version, str) and len(version) == 40 and all(c in '0123456789abcdef' for c in version)
+
+
+def _prune_snapshots(directory, keep):
+    """新しいものから keep 件を残してスナップショットを削除"""
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.marshal')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+    except OSError:
+        return
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _stroke_count(item):
+    """レコードまたは従来形式の辞書から画数を取得"""
+    if isinstance(item, KanjiRecord):
+        return item.strokes
+    return int(item['画数'])
@@ -0,0 +1,293 @@
+"""
+ノンブロッキングなログ出力（キュー + バックグラウンドスレッド）
+
+LOG_MODE=queue では、リクエスト処理中のログはキューに積むだけにし、
+ファイルへの書き込み・ローテーションはバックグラウンドのスレッドで行います。
+出力は1行1件の JSON です。
+
+- LOG_SAMPLING で、大量に出る INFO 以下のログをモジュールごとに間引けます
+  （例: "app.kuku=0.1,app.rireki.routes=0.5"）
+- 同じファイルに複数プロセス（CGI・serve.py のワーカー）が書き込んでも
+  安全にローテーションできるよう、ロックファイルで排他します
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import has_request_context, request
+
+from app.common.warmup import register_after_fork
+
+try:
+    import fcntl
+except ImportError:  # Windows（開発環境）ではプロセス間の排他なし
+    fcntl = None
+
+# LogRecord の標準属性（これ以外は extra として JSON に含める）
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime',
+}
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 現在のキューリスナー（fork 後・再初期化時に作り直す）
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def parse_sampling(value):
+    """'name=rate,...' を {name: rate} に変換"""
+    rates = {}
+    for item in (value or '').split(','):
+        name, sep, rate = item.strip().partition('=')
+        if not sep:
+            continue
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+def module_name(pathname):
+    """ソースファイルのパスをモジュール名（app.kuku.routes 等）に変換"""
+    path = os.path.abspath(pathname)
+    if not path.startswith(_ROOT_DIR + os.sep):
+        return None
+    path = os.path.splitext(os.path.relpath(path, _ROOT_DIR))[0]
+    return path.replace(os.sep, '.')
+
+
+class SamplingFilter(logging.Filter):
+    """
+    INFO 以下のログをモジュール（またはロガー名）ごとの割合で間引く
+
+    キーは前方一致で、最も長く一致したものを使います。
+    残したログには sample_rate を付けるため、集計時に件数を補正できます。
+    """
+
+    def __init__(self, rates, max_level=logging.INFO):
+        super().__init__()
+        self.rates = rates
+        self.max_level = max_level
+        self._sources = {}
+
+    def _source(self, record):
+        source = self._sources.get(record.pathname)
+        if source is None:
+            source = self._sources[record.pathname] = module_name(record.pathname) or record.name
+        return source
+
+    def rate_for(self, record):
+        best = None
+        for source in (self._source(record), record.name):
+            for key, rate in self.rates.items():
+                if source == key or source.startswith(key + '.'):
+                    if best is None or len(key) > best[0]:
+                        best = (len(key), rate)
+        return 1.0 if best is None else best[1]
+
+    def filter(self, record):
+        if record.levelno > self.max_level or not self.rates:
+            return True
+        rate = self.rate_for(record)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class RequestContextFilter(logging.Filter):
+    """リクエスト処理中のログにメソッドとパスを付ける（キューに積む前に実行）"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1件の JSON に整形"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': module_name(record.pathname) or record.module,
+            'line': record.lineno,
+            'pid': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ProcessSafeRotatingFileHandler(RotatingFileHandler):
+    """
+    複数プロセスから同じファイルに書き込めるローテーション付きハンドラ
+
+    書き込み・ローテーションはロックファイル（<ファイル名>.lock）の flock で排他し、
+    他のプロセスがローテーションした後は新しいファイルを開き直します。
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding='utf-8'):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self._lock_fd = None
+        self._lock_pid = None
+
+    def _acquire_file_lock(self):
+        if fcntl is None:
+            return
+        if self._lock_fd is None or self._lock_pid != os.getpid():
+            # fork 後は親と同じロックを共有しないよう開き直す
+            self._lock_fd = os.open(self.baseFilename + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _release_file_lock(self):
+        if fcntl is not None and self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(self.stream.fileno())
+        if current is None or (current.st_ino, current.st_dev) != (opened.st_ino, opened.st_dev):
+            self.stream.close()
+            self.stream = self._open()
+
+    def emit(self, record):
+        try:
+            self._acquire_file_lock()
+            try:
+                self._reopen_if_rotated()
+                if self.shouldRollover(record):
+                    self.doRollover()
+                logging.FileHandler.emit(self, record)
+            finally:
+                self._release_file_lock()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        if self._lock_fd is not None and self._lock_pid == os.getpid():
+            os.close(self._lock_fd)
+        self._lock_fd = None
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """メッセージを確定させてからキューに積むハンドラ（例外情報は文字列化して保持）"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _stop_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            # キューに残ったログを書き出してから閉じる
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+@register_after_fork
+def _restart_listener_after_fork():
+    """fork 後の子プロセスにはリスナーのスレッドがないため、新しいキューで作り直す"""
+    global _listener
+    listener = _listener
+    if listener is None:
+        return
+    new_queue = queue.Queue(-1)
+    for handler in logging.getLogger(listener.logger_name).handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            handler.queue = new_queue
+    _listener = QueueListener(new_queue, *listener.handlers, respect_handler_level=True)
+    _listener.logger_name = listener.logger_name
+    _listener.settings = listener.settings
+    _listener.start()
+
+
+atexit.register(_stop_listener)
+
+
+def install_queue_logging(logger, filename, level=logging.INFO, sampling=None,
+                          max_bytes=10240000, backup_count=10):
+    """
+    logger にキュー経由の JSON ログ出力を設定
+
+    同じ設定で設定済みの場合（create_app を複数回呼んだ場合など）は何もせず、
+    既存のリスナーを返します。設定が異なる場合は既存のリスナーを停止して作り直します。
+
+    Returns:
+        QueueListener: 開始済みのリスナー（終了時に atexit で停止・書き出し）
+    """
+    global _listener
+    settings = (
+        logger.name, os.path.abspath(filename), level,
+        tuple(sorted((sampling or {}).items())), max_bytes, backup_count,
+    )
+    with _listener_lock:
+        listener = _listener
+        if listener is not None and listener.settings == settings and any(
+            isinstance(handler, NonBlockingQueueHandler) and handler.queue is listener.queue
+            for handler in logger.handlers
+        ):
+            return listener
+    _stop_listener()
+
+    file_handler = ProcessSafeRotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(level)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(sampling))
+    queue_handler.addFilter(RequestContextFilter())
+
+    for handler in list(logger.handlers):
+        if isinstance(handler, (NonBlockingQueueHandler, RotatingFileHandler)):
+            logger.removeHandler(handler)
+            handler.close()
+    logger.addHandler(queue_handler)
+
+    with _listener_lock:
+        _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.logger_name = logger.name
+        _listener.settings = settings
+        _listener.start()
+    return _listener
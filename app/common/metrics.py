@@ -0,0 +1,353 @@
+"""
+リクエストのメトリクス計測と Prometheus 形式での公開
+
+計測する項目:
+- エンドポイントごとのリクエスト数（ステータスコード別）
+- 応答時間・応答サイズのヒストグラム
+- リクエストごとの SQLite クエリ数・時間
+- キャッシュのヒット・ミス（record_cache で記録）
+
+既定（METRICS_BACKEND=memory）はプロセス内で集計します（常駐サーバー向け）。
+CGI など複数プロセスの値を合計する場合は METRICS_BACKEND=sqlite を指定すると、
+カウンターを SQLite（METRICS_DATABASE）に加算します。リクエストごとには書き込まず、
+プロセス内でまとめた値を METRICS_FLUSH_INTERVAL 秒ごと・プロセス終了時に
+1トランザクションで書き込みます（CGI では1プロセスにつき1回）。
+
+/metrics は METRICS_TOKEN を設定した場合のみ公開します（未設定では 404）。
+"""
+import atexit
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+
+from flask import Response, abort, current_app, g, has_request_context, request
+
+from app.common import db
+from app.common.stamps import file_identity, is_stamped, write_stamp
+from app.common.warmup import register_after_fork
+
+# メトリクス名 -> (種類, 説明)
+METRICS = {
+    'study_http_requests_total': ('counter', 'HTTP リクエスト数'),
+    'study_http_request_duration_seconds': ('histogram', '応答時間（秒）'),
+    'study_http_response_size_bytes': ('histogram', '応答本文のサイズ（バイト）'),
+    'study_db_queries_total': ('counter', 'SQLite のクエリ数'),
+    'study_db_query_seconds_total': ('counter', 'SQLite のクエリ時間の合計（秒）'),
+    'study_cache_requests_total': ('counter', 'キャッシュの参照数（hit / miss）'),
+}
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# 計測対象外のエンドポイント
+EXCLUDED_ENDPOINTS = ('metrics',)
+
+
+def format_labels(labels):
+    """ラベルを Prometheus の表記（name="value",...）に変換"""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return ','.join(parts)
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class MemoryBackend:
+    """プロセス内で集計（常駐サーバーの単一プロセス・開発用）"""
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add_many(self, samples):
+        with self._lock:
+            for key, value in samples:
+                self._samples[key] = self._samples.get(key, 0) + value
+
+    def collect(self):
+        with self._lock:
+            return list(self._samples.items())
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class SQLiteBackend:
+    """
+    SQLite ファイルで集計（複数プロセス・CGI 用）
+
+    加算はプロセス内にためておき、flush_interval 秒ごと・プロセス終了時に
+    まとめて書き込みます（リクエストごとに書き込みロックを取らないため）。
+    メトリクスは失っても困らないため synchronous=OFF で書き込みます。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metric_samples (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, labels)
+        ) WITHOUT ROWID
+    """
+
+    # スキーマの作成済みを記録するスタンプ（STAMP_DIR/<STAMP>.stamp）
+    STAMP = 'metrics-schema'
+    SCHEMA_HASH = hashlib.sha1(SCHEMA.encode('utf-8')).hexdigest()[:12]
+
+    def __init__(self, path, flush_interval=10.0, stamp_dir=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stamp_dir = stamp_dir
+        self._local = threading.local()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # fork 前にためた値を子プロセスで重ねて書き込まない
+        register_after_fork(self._discard_pending)
+        atexit.register(self._flush_at_exit)
+
+    def _stamp_key(self):
+        identity = file_identity(self.path)
+        if identity is None:
+            return None
+        return f'{os.path.abspath(self.path)}:{identity}:{self.SCHEMA_HASH}'
+
+    def _connect(self):
+        # fork 後は親の接続を使わずに作り直す
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        stamped = is_stamped(self.stamp_dir, self.STAMP, self._stamp_key())
+        conn = sqlite3.connect(self.path, timeout=db.BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute('PRAGMA synchronous=OFF')
+        if not stamped:
+            # WAL はファイルに記録されるため、スキーマと合わせて最初の1回だけ設定する
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(self.SCHEMA)
+            write_stamp(self.stamp_dir, self.STAMP, self._stamp_key())
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def add_many(self, samples):
+        with self._pending_lock:
+            for key, value in samples:
+                self._pending[key] = self._pending.get(key, 0) + value
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """ためた値を1トランザクションで書き込む（失敗した場合は次回に持ち越す）"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self._write(pending.items())
+        except BaseException:
+            with self._pending_lock:
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + value
+            raise
+
+    def _discard_pending(self):
+        with self._pending_lock:
+            self._pending = {}
+            self._last_flush = time.monotonic()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except (sqlite3.Error, OSError):
+            pass
+
+    def _write(self, samples):
+        rows = [(name, format_labels(labels), value) for (name, labels), value in samples]
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO metric_samples (name, labels) VALUES (?, ?)',
+                [row[:2] for row in rows]
+            )
+            conn.executemany(
+                'UPDATE metric_samples SET value = value + ? WHERE name = ? AND labels = ?',
+                [(value, name, labels) for name, labels, value in rows]
+            )
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def collect(self):
+        self.flush()
+        rows = self._connect().execute('SELECT name, labels, value FROM metric_samples')
+        return [((name, labels), value) for name, labels, value in rows]
+
+    def reset(self):
+        self._discard_pending()
+        self._connect().execute('DELETE FROM metric_samples')
+
+
+class RequestMetrics:
+    """1リクエスト分の計測値（応答時にまとめてバックエンドへ書き込む）"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(labels))
+        self.samples[key] = self.samples.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        labels = tuple(labels)
+        for bound in buckets:
+            if value <= bound:
+                self.inc(f'{name}_bucket', labels + (('le', format_value(bound)),))
+        self.inc(f'{name}_bucket', labels + (('le', '+Inf'),))
+        self.inc(f'{name}_sum', labels, value)
+        self.inc(f'{name}_count', labels)
+
+
+def get_backend(app=None):
+    """設定されたバックエンド（無効の場合は None）"""
+    app = app or current_app
+    return app.extensions.get('metrics')
+
+
+def create_backend(config):
+    kind = config.get('METRICS_BACKEND', '')
+    if kind == 'memory':
+        return MemoryBackend()
+    if kind == 'sqlite':
+        return SQLiteBackend(config['METRICS_DATABASE'], config.get('METRICS_FLUSH_INTERVAL', 10.0),
+                             config.get('STAMP_DIR'))
+    return None
+
+
+def flush_metrics(app=None):
+    """ためた計測値を書き込む（常駐サーバーのワーカー終了時など。SQLite 以外は何もしない）"""
+    backend = get_backend(app)
+    if isinstance(backend, SQLiteBackend):
+        backend.flush()
+
+
+def record_cache(name, hit):
+    """キャッシュのヒット・ミスを記録（リクエスト処理中のみ）"""
+    if not has_request_context():
+        return
+    current = g.get('_metrics')
+    if current is not None:
+        current.inc('study_cache_requests_total', (('cache', name), ('result', 'hit' if hit else 'miss')))
+
+
+def _before_request():
+    g._metrics = RequestMetrics()
+    g._metrics_start = time.perf_counter()
+    g._metrics_queries = db.query_stats()
+
+
+def _after_request(response):
+    current = g.pop('_metrics', None)
+    if current is None or request.endpoint in EXCLUDED_ENDPOINTS:
+        return response
+
+    elapsed = time.perf_counter() - g._metrics_start
+    count, seconds = db.query_stats()
+    start_count, start_seconds = g._metrics_queries
+
+    labels = (
+        ('blueprint', request.blueprint or 'app'),
+        ('endpoint', request.endpoint or 'unmatched'),
+    )
+    current.inc('study_http_requests_total', labels + (
+        ('method', request.method), ('status', str(response.status_code))
+    ))
+    current.observe('study_http_request_duration_seconds', labels, elapsed, DURATION_BUCKETS)
+    # ストリーミング応答は長さが不明のため記録しない
+    if response.content_length is not None:
+        current.observe('study_http_response_size_bytes', labels, response.content_length, SIZE_BUCKETS)
+    current.inc('study_db_queries_total', labels, count - start_count)
+    current.inc('study_db_query_seconds_total', labels, seconds - start_seconds)
+
+    try:
+        get_backend().add_many(current.samples.items())
+    except (sqlite3.Error, OSError) as e:
+        # 計測の失敗で応答を失敗させない
+        current_app.logger.warning(f'Failed to record metrics: {e}')
+    return response
+
+
+def render_metrics(samples):
+    """サンプルを Prometheus テキスト形式に変換"""
+    grouped = {}
+    for (name, labels), value in samples:
+        if not isinstance(labels, str):
+            labels = format_labels(labels)
+        grouped.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for base, (kind, help_text) in METRICS.items():
+        names = [base] if kind == 'counter' else [f'{base}_bucket', f'{base}_sum', f'{base}_count']
+        if not any(name in grouped for name in names):
+            continue
+        lines.append(f'# HELP {base} {help_text}')
+        lines.append(f'# TYPE {base} {kind}')
+        for name in names:
+            for labels, value in sorted(grouped.get(name, ()), key=_sample_order):
+                lines.append(f'{name}{{{labels}}} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _sample_order(sample):
+    """ヒストグラムのバケットを le の昇順に並べる"""
+    labels = sample[0]
+    prefix, sep, le = labels.rpartition('le="')
+    if not sep:
+        return labels, 0
+    le = le.rstrip('"')
+    return prefix, float('inf') if le == '+Inf' else float(le)
+
+
+def metrics_view():
+    """/metrics: Prometheus 形式で出力（METRICS_TOKEN の Bearer 認証。未設定の場合は 404）"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '')
+    supplied = supplied[len('Bearer '):] if supplied.startswith('Bearer ') else request.args.get('token', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+    backend = get_backend()
+    body = render_metrics(backend.collect()) if backend is not None else ''
+    response = Response(body, mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def init_metrics(app):
+    """計測フックと /metrics エンドポイントを登録（METRICS_BACKEND が空なら何もしない）"""
+    backend = create_backend(app.config)
+    if backend is None:
+        return None
+
+    app.extensions['metrics'] = backend
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    return backend
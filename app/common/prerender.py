@@ -0,0 +1,184 @@
+"""
+静的なページの事前レンダリング
+
+ポータル画面・各アプリのメイン画面はリクエストによって内容が変わらないため、
+manage.py prerender でアプリを通してレンダリングした HTML を
+prerendered/<パス>/index.html に書き出します。
+.htaccess のルールでファイルがあれば Apache が直接返すため、CGI（Python）は起動しません。
+
+テンプレート・ポータルのアプリ一覧・ビルド済みアセットの更新日時とサイズから
+作った署名を prerendered/manifest.json に保存します。署名が変わった場合は、デプロイの手順で
+実行する manage.py の migrate・build-assets・build-templates が書き出し直します
+（manage.py prerender --check で確認できます）。署名の計算は全テンプレートを stat するため、
+CGI の起動時の確認（PRERENDER_AUTO=1）は既定では行いません。
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows（開発環境）ではプロセス間の排他なし
+    fcntl = None
+
+# 事前レンダリングするエンドポイント（引数なしで内容が決まるもののみ）
+PRERENDER_ENDPOINTS = ('portal.index', 'kuku.index', 'shisoku.index', 'tankanji.index')
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.lock'
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 署名の対象（app/ からの相対パス。ディレクトリは配下の全ファイル）
+SOURCE_PATHS = (
+    'templates',
+    os.path.join('portal', 'logic.py'),
+    os.path.join('static', 'dist', 'manifest.json'),
+)
+
+
+def iter_source_files(app_dir=_APP_DIR):
+    for relative in SOURCE_PATHS:
+        path = os.path.join(app_dir, relative)
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.exists(path):
+            yield path
+
+
+def source_signature(app_dir=_APP_DIR):
+    """書き出しの元になるファイルの署名（パス・更新日時・サイズのハッシュ）"""
+    digest = hashlib.sha1()
+    for path in iter_source_files(app_dir):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        relative = os.path.relpath(path, app_dir).replace(os.sep, '/')
+        digest.update(f'{relative}:{stat.st_mtime_ns}:{stat.st_size}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def output_path(output_dir, url_path):
+    """URL のパス（/kuku/ 等）から書き出し先のファイルのパス"""
+    parts = [part for part in url_path.split('/') if part]
+    return os.path.join(output_dir, *parts, 'index.html')
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, content):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.prerender.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        # Apache が読めるよう、一般のファイルと同じ権限にする
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def prerender(app, output_dir=None, endpoints=PRERENDER_ENDPOINTS):
+    """
+    エンドポイントをアプリを通してレンダリングし、HTML を書き出す
+
+    Returns:
+        dict: 書き出したマニフェスト（{"signature": ..., "pages": {URL のパス: ファイル}}）
+    """
+    output_dir = output_dir or app.config['PRERENDER_DIR']
+    signature = source_signature()
+
+    with app.test_request_context():
+        from flask import url_for
+        paths = [url_for(endpoint) for endpoint in endpoints]
+
+    client = app.test_client()
+    pages = {}
+    for url_path in paths:
+        response = client.get(url_path)
+        if response.status_code != 200 or response.mimetype != 'text/html':
+            raise RuntimeError(f'{url_path}: {response.status_code} {response.mimetype}')
+        path = output_path(output_dir, url_path)
+        _write_atomic(path, response.get_data())
+        pages[url_path] = os.path.relpath(path, output_dir).replace(os.sep, '/')
+
+    # 古いページ（対象から外れたもの）を削除
+    previous = load_manifest(output_dir) or {}
+    for url_path, relative in previous.get('pages', {}).items():
+        if url_path not in pages:
+            try:
+                os.remove(os.path.join(output_dir, relative))
+            except OSError:
+                pass
+
+    manifest = {'signature': signature, 'pages': pages}
+    _write_atomic(
+        os.path.join(output_dir, MANIFEST_NAME),
+        json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8')
+    )
+    return manifest
+
+
+def is_stale(app, output_dir=None):
+    """書き出し済みのページが古いか（一度も書き出していない場合は False）"""
+    manifest = load_manifest(output_dir or app.config['PRERENDER_DIR'])
+    return manifest is not None and manifest.get('signature') != source_signature()
+
+
+def refresh_if_stale(app):
+    """
+    書き出し済みのページが古ければ書き出し直す
+
+    複数のプロセスが同時に起動した場合は、ロックを取れたプロセスだけが書き出します。
+
+    Returns:
+        dict: 書き出した場合はマニフェスト、それ以外は None
+    """
+    output_dir = app.config['PRERENDER_DIR']
+    if not is_stale(app, output_dir):
+        return None
+
+    lock_fd = None
+    try:
+        if fcntl is not None:
+            lock_fd = os.open(os.path.join(output_dir, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            if not is_stale(app, output_dir):
+                return None
+        manifest = prerender(app, output_dir)
+        app.logger.info(f"Prerendered {len(manifest['pages'])} pages -> {output_dir}")
+        return manifest
+    except (OSError, RuntimeError) as e:
+        # 書き出しに失敗しても、CGI で動的にレンダリングできるため起動は続ける
+        app.logger.warning(f'Failed to prerender pages: {e}')
+        return None
+    finally:
+        if lock_fd is not None:
+            os.close(lock_fd)
+
+
+def init_prerender(app):
+    """Blueprint の登録後に呼び出し、書き出し済みのページが古ければ書き出し直す"""
+    if app.config.get('PRERENDER_AUTO') and app.config.get('PRERENDER_DIR'):
+        return refresh_if_stale(app)
+    return None
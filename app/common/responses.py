@@ -0,0 +1,134 @@
+"""
+事前シリアライズ・事前圧縮した応答の配信
+
+内容がデータのバージョンでしか変わらない応答（漢字データ等）を、
+一度だけシリアライズ・圧縮して使い回します。
+ETag による条件付き GET（304）と Accept-Encoding による
+gzip / brotli の選択に対応します。
+"""
+import json
+import zlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # サーバーに brotli がない場合は gzip のみ
+    brotli = None
+
+# 優先順位の高い順
+ENCODINGS = ('br', 'gzip', 'identity') if brotli is not None else ('gzip', 'identity')
+
+# これより小さい本文は圧縮しない
+MIN_COMPRESS_SIZE = 1024
+
+
+def compress(body, encoding):
+    """本文を指定のエンコーディングで圧縮"""
+    if encoding == 'gzip':
+        # wbits=31 で gzip 形式（mtime=0 のため出力は決定的）
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    if encoding == 'br':
+        return brotli.compress(body)
+    return body
+
+
+def iter_gzip(chunks, level=6):
+    """
+    文字列・バイト列のチャンクを逐次 gzip 圧縮して返す（ストリーミング応答用）
+
+    圧縮器の内部状態のみを保持するため、全体の大きさに関係なく
+    メモリ使用量は一定です。
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def dump_json(payload):
+    """コンパクトな UTF-8 JSON バイト列に変換"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class PreparedBody:
+    """一度だけシリアライズし、エンコーディングごとの圧縮結果を保持する応答本文"""
+
+    def __init__(self, body, etag, mimetype='application/json'):
+        self.etag = etag
+        self.mimetype = mimetype
+        self._variants = {'identity': body}
+
+    @classmethod
+    def from_json(cls, payload, etag):
+        return cls(dump_json(payload), etag)
+
+    @property
+    def body(self):
+        return self._variants['identity']
+
+    def variant(self, encoding):
+        """圧縮済みの本文を取得（初回のみ圧縮）"""
+        if encoding not in self._variants:
+            self._variants[encoding] = compress(self.body, encoding)
+        return self._variants[encoding]
+
+
+def etag_for(etag, encoding):
+    """エンコーディングごとの強い ETag（表現ごとに異なる値にする）"""
+    if encoding == 'identity':
+        return etag
+    return f'{etag}-{encoding}'
+
+
+def choose_encoding(body_size=None):
+    """Accept-Encoding から最適なエンコーディングを選択"""
+    if body_size is not None and body_size < MIN_COMPRESS_SIZE:
+        return 'identity'
+    accepted = request.accept_encodings
+    for encoding in ENCODINGS:
+        if encoding == 'identity' or accepted[encoding]:
+            return encoding
+    return 'identity'
+
+
+def _set_cache_headers(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+
+
+def not_modified(etag, cache_control='no-cache'):
+    """
+    If-None-Match が一致すれば 304 応答を返す（不一致なら None）
+
+    本文を組み立てる前に呼び出すことで、304 の場合はシリアライズを省略できます。
+    """
+    if not request.if_none_match:
+        return None
+    for encoding in ENCODINGS:
+        candidate = etag_for(etag, encoding)
+        if request.if_none_match.contains(candidate):
+            response = Response(status=304)
+            _set_cache_headers(response, candidate, cache_control)
+            return response
+    return None
+
+
+def send_prepared(prepared, cache_control='no-cache', status=200):
+    """PreparedBody を条件付き GET・圧縮に対応して返す"""
+    response = not_modified(prepared.etag, cache_control)
+    if response is not None:
+        return response
+
+    encoding = choose_encoding(len(prepared.body))
+    response = Response(prepared.variant(encoding), status=status, mimetype=prepared.mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    _set_cache_headers(response, etag_for(prepared.etag, encoding), cache_control)
+    return response
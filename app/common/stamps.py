@@ -0,0 +1,61 @@
+"""
+起動時のチェックの記録（スタンプファイル）
+
+CGI ではリクエストごとにプロセスが起動するため、スキーマの作成・更新のように
+一度済めば変わらないチェックを毎回行わず、成功したときの条件（スキーマのバージョン・
+DB ファイルの inode など）を STAMP_DIR/<名前>.stamp に記録します。
+次の起動では条件がスタンプと一致すればチェックを省略します。
+
+スタンプを削除する（または manage.py migrate を実行する）と、次の起動でチェックし直します。
+"""
+import os
+import tempfile
+
+
+def file_identity(path):
+    """ファイルの同一性（デバイスと inode）。ファイルがない場合は None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f'{stat.st_dev}:{stat.st_ino}'
+
+
+def _stamp_path(stamp_dir, name):
+    return os.path.join(stamp_dir, f'{name}.stamp')
+
+
+def is_stamped(stamp_dir, name, key):
+    """スタンプの内容が key と一致するか（STAMP_DIR が空の場合は常に False）"""
+    if not stamp_dir or key is None:
+        return False
+    try:
+        with open(_stamp_path(stamp_dir, name), encoding='utf-8') as f:
+            return f.read() == key
+    except OSError:
+        return False
+
+
+def write_stamp(stamp_dir, name, key):
+    """スタンプを書き込む（書き込めない環境では何もしない）"""
+    if not stamp_dir or key is None:
+        return False
+    try:
+        os.makedirs(stamp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=stamp_dir, prefix=f'.{name}.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(key)
+        os.replace(temp_path, _stamp_path(stamp_dir, name))
+    except OSError:
+        return False
+    return True
+
+
+def remove_stamp(stamp_dir, name):
+    """スタンプを削除（次の起動でチェックし直す）"""
+    if not stamp_dir:
+        return
+    try:
+        os.remove(_stamp_path(stamp_dir, name))
+    except OSError:
+        pass
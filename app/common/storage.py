@@ -0,0 +1,582 @@
+"""
+永続化のバックエンド（SQLite / MySQL）
+
+QuizSession・HistoryLogic 等のモデルは get_storage() のバックエンドを通して
+DB にアクセスします。バックエンドは DB_BACKEND で選択します。
+
+- sqlite: app.common.db の接続（スレッドごとに1本、WAL）。書き込みは DB 全体で1つずつ
+- mysql: PyMySQL の接続を上限付きのプールで再利用（InnoDB の行ロックで書き込みが並行できる）
+
+SQL は SQLite の書き方（? / :name のプレースホルダー、INSERT OR IGNORE）で書きます。
+MySQL では PyMySQL の書き方に変換し、変換結果を SQL の文字列ごとにキャッシュします。
+PyMySQL にはサーバー側のプリペアドステートメントがないため、文はパラメータを
+埋め込んだ SQL として毎回送られます（再利用するのは変換結果と接続です）。
+方言で書き方が大きく異なる文は、呼び出し側で dialect ごとに用意してください。
+
+共通のインターフェース:
+    query(sql, params) / query_one(sql, params)   行（列名・位置のどちらでも参照可）
+    iterate(sql, params, size)                     行を size 件ずつ読み込みながら列挙（結果をすべては保持しない）
+    execute(sql, params) / executemany(sql, seq)   変更した行数
+    transaction()                                  execute / executemany を持つ接続（入れ子は外側に合流）
+    reclaim_space()                                削除で空いた領域の返却（SQLite のみ）
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+
+from app.common import db
+from app.common.stamps import is_stamped, write_stamp
+
+try:
+    import pymysql
+    import pymysql.cursors
+except ImportError:  # DB_BACKEND=mysql の場合のみ必要
+    pymysql = None
+
+STORAGE_BACKENDS = ('sqlite', 'mysql')
+
+# MySQL 用に変換した SQL をキャッシュする件数
+STATEMENT_CACHE_SIZE = 256
+
+# iterate() で一度に読み込む行数の既定値
+ITERATE_BATCH_SIZE = 500
+
+# スキーマの作成・更新済みを記録するスタンプの名前（STAMP_DIR/mysql-schema.stamp）
+MYSQL_SCHEMA_STAMP = 'mysql-schema'
+
+
+class IntegrityError(Exception):
+    """一意制約違反等（バックエンドの例外を変換したもの）"""
+
+
+class PoolTimeout(Exception):
+    """プールの接続がすべて使用中のまま待ち時間を超えた"""
+
+
+# ---------------------------------------------------------------------------
+# SQLite
+# ---------------------------------------------------------------------------
+
+class SQLiteBackend:
+    """app.common.db の接続をそのまま使うバックエンド（DATABASE はリクエストごとに設定から解決）"""
+
+    dialect = 'sqlite'
+
+    def init(self, app, force=False):
+        return db.init_db(app, force)
+
+    def query(self, sql, params=()):
+        return db.query(sql, params)
+
+    def query_one(self, sql, params=()):
+        return db.query_one(sql, params)
+
+    def iterate(self, sql, params=(), size=ITERATE_BATCH_SIZE):
+        cursor = db.get_db().execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def execute(self, sql, params=()):
+        try:
+            return db.execute(sql, params).rowcount
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+
+    def executemany(self, sql, seq_of_params):
+        try:
+            return db.executemany(sql, seq_of_params).rowcount
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+
+    @contextmanager
+    def transaction(self):
+        try:
+            with db.transaction() as conn:
+                yield conn
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+
+    def reclaim_space(self):
+        # execute() では1ページずつしか返却されないため executescript で最後まで実行
+        db.get_db().executescript('PRAGMA incremental_vacuum;')
+
+    def stats(self):
+        return {'backend': self.dialect, 'database': db.get_database_path()}
+
+
+# ---------------------------------------------------------------------------
+# MySQL
+# ---------------------------------------------------------------------------
+
+# 文字列リテラル・? ・:name（:: は対象外）
+_PARAM_RE = re.compile(r"'(?:[^']|'')*'|\?|(?<![:\w]):([A-Za-z_]\w*)")
+
+
+@functools.lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def translate_sql(sql):
+    """SQLite の書き方の SQL を PyMySQL の書き方（%s / %(name)s）に変換"""
+    sql = sql.replace('%', '%%')
+    sql = re.sub(r'\bINSERT\s+OR\s+IGNORE\b', 'INSERT IGNORE', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bINSERT\s+OR\s+REPLACE\b', 'REPLACE', sql, flags=re.IGNORECASE)
+
+    def replace(match):
+        text = match.group(0)
+        if text.startswith("'"):
+            return text
+        if text == '?':
+            return '%s'
+        return f'%({match.group(1)})s'
+    return _PARAM_RE.sub(replace, sql)
+
+
+class Row:
+    """列名・位置のどちらでも参照できる行（sqlite3.Row と同じ使い方）"""
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._index)
+
+
+class MySQLCursor:
+    """
+    PyMySQL のカーソル（結果は取得済み）の行を Row に変換して返す
+
+    接続はプールにすぐ返却するため、query / execute の結果は取得しておきます。
+    大量の行は MySQLBackend.iterate（SSCursor で少しずつ読み込む）を使ってください。
+    """
+
+    def __init__(self, cursor):
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+        description = cursor.description or ()
+        self._index = {column[0]: i for i, column in enumerate(description)}
+        self._rows = deque(cursor.fetchall() or ()) if description else deque()
+
+    def fetchone(self):
+        return Row(self._rows.popleft(), self._index) if self._rows else None
+
+    def fetchall(self):
+        rows = [Row(values, self._index) for values in self._rows]
+        self._rows.clear()
+        return rows
+
+    def __iter__(self):
+        while self._rows:
+            yield Row(self._rows.popleft(), self._index)
+
+
+class MySQLConnection:
+    """プールから取り出した接続（SQL を変換して実行）"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.in_transaction = False
+
+    def _run(self, method, sql, params):
+        start = time.perf_counter()
+        cursor = self.raw.cursor()
+        try:
+            getattr(cursor, method)(translate_sql(sql), params)
+            return MySQLCursor(cursor)
+        except pymysql.err.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+        finally:
+            cursor.close()
+            db.record_query(time.perf_counter() - start)
+
+    def execute(self, sql, params=()):
+        # 引数なしでも % の変換を行うため、常にタプル・辞書を渡す
+        return self._run('execute', sql, params if params is not None else ())
+
+    def executemany(self, sql, seq_of_params):
+        # INSERT ... VALUES は PyMySQL が複数行の INSERT 1文にまとめて送る
+        seq_of_params = list(seq_of_params)
+        if not seq_of_params:
+            return None
+        return self._run('executemany', sql, seq_of_params)
+
+
+class _PoolEntry:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    上限付きのコネクションプール
+
+    - 同時に使う接続は size 本まで。すべて使用中なら timeout 秒まで返却を待つ
+    - 取り出すとき、ping_interval 秒以上使っていない接続は ping で死活を確認し、
+      recycle 秒以上前に作った接続は作り直す（MySQL の wait_timeout 対策）
+    - 最後に使った接続から再利用する（使われない接続は wait_timeout で自然に切れる）
+    - fork 後の子プロセスでは親の接続を使わず、close もせずに手放す
+    """
+
+    def __init__(self, connect, size=5, timeout=10, ping_interval=30, recycle=3600):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.recycle = recycle
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._idle = []
+            self._created = 0
+            self._pid = os.getpid()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self._check_fork()
+            while not self._idle and self._created >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f'All {self.size} connections are in use')
+                self._cond.wait(remaining)
+            entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                self._created += 1
+
+        if entry is not None and self._healthy(entry):
+            return entry
+        if entry is not None:
+            self._close(entry)
+        try:
+            return _PoolEntry(self._connect())
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _healthy(self, entry):
+        now = time.monotonic()
+        if now - entry.created_at >= self.recycle:
+            return False
+        if now - entry.last_used >= self.ping_interval:
+            try:
+                entry.conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    @staticmethod
+    def _close(entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def release(self, entry, discard=False):
+        """接続を返却（エラーで状態が分からない接続は discard=True で破棄）"""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if discard:
+                self._created -= 1
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+            self._cond.notify()
+        if discard:
+            self._close(entry)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for entry in idle:
+            self._close(entry)
+
+    def stats(self):
+        with self._cond:
+            return {'size': self.size, 'open': self._created, 'idle': len(self._idle)}
+
+
+# MySQL のスキーマ: (バージョン, [SQL, ...]) を昇順に並べる（SQLite の db.MIGRATIONS 6 と同じ内容）
+MYSQL_MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS quiz_sessions (
+            id BINARY(16) NOT NULL PRIMARY KEY,
+            app_type TINYINT NOT NULL,
+            levels SMALLINT NOT NULL,
+            mode TINYINT NOT NULL,
+            status TINYINT NOT NULL DEFAULT 0,
+            correct_count INT NOT NULL DEFAULT 0,
+            total_count INT NOT NULL DEFAULT 0,
+            correct_rate INT NULL,
+            answers BLOB NULL,
+            created_at BIGINT NOT NULL,
+            completed_at BIGINT NULL,
+            INDEX idx_quiz_sessions_app_created (app_type, created_at),
+            INDEX idx_quiz_sessions_status_created (status, created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS history_records (
+            id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            record_id VARCHAR(191) NOT NULL,
+            user_id VARCHAR(191) NULL,
+            app_id VARCHAR(32) NOT NULL,
+            date CHAR(10) NOT NULL,
+            time VARCHAR(16) NULL,
+            timestamp BIGINT NULL,
+            correct_count INT NOT NULL DEFAULT 0,
+            total_count INT NOT NULL DEFAULT 0,
+            correct_rate INT NULL,
+            time_spent INT NOT NULL DEFAULT 0,
+            payload MEDIUMTEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_history_records_record_id (record_id),
+            INDEX idx_history_records_app_date (app_id, date),
+            INDEX idx_history_records_user_id (user_id, id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS history_daily_rollups (
+            app_id VARCHAR(32) NOT NULL,
+            date CHAR(10) NOT NULL,
+            attempts INT NOT NULL DEFAULT 0,
+            correct_sum INT NOT NULL DEFAULT 0,
+            total_sum INT NOT NULL DEFAULT 0,
+            best_rate INT NOT NULL DEFAULT 0,
+            time_spent INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (app_id, date)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+]
+
+# 複数プロセスが同時に起動した場合にスキーマの作成を1つずつ行うためのロック名
+MIGRATION_LOCK = 'study_schema_migration'
+
+
+class MySQLBackend:
+    """PyMySQL の接続をプールで再利用するバックエンド"""
+
+    dialect = 'mysql'
+
+    def __init__(self, pool, stamp_dir=None, location=None):
+        self.pool = pool
+        self.stamp_dir = stamp_dir
+        # スタンプに記録する接続先（ホスト・ポート・DB 名）
+        self.location = location
+        self._local = threading.local()
+
+    def _stamp_key(self):
+        if self.location is None:
+            return None
+        return f'{self.location}:{MYSQL_MIGRATIONS[-1][0]}'
+
+    @contextmanager
+    def _connection(self):
+        # トランザクション中はその接続を使う
+        current = getattr(self._local, 'conn', None)
+        if current is not None:
+            yield current
+            return
+        entry = self.pool.acquire()
+        discard = False
+        try:
+            yield MySQLConnection(entry.conn)
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.pool.release(entry, discard)
+
+    def init(self, app, force=False):
+        """
+        スキーマを作成・更新（何度呼んでも安全）
+
+        最新のバージョンへの更新済みを接続先ごとにスタンプファイルに記録し、
+        一致すれば接続しません（CGI の各プロセスで GET_LOCK・schema_version の確認をしない）。
+        force=True（manage.py migrate）の場合はスタンプに関わらず確認します。
+        """
+        if not force and is_stamped(self.stamp_dir, MYSQL_SCHEMA_STAMP, self._stamp_key()):
+            return True
+        try:
+            with self._connection() as conn:
+                conn.execute('SELECT GET_LOCK(?, 30)', (MIGRATION_LOCK,))
+                try:
+                    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)')
+                    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+                    current = row[0] or 0
+                    for version, statements in MYSQL_MIGRATIONS:
+                        if version <= current:
+                            continue
+                        # MySQL の DDL は暗黙にコミットされるため、各文は何度実行しても安全に書く
+                        for statement in statements:
+                            conn.execute(statement)
+                        conn.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+                        app.logger.info(f'MySQL schema migrated to version {version}')
+                finally:
+                    conn.execute('SELECT RELEASE_LOCK(?)', (MIGRATION_LOCK,))
+        except (pymysql.err.MySQLError, PoolTimeout) as e:
+            app.logger.error(f'Database initialization failed: {e}')
+            return False
+        write_stamp(self.stamp_dir, MYSQL_SCHEMA_STAMP, self._stamp_key())
+        return True
+
+    def query(self, sql, params=()):
+        with self._connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with self._connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def iterate(self, sql, params=(), size=ITERATE_BATCH_SIZE):
+        """
+        SSCursor（結果をサーバーから少しずつ受け取る）で size 件ずつ読み込みながら列挙
+
+        列挙を終えるか、ジェネレーターを閉じるまで接続を使用します。
+        """
+        with self._connection() as conn:
+            start = time.perf_counter()
+            cursor = conn.raw.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(translate_sql(sql), params if params is not None else ())
+                db.record_query(time.perf_counter() - start)
+                index = {column[0]: i for i, column in enumerate(cursor.description or ())}
+                while True:
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        return
+                    for values in rows:
+                        yield Row(values, index)
+            finally:
+                # 読み残した行は close で読み捨てられ、接続は次の文を実行できる状態に戻る
+                cursor.close()
+
+    def execute(self, sql, params=()):
+        with self._connection() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def executemany(self, sql, seq_of_params):
+        with self._connection() as conn:
+            cursor = conn.executemany(sql, seq_of_params)
+            return cursor.rowcount if cursor else 0
+
+    @contextmanager
+    def transaction(self):
+        if getattr(self._local, 'conn', None) is not None:
+            yield self._local.conn
+            return
+        with self._connection() as conn:
+            conn.raw.begin()
+            conn.in_transaction = True
+            self._local.conn = conn
+            try:
+                yield conn
+            except BaseException:
+                try:
+                    conn.raw.rollback()
+                finally:
+                    self._local.conn = None
+                raise
+            else:
+                self._local.conn = None
+                conn.raw.commit()
+
+    def reclaim_space(self):
+        # InnoDB は削除した領域をテーブル内で再利用する
+        pass
+
+    def stats(self):
+        stats = {'backend': self.dialect}
+        stats.update(self.pool.stats())
+        return stats
+
+
+def mysql_connector(config):
+    """設定から PyMySQL の接続を作る関数"""
+    if pymysql is None:
+        raise RuntimeError('DB_BACKEND=mysql には PyMySQL が必要です')
+    options = {
+        'host': config.get('MYSQL_HOST', 'localhost'),
+        'port': int(config.get('MYSQL_PORT', 3306)),
+        'user': config.get('MYSQL_USER', ''),
+        'password': config.get('MYSQL_PASSWORD', ''),
+        'database': config.get('MYSQL_DATABASE', ''),
+        'charset': 'utf8mb4',
+        # 暗黙のトランザクションを使わず、transaction() で明示的に制御
+        'autocommit': True,
+        'connect_timeout': int(config.get('DB_CONNECT_TIMEOUT', 5)),
+    }
+    return lambda: pymysql.connect(**options)
+
+
+def create_storage(config):
+    kind = config.get('DB_BACKEND', 'sqlite')
+    if kind == 'sqlite':
+        return SQLiteBackend()
+    if kind == 'mysql':
+        pool = ConnectionPool(
+            mysql_connector(config),
+            size=int(config.get('DB_POOL_SIZE', 5)),
+            timeout=float(config.get('DB_POOL_TIMEOUT', 10)),
+            ping_interval=float(config.get('DB_POOL_PING_INTERVAL', 30)),
+            recycle=float(config.get('DB_POOL_RECYCLE', 3600)),
+        )
+        location = (f"{config.get('MYSQL_HOST', 'localhost')}:{config.get('MYSQL_PORT', 3306)}"
+                    f"/{config.get('MYSQL_DATABASE', '')}")
+        return MySQLBackend(pool, config.get('STAMP_DIR'), location)
+    raise RuntimeError(f'Unknown DB_BACKEND: {kind}')
+
+
+_default = SQLiteBackend()
+
+
+def get_storage():
+    """設定されたバックエンド（アプリ外・未設定の場合は SQLite）"""
+    if has_app_context():
+        storage = current_app.extensions.get('storage')
+        if storage is not None:
+            return storage
+    return _default
+
+
+def init_storage(app):
+    """バックエンドを設定し、スキーマを作成・更新"""
+    storage = create_storage(app.config)
+    app.extensions['storage'] = storage
+    storage.init(app)
+    return storage
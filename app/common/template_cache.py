@@ -0,0 +1,57 @@
+"""
+Jinja2 テンプレートのバイトコードキャッシュ
+
+CGI ではプロセスごとに全テンプレートを字句解析・構文解析・コンパイルします。
+コンパイル結果をディスク上に保存し、全プロセスで共有します。
+キャッシュはテンプレートソースのハッシュで検証されるため、
+テンプレートを更新すると自動的に再コンパイルされます。
+"""
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_template_cache(app):
+    """アプリの Jinja 環境にバイトコードキャッシュを設定"""
+    cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+    if not cache_dir:
+        return None
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        # 書き込めない環境ではキャッシュなしで動作させる
+        app.logger.warning(f'Template cache disabled: {e}')
+        return None
+
+    cache = FileSystemBytecodeCache(cache_dir)
+    app.jinja_env.bytecode_cache = cache
+    return cache
+
+
+def iter_template_names(app):
+    """アプリと全Blueprintのテンプレート名を列挙"""
+    return sorted(
+        name for name in app.jinja_env.list_templates()
+        if name.endswith('.html')
+    )
+
+
+def precompile_templates(app, clear=False):
+    """
+    全テンプレートをコンパイルしてバイトコードキャッシュに書き出す
+
+    Args:
+        clear: True の場合は既存のキャッシュを削除してから再生成
+
+    Returns:
+        list: コンパイルしたテンプレート名
+    """
+    cache = app.jinja_env.bytecode_cache
+    if clear and cache is not None:
+        cache.clear()
+
+    names = iter_template_names(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
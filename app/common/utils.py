@@ -3,44 +3,60 @@
 """
 import logging
 import os
-from logging.handlers import RotatingFileHandler
 
 def init_logger(app):
-    """ログ初期化"""
+    """
+    ログ初期化
+
+    LOG_MODE:
+        queue: キュー経由でバックグラウンドのスレッドが JSON 行を書き込む（既定）
+        file: リクエスト処理中にテキスト形式で直接書き込む（従来の形式）
+    """
     if not app.debug:
-        # logsディレクトリ作成
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        
-        # ロギングハンドラ設定
-        file_handler = RotatingFileHandler(
-            'logs/app.log',
-            maxBytes=10240000,  # 10MB
-            backupCount=10
-        )
-        
-        # フォーマッタ設定
-        formatter = logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+        from app.common.logging_pipeline import (
+            ProcessSafeRotatingFileHandler, install_queue_logging, parse_sampling
         )
-        file_handler.setFormatter(formatter)
-        file_handler.setLevel(logging.INFO)
+
+        level = getattr(logging, str(app.config.get('LOG_LEVEL', 'INFO')).upper(), logging.INFO)
+        log_file = app.config.get('LOG_FILE') or os.path.join('logs', 'app.log')
+        max_bytes = 10240000  # 10MB
+        backup_count = 10
+
+        if app.config.get('LOG_MODE', 'queue') == 'queue':
+            install_queue_logging(
+                app.logger,
+                log_file,
+                level=level,
+                sampling=parse_sampling(app.config.get('LOG_SAMPLING')),
+                max_bytes=max_bytes,
+                backup_count=backup_count
+            )
+        else:
+            # ロギングハンドラ設定（複数プロセスからのローテーションに対応）
+            file_handler = ProcessSafeRotatingFileHandler(
+                log_file,
+                maxBytes=max_bytes,
+                backupCount=backup_count
+            )
+            
+            # フォーマッタ設定
+            formatter = logging.Formatter(
+                '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+            )
+            file_handler.setFormatter(formatter)
+            file_handler.setLevel(level)
+            
+            # ハンドラをアプリケーションに追加
+            app.logger.addHandler(file_handler)
         
-        # ハンドラをアプリケーションに追加
-        app.logger.addHandler(file_handler)
-        app.logger.setLevel(logging.INFO)
+        app.logger.setLevel(level)
         app.logger.info('Application startup')
 
 def get_db_connection():
-    """SQLite接続を取得"""
-    import sqlite3
-    from flask import current_app
-    
-    db_path = current_app.config.get('DATABASE', 'data/study.db')
-    
-    # ディレクトリがなければ作成
-    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    """
+    SQLite接続を取得
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    接続はスレッドごとに再利用されるため、呼び出し側で close しないこと。
+    """
+    from app.common.db import get_db
+    return get_db()
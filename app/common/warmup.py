@@ -0,0 +1,57 @@
+"""
+常駐サーバー用のウォームアップ・fork 安全性ユーティリティ
+
+CGI ではリクエストごとにプロセスが起動するため意味を持ちませんが、
+serve.py による常駐モードでは、マスタープロセスで一度だけ
+キャッシュを温め、fork 後の各ワーカーでプロセス固有の資源
+（DB接続など）を作り直します。
+"""
+import os
+
+# fork 後の子プロセスで実行するフック
+_after_fork_hooks = []
+
+
+def register_after_fork(func):
+    """
+    fork 後に子プロセスで実行する関数を登録（デコレーターとしても使用可）
+
+    DB接続やファイルハンドルなど、親プロセスから引き継ぐと
+    共有されてしまう資源の破棄に使用します。
+    """
+    _after_fork_hooks.append(func)
+    return func
+
+
+def run_after_fork_hooks():
+    """登録済みの fork 後フックを実行"""
+    for func in _after_fork_hooks:
+        func()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Python 3.7+ の POSIX 環境では os.fork() のたびに自動実行
+    os.register_at_fork(after_in_child=run_after_fork_hooks)
+
+
+def warm_up(app):
+    """
+    プロセス共有可能なキャッシュを事前に構築
+
+    fork 前のマスタープロセスで呼び出すことで、漢字データや
+    コンパイル済みテンプレートをコピーオンライトで全ワーカーに共有します。
+    DB はスキーマ作成のみ行い、接続は fork 後に各ワーカーで作り直されます。
+
+    Returns:
+        dict: ウォームアップした項目と件数
+    """
+    from app.common.kanji_loader import KanjiLoader
+    from app.common.template_cache import precompile_templates
+
+    summary = {}
+    summary['database'] = app.extensions['storage'].init(app)
+    summary['kanji'] = len(KanjiLoader.load())
+    summary['templates'] = len(precompile_templates(app))
+
+    app.logger.info(f'Warm-up completed: {summary}')
+    return summary
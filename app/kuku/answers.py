@@ -0,0 +1,244 @@
+"""
+九九練習アプリケーション - 回答ログ
+
+1回のセッションの回答（問題ごとの九九の位置・回答・正誤・回答時間）を
+1つの BLOB にまとめて quiz_sessions.answers に保存します。
+回答ごとに行を作らないため、問題数が増えても行数は増えません。
+
+形式（可変長整数。先頭の1バイトは形式のバージョン）:
+    [FORMAT_VERSION] + 回答ごとに
+        varint((九九の位置 << 1) | 正誤)   九九の位置は engine.FACTS と同じ (段-1)*9 + (かける数-1)
+        varint(回答 + 1)                   0 は無回答
+        varint(zigzag(回答時間 - 前の回答時間))   ミリ秒。前の問題との差分
+
+1問あたり通常3～4バイトです。
+"""
+import time
+
+from app.common.cache import cached
+from app.common.storage import get_storage
+from .engine import FACTS, fact_key, parse_levels
+from .models import ANSWERS_CACHE_TAG, APP_TYPES, STATUSES, decode_levels
+
+FORMAT_VERSION = 1
+
+# 1セッションの回答数の上限（出題エンジンの上限と同じ）
+MAX_ANSWERS = 200
+
+# 回答・回答時間の上限（これを超える値は不正として扱う）
+MAX_ANSWER_VALUE = 9999
+MAX_RESPONSE_MS = 10 * 60 * 1000
+
+# 集計の対象期間（日）
+DEFAULT_STATS_DAYS = 30
+MAX_STATS_DAYS = 3650
+
+# 集計のキャッシュの有効期限（秒）。結果の保存ごとには無効化しない
+FACT_STATS_CACHE_TTL = 600
+
+
+class AnswerLogError(ValueError):
+    """回答ログが不正"""
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise AnswerLogError('Truncated answer log')
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def _int_field(answer, name, default, upper):
+    # null は省略と同じ扱い（既定値がなければ None）
+    value = answer.get(name)
+    if value is None:
+        return default
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= upper:
+        raise AnswerLogError(f'Invalid {name}')
+    return value
+
+
+def normalize_answers(answers):
+    """
+    クライアントの回答リストを (九九の位置, 回答, 正誤, 回答時間) のリストに変換
+
+    Args:
+        answers: [{"multiplicand": 7, "multiplier": 8, "user_answer": 56, "response_ms": 2300}, ...]
+                 （scorer.js の回答履歴と同じ形式。正誤はサーバーで判定し直す）
+    """
+    if not isinstance(answers, list) or len(answers) > MAX_ANSWERS:
+        raise AnswerLogError('Invalid answers')
+    normalized = []
+    for answer in answers:
+        if not isinstance(answer, dict):
+            raise AnswerLogError('Invalid answers')
+        a = _int_field(answer, 'multiplicand', None, 9)
+        b = _int_field(answer, 'multiplier', None, 9)
+        if not a or not b:
+            raise AnswerLogError('Invalid multiplicand or multiplier')
+        value = answer.get('user_answer')
+        if isinstance(value, str):
+            # 入力欄の文字列のまま送られた場合（空欄は無回答）
+            value = int(value) if value.strip().isdigit() else None
+        value = _int_field({'user_answer': value}, 'user_answer', None, MAX_ANSWER_VALUE)
+        response_ms = _int_field(answer, 'response_ms', 0, MAX_RESPONSE_MS)
+        position = (a - 1) * 9 + (b - 1)
+        normalized.append((position, value, value == FACTS[position][2], response_ms))
+    return normalized
+
+
+def encode_answers(answers):
+    """(九九の位置, 回答, 正誤, 回答時間) のリストを BLOB に変換"""
+    out = bytearray([FORMAT_VERSION])
+    previous_ms = 0
+    for position, value, correct, response_ms in answers:
+        _write_varint(out, (position << 1) | (1 if correct else 0))
+        _write_varint(out, 0 if value is None else value + 1)
+        _write_varint(out, _zigzag(response_ms - previous_ms))
+        previous_ms = response_ms
+    return bytes(out)
+
+
+def iter_answers(blob):
+    """BLOB から (九九の位置, 回答, 正誤, 回答時間) を順に取り出す"""
+    data = bytes(blob)
+    if not data or data[0] != FORMAT_VERSION:
+        raise AnswerLogError('Unknown answer log format')
+    pos = 1
+    end = len(data)
+    response_ms = 0
+    while pos < end:
+        # 九九の位置・回答は通常1バイト、回答時間の差分は2バイトのため、関数を呼ばずに読む
+        head = data[pos]
+        if head < 0x80:
+            pos += 1
+        else:
+            head, pos = _read_varint(data, pos)
+        if pos + 2 < end and data[pos] < 0x80 and data[pos + 2] < 0x80:
+            value = data[pos]
+            delta = data[pos + 1]
+            if delta < 0x80:
+                pos += 2
+            else:
+                delta = (delta & 0x7F) | (data[pos + 2] << 7)
+                pos += 3
+        else:
+            value, pos = _read_varint(data, pos)
+            delta, pos = _read_varint(data, pos)
+        position = head >> 1
+        if position >= len(FACTS):
+            raise AnswerLogError('Invalid fact index')
+        response_ms += _unzigzag(delta)
+        yield position, (value - 1 if value else None), bool(head & 1), response_ms
+
+
+def decode_answers(blob):
+    """BLOB を回答のリスト（クライアントと同じキー）に変換"""
+    answers = []
+    for position, value, correct, response_ms in iter_answers(blob):
+        a, b, correct_answer = FACTS[position]
+        answers.append({
+            'multiplicand': a,
+            'multiplier': b,
+            'user_answer': value,
+            'correct_answer': correct_answer,
+            'is_correct': correct,
+            'response_ms': response_ms,
+        })
+    return answers
+
+
+@cached('kuku_fact_stats', ttl=FACT_STATS_CACHE_TTL, tags=(ANSWERS_CACHE_TAG,))
+def _fact_stats(days, mask):
+    cutoff = int(time.time()) - days * 86400
+    attempts = [0] * len(FACTS)
+    correct = [0] * len(FACTS)
+    total_ms = [0] * len(FACTS)
+    sessions = 0
+    skipped = 0
+
+    # (app_type, created_at) のインデックスで期間を絞り込む
+    rows = get_storage().query(
+        """
+        SELECT answers FROM quiz_sessions
+        WHERE app_type = ? AND created_at >= ? AND status = ? AND answers IS NOT NULL
+        """,
+        (APP_TYPES['kuku'], cutoff, STATUSES['completed'])
+    )
+    for (blob,) in rows:
+        try:
+            for position, _, is_correct, response_ms in iter_answers(blob):
+                attempts[position] += 1
+                correct[position] += is_correct
+                total_ms[position] += response_ms
+        except AnswerLogError:
+            skipped += 1
+            continue
+        sessions += 1
+
+    levels = set(decode_levels(mask))
+    facts = []
+    error_rates = {}
+    for position, (a, b, _) in enumerate(FACTS):
+        if a not in levels or not attempts[position]:
+            continue
+        rate = correct[position] / attempts[position]
+        facts.append({
+            'fact': fact_key(a, b),
+            'multiplicand': a,
+            'multiplier': b,
+            'attempts': attempts[position],
+            'correct': correct[position],
+            'correct_rate': round(rate * 100),
+            'avg_response_ms': round(total_ms[position] / attempts[position]),
+        })
+        error_rates[fact_key(a, b)] = round(1 - rate, 4)
+    return {
+        'days': days,
+        'levels': sorted(levels),
+        'sessions': sessions,
+        'skipped': skipped,
+        'answers': sum(attempts[position] for position, (a, _, _) in enumerate(FACTS) if a in levels),
+        'facts': facts,
+        'error_rates': error_rates,
+    }
+
+
+def fact_stats(days=DEFAULT_STATS_DAYS, levels=None):
+    """
+    完了したセッションの回答ログから九九ごとの正答率・平均回答時間を集計
+
+    Args:
+        days: 対象期間（今日から遡る日数）
+        levels: 対象の段（リストまたはカンマ区切り。省略時は全段）
+
+    Returns:
+        dict: {"sessions": n, "answers": n, "facts": [...],
+               "error_rates": {"7x8": 0.25, ...}}  error_rates は /kuku/api/quiz の weighted にそのまま渡せます
+    """
+    if not isinstance(days, int) or isinstance(days, bool) or not 1 <= days <= MAX_STATS_DAYS:
+        raise AnswerLogError('Invalid days')
+    mask = parse_levels(levels) if levels else (1 << 9) - 1
+    return _fact_stats(days, mask)
@@ -0,0 +1,184 @@
+"""
+九九練習アプリケーション - 出題エンジン
+
+81通りの九九（1×1～9×9）の表と、段の組み合わせ（9ビットのマスク、511通り）ごとの
+出題候補から出題リストを生成します。出題候補は初めて使うときに作ってプロセス内に保持します
+（CGI では import のたびに 511 通りを作ると起動が遅くなるため）。
+
+- sequential: 段・かける数の順（quizLogic.js と同じ並び）
+- random: 候補をシード付きの乱数でシャッフル
+- weighted: 学習者ごとの誤答率で重み付けし、エイリアス法で count 問を抽出
+
+同じ段・モード・シード・問題数（・誤答率）からは常に同じ出題リストを生成するため、
+応答をキャッシュできます。
+"""
+import random
+from functools import lru_cache
+
+from .models import decode_levels, encode_levels
+
+# 九九の表: 位置 (段-1)*9 + (かける数-1) -> (段, かける数, 答え)
+FACTS = tuple((a, b, a * b) for a in range(1, 10) for b in range(1, 10))
+
+
+@lru_cache(maxsize=None)
+def facts_for_mask(mask):
+    """段の組み合わせ（マスク）-> 出題候補の位置のタプル"""
+    return tuple(
+        (level - 1) * 9 + (b - 1) for level in decode_levels(mask) for b in range(1, 10)
+    )
+
+
+QUIZ_MODES = ('sequential', 'random', 'weighted')
+
+# 1回に生成する問題数の上限
+MAX_COUNT = 200
+
+# シードの上限（JSON・JavaScript の安全な整数に収める）
+MAX_SEED = 2 ** 53 - 1
+
+# 重み = 1 + ERROR_WEIGHT * 誤答率（誤答率 0 の問題も出題されるようにする）
+ERROR_WEIGHT = 4.0
+
+
+class QuizRequestError(ValueError):
+    """出題の条件が不正"""
+
+
+def fact_key(a, b):
+    """誤答率の指定に使うキー（例: '7x8'）"""
+    return f'{a}x{b}'
+
+
+class AliasTable:
+    """
+    重み付き抽出のエイリアス表（Vose の方法）
+
+    表の作成は O(n)、1回の抽出は乱数2つで O(1) です。
+    """
+    __slots__ = ('size', 'prob', 'alias')
+
+    def __init__(self, weights):
+        size = len(weights)
+        total = float(sum(weights))
+        if size == 0 or total <= 0:
+            raise QuizRequestError('Invalid weights')
+        scaled = [weight * size / total for weight in weights]
+        self.size = size
+        self.prob = [1.0] * size
+        self.alias = list(range(size))
+
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # 誤差で残ったものは確率 1 のまま
+
+    def sample(self, rng):
+        i = int(rng.random() * self.size)
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+
+def parse_levels(levels):
+    """段の指定（リストまたはカンマ区切り）をマスクに変換"""
+    if isinstance(levels, str):
+        try:
+            levels = [int(level) for level in levels.split(',') if level.strip()]
+        except ValueError:
+            raise QuizRequestError('Invalid levels')
+    if not levels or not isinstance(levels, list) \
+            or not all(isinstance(level, int) and 1 <= level <= 9 for level in levels):
+        raise QuizRequestError('Invalid levels')
+    return encode_levels(levels)
+
+
+def fact_weights(positions, error_rates):
+    """出題候補ごとの重み（誤答率の指定がない問題は誤答率 0 とみなす）"""
+    if not isinstance(error_rates, dict):
+        raise QuizRequestError('Invalid error_rates')
+    weights = []
+    for position in positions:
+        a, b, _ = FACTS[position]
+        rate = error_rates.get(fact_key(a, b), 0)
+        if not isinstance(rate, (int, float)) or isinstance(rate, bool) or not 0 <= rate <= 1:
+            raise QuizRequestError('Invalid error_rates')
+        weights.append(1.0 + ERROR_WEIGHT * rate)
+    return weights
+
+
+def _weighted_positions(positions, weights, count, rng):
+    """エイリアス法で count 問を抽出（同じ問題が連続しないようにする）"""
+    table = AliasTable(weights)
+    picked = []
+    previous = None
+    while len(picked) < count:
+        index = table.sample(rng)
+        if index == previous and len(positions) > 1:
+            continue
+        picked.append(positions[index])
+        previous = index
+    return picked
+
+
+def generate_quiz(levels, mode='sequential', seed=None, count=None, error_rates=None):
+    """
+    出題リストを生成
+
+    Args:
+        levels: 段のリスト（またはカンマ区切りの文字列）
+        mode: 'sequential' / 'random' / 'weighted'
+        seed: 乱数のシード（random / weighted で省略した場合はサーバーで決めて返す）
+        count: 問題数（省略時は候補の数。sequential / random は候補の数まで）
+        error_rates: weighted で使う誤答率（{'7x8': 0.5, ...}）
+
+    Returns:
+        dict: {"quiz_list": [...], "total_count": n, "levels": [...], "mode": ..., "seed": ...}
+    """
+    mask = parse_levels(levels)
+    if mode not in QUIZ_MODES:
+        raise QuizRequestError('Invalid mode')
+
+    positions = facts_for_mask(mask)
+    if count is None:
+        count = len(positions)
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_COUNT:
+        raise QuizRequestError('Invalid count')
+    if mode != 'weighted':
+        count = min(count, len(positions))
+
+    if mode == 'sequential':
+        seed = None
+        picked = positions[:count]
+    else:
+        if seed is None:
+            seed = random.randint(0, MAX_SEED)
+        if not isinstance(seed, int) or isinstance(seed, bool) or not 0 <= seed <= MAX_SEED:
+            raise QuizRequestError('Invalid seed')
+        rng = random.Random(seed)
+        if mode == 'random':
+            picked = rng.sample(positions, count)
+        else:
+            weights = fact_weights(positions, error_rates or {})
+            picked = _weighted_positions(positions, weights, count, rng)
+
+    quiz_list = []
+    for i, position in enumerate(picked):
+        a, b, answer = FACTS[position]
+        quiz_list.append({
+            'id': i,
+            'multiplicand': a,
+            'multiplier': b,
+            'correct_answer': answer,
+        })
+    return {
+        'quiz_list': quiz_list,
+        'total_count': len(quiz_list),
+        'levels': decode_levels(mask),
+        'mode': mode,
+        'seed': seed,
+    }
@@ -1,12 +1,89 @@
 """
 九九練習アプリケーション - データモデル
 """
-import sqlite3
 from datetime import datetime
+import calendar
+import time
 import uuid
-import json
 from flask import current_app
-import os
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from app.common.storage import IntegrityError, get_storage
+
+# 署名付きセッショントークンのソルト（他用途の署名と区別）
+TOKEN_SALT = 'kuku-session'
+
+# DB 上の整数コード（quiz_sessions は文字列ではなくコードで保存）
+APP_TYPES = {'kuku': 1, 'shisoku': 2, 'tankanji': 3}
+MODES = {'sequential': 0, 'random': 1}
+STATUSES = {'active': 0, 'completed': 1}
+
+# 放置セッションの削除で1回に削除する件数
+PURGE_BATCH_SIZE = 1000
+
+# 回答ログの集計（app.kuku.answers）のキャッシュのタグ
+# 集計は期間全体の割合のため、結果の保存ごとには無効化せず有効期限（FACT_STATS_CACHE_TTL）で更新する
+ANSWERS_CACHE_TAG = 'kuku_answers'
+
+# 放置セッションの削除（MySQL は IN 句のサブクエリで LIMIT を使えないため DELETE ... LIMIT）
+PURGE_SQL = {
+    'sqlite': """
+        DELETE FROM quiz_sessions WHERE id IN (
+            SELECT id FROM quiz_sessions
+            WHERE status = ? AND created_at < ?
+            LIMIT ?
+        )
+    """,
+    'mysql': """
+        DELETE FROM quiz_sessions
+        WHERE status = ? AND created_at < ?
+        LIMIT ?
+    """,
+}
+
+
+def _decode(codes, value):
+    for name, code in codes.items():
+        if code == value:
+            return name
+    return None
+
+
+def encode_levels(levels):
+    """段のリストを9ビットのマスクに変換（段 n をビット n-1）"""
+    mask = 0
+    for level in levels:
+        mask |= 1 << (int(level) - 1)
+    return mask
+
+
+def decode_levels(mask):
+    """9ビットのマスクを段のリスト（昇順）に変換"""
+    return [level for level in range(1, 10) if mask & (1 << (level - 1))]
+
+
+def encode_id(session_id):
+    """UUID 文字列を16バイトに変換（形式が不正なら None）"""
+    try:
+        return uuid.UUID(session_id).bytes
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def to_epoch(value):
+    """UTC の naive datetime を UNIX 秒に変換"""
+    return calendar.timegm(value.timetuple())
+
+
+class InvalidSessionToken(Exception):
+    """セッショントークンが不正（改ざん・形式不正）"""
+
+
+class ExpiredSessionToken(InvalidSessionToken):
+    """セッショントークンの有効期限切れ"""
+
+
+class DuplicateResult(Exception):
+    """同じセッションの結果が既に保存済み"""
 
 class QuizSession:
     """
@@ -14,6 +91,10 @@ class QuizSession:
     
     クライアント側で全ての問題生成・採点が完了した後、
     最終結果のみをサーバーに保存します。
+    
+    署名モード（KUKU_SESSION_MODE='signed'）では、セッション作成時に
+    DBへ書き込まず、段・モード・作成日時を含む署名付きトークンを返します。
+    結果保存時にトークンを検証し、完了済みの行を1回の INSERT で保存します。
     """
     
     def __init__(self, levels, mode, app_type='kuku'):
@@ -24,8 +105,9 @@ class QuizSession:
         self.correct_count = 0
         self.total_count = 0
         self.correct_rate = 0
+        self.answers = None  # 回答ログ（app.kuku.answers.encode_answers の BLOB）
         self.status = 'active'  # 'active' or 'completed'
-        self.created_at = datetime.now()
+        self.created_at = datetime.utcnow()
     
     def save(self):
         """
@@ -33,28 +115,18 @@ class QuizSession:
         クライアント側で問題生成・採点を行うため、
         詳細情報はまだ保存しません。
         """
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute(
-                """
-                INSERT INTO quiz_sessions 
-                (id, app_type, levels, mode, status)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (self.id, self.app_type, json.dumps(self.levels), 
-                 self.mode, self.status)
-            )
-            
-            conn.commit()
-            current_app.logger.info(f'Session created: {self.id}')
-        
-        finally:
-            cursor.close()
-            conn.close()
+        get_storage().execute(
+            """
+            INSERT INTO quiz_sessions 
+            (id, app_type, levels, mode, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (encode_id(self.id), APP_TYPES[self.app_type], encode_levels(self.levels),
+             MODES[self.mode], STATUSES[self.status], to_epoch(self.created_at))
+        )
+        current_app.logger.info(f'Session created: {self.id}')
     
-    def update_result(self, correct_count, total_count, correct_rate):
+    def update_result(self, correct_count, total_count, correct_rate, answers=None):
         """
         クライアント側で計算した結果を更新
         
@@ -62,71 +134,160 @@ class QuizSession:
             correct_count: 正答数
             total_count: 全問数
             correct_rate: 正答率（パーセント）
+            answers: 回答ログの BLOB（省略可）
         """
         self.correct_count = correct_count
         self.total_count = total_count
         self.correct_rate = correct_rate
+        self.answers = answers
     
     def mark_completed(self):
         """セッションを完了状態に変更"""
         self.status = 'completed'
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
+        get_storage().execute(
+            """
+            UPDATE quiz_sessions 
+            SET status = ?, correct_count = ?, total_count = ?, correct_rate = ?,
+                answers = ?, completed_at = ?
+            WHERE id = ?
+            """,
+            (STATUSES[self.status], self.correct_count, self.total_count, self.correct_rate,
+             self.answers, int(time.time()), encode_id(self.id))
+        )
+        current_app.logger.info(f'Session completed: {self.id}')
+    
+    def save_completed(self):
+        """
+        完了済みセッションを1回の INSERT で保存（署名モード用）
         
+        Raises:
+            DuplicateResult: 同じセッションの結果が保存済みの場合
+        """
+        self.status = 'completed'
         try:
-            cursor.execute(
+            get_storage().execute(
                 """
-                UPDATE quiz_sessions 
-                SET status = ?, correct_count = ?, total_count = ?
-                WHERE id = ?
+                INSERT INTO quiz_sessions
+                (id, app_type, levels, mode, status, correct_count, total_count,
+                 correct_rate, answers, created_at, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (self.status, self.correct_count, self.total_count, self.id)
+                (encode_id(self.id), APP_TYPES[self.app_type], encode_levels(self.levels),
+                 MODES[self.mode], STATUSES[self.status], self.correct_count,
+                 self.total_count, self.correct_rate, self.answers,
+                 to_epoch(self.created_at), int(time.time()))
             )
-            
-            conn.commit()
-            current_app.logger.info(f'Session completed: {self.id}')
-        
-        finally:
-            cursor.close()
-            conn.close()
+        except IntegrityError:
+            raise DuplicateResult(self.id)
+        current_app.logger.info(f'Session completed: {self.id}')
     
     @staticmethod
-    def get_by_id(session_id):
-        """セッションを取得"""
-        conn = QuizSession.get_db_connection()
-        cursor = conn.cursor()
+    def _serializer():
+        return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+    
+    def to_token(self):
+        """段・モード・作成日時を含む署名付きトークンを発行"""
+        return self._serializer().dumps({
+            'id': self.id,
+            'app': self.app_type,
+            'levels': self.levels,
+            'mode': self.mode
+        })
+    
+    @staticmethod
+    def is_token(session_id):
+        """署名付きトークン形式かどうか（UUID には '.' が含まれない）"""
+        return isinstance(session_id, str) and '.' in session_id
+    
+    @staticmethod
+    def from_token(token):
+        """
+        署名付きトークンを検証してセッションを復元
         
+        Raises:
+            ExpiredSessionToken: 有効期限（KUKU_SESSION_MAX_AGE 秒）切れ
+            InvalidSessionToken: 署名不正・形式不正
+        """
+        max_age = current_app.config.get('KUKU_SESSION_MAX_AGE')
         try:
-            cursor.execute(
-                "SELECT * FROM quiz_sessions WHERE id = ?",
-                (session_id,)
+            payload, issued_at = QuizSession._serializer().loads(
+                token, max_age=max_age, return_timestamp=True
             )
-            
-            row = cursor.fetchone()
-            
-            if not row:
-                return None
-            
+        except SignatureExpired:
+            raise ExpiredSessionToken(token)
+        except BadSignature:
+            raise InvalidSessionToken(token)
+        
+        try:
             session = QuizSession(
-                levels=json.loads(row['levels']),
-                mode=row['mode']
+                levels=payload['levels'],
+                mode=payload['mode'],
+                app_type=payload['app']
             )
-            session.id = row['id']
-            session.correct_count = row['correct_count']
-            session.total_count = row['total_count']
-            session.status = row['status']
-            
-            return session
+            session.id = payload['id']
+        except (KeyError, TypeError):
+            raise InvalidSessionToken(token)
+        
+        # トークンの発行日時（UTC）を作成日時とする
+        session.created_at = issued_at.replace(tzinfo=None)
+        return session
+    
+    @staticmethod
+    def get_by_id(session_id):
+        """セッションを取得"""
+        key = encode_id(session_id)
+        if key is None:
+            return None
         
-        finally:
-            cursor.close()
-            conn.close()
+        row = get_storage().query_one(
+            "SELECT * FROM quiz_sessions WHERE id = ?",
+            (key,)
+        )
+        
+        if not row:
+            return None
+        
+        session = QuizSession(
+            levels=decode_levels(row['levels']),
+            mode=_decode(MODES, row['mode']),
+            app_type=_decode(APP_TYPES, row['app_type'])
+        )
+        session.id = str(uuid.UUID(bytes=bytes(row['id'])))
+        session.correct_count = row['correct_count']
+        session.total_count = row['total_count']
+        session.correct_rate = row['correct_rate']
+        session.answers = row['answers']
+        session.status = _decode(STATUSES, row['status'])
+        session.created_at = datetime.utcfromtimestamp(row['created_at'])
+        
+        return session
     
     @staticmethod
-    def get_db_connection():
-        """SQLite接続"""
-        db_path = current_app.config.get('DATABASE', 'data/study.db')
-        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def purge_abandoned(older_than, batch_size=PURGE_BATCH_SIZE, max_batches=None, now=None):
+        """
+        作成から older_than 秒以上経過した未完了セッションを削除
+        
+        (status, created_at) のインデックスで対象を batch_size 件ずつ削除し、
+        バッチごとにトランザクションを分けて書き込みロックを短く保ちます。
+        削除で空いたページは返却します（SQLite の incremental_vacuum）。
+        
+        Returns:
+            int: 削除した件数
+        """
+        storage = get_storage()
+        now = time.time() if now is None else now
+        cutoff = int(now - older_than)
+        deleted = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            with storage.transaction() as conn:
+                cursor = conn.execute(
+                    PURGE_SQL[storage.dialect],
+                    (STATUSES['active'], cutoff, batch_size)
+                )
+            batches += 1
+            deleted += cursor.rowcount
+            storage.reclaim_space()
+            if cursor.rowcount < batch_size:
+                break
+        return deleted
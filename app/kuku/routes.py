@@ -1,9 +1,27 @@
 """
 九九練習アプリケーション - ルート定義
 """
+import threading
+from collections import OrderedDict
+
 from flask import request, jsonify, render_template, current_app
+from app.common.metrics import record_cache
+from app.common.responses import PreparedBody, send_prepared
 from . import kuku_bp
-from .models import QuizSession
+from .answers import AnswerLogError, encode_answers, fact_stats, normalize_answers
+from .engine import QuizRequestError, generate_quiz, parse_levels
+from .models import (
+    QuizSession, InvalidSessionToken, ExpiredSessionToken, DuplicateResult
+)
+
+# (段, モード, シード, 問題数) -> シリアライズ済みの出題リスト（誤答率の指定がないもののみ）
+# （serve.py のスレッドプールから同時に参照・追い出しするため _quiz_cache_lock の中で操作する）
+_quiz_cache = OrderedDict()
+_quiz_cache_lock = threading.Lock()
+QUIZ_CACHE_SIZE = 1024
+
+# シードを指定した出題リストは内容が変わらないため、ブラウザ・中継サーバーにキャッシュさせる
+QUIZ_CACHE_CONTROL = 'public, max-age=86400'
 
 @kuku_bp.route('/', methods=['GET'])
 def index():
@@ -16,6 +34,7 @@ def create_session():
     セッション作成エンドポイント
     
     クライアント側で全てのクイズを生成するためのセッションを作成します。
+    署名モードでは session_id として署名付きトークンを返します（DB書き込みなし）。
     
     リクエスト:
     {
@@ -40,15 +59,100 @@ def create_session():
     
     # セッション作成（問題生成はクライアント側で実施）
     session = QuizSession(levels=levels, mode=mode)
-    session.save()
+    
+    if current_app.config.get('KUKU_SESSION_MODE') == 'signed':
+        # 署名付きトークンを返し、DBには結果保存時にのみ書き込む
+        session_id = session.to_token()
+    else:
+        session.save()
+        session_id = session.id
     
     current_app.logger.info(f'Session created: {session.id}')
     
     return jsonify({
-        'session_id': session.id,
+        'session_id': session_id,
         'message': 'Session created'
     }), 200
 
+def _quiz_params():
+    """GET のクエリ文字列、または POST の JSON から出題の条件を取り出す"""
+    if request.method == 'GET':
+        args = request.args
+        try:
+            seed = int(args['seed']) if args.get('seed') else None
+            count = int(args['count']) if args.get('count') else None
+        except ValueError:
+            raise QuizRequestError('Invalid seed or count')
+        return args.get('levels', ''), args.get('mode', 'sequential'), seed, count, None
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise QuizRequestError('No JSON data provided')
+    return (data.get('levels', []), data.get('mode', 'sequential'), data.get('seed'),
+            data.get('count'), data.get('error_rates'))
+
+
+def _get_cached_quiz(key):
+    """キャッシュした出題リスト（なければ None）。参照したものを最新にする"""
+    with _quiz_cache_lock:
+        prepared = _quiz_cache.get(key)
+        if prepared is not None:
+            _quiz_cache.move_to_end(key)
+        return prepared
+
+
+def _set_cached_quiz(key, prepared):
+    """出題リストをキャッシュし、上限を超えた分を古いものから追い出す"""
+    with _quiz_cache_lock:
+        _quiz_cache[key] = prepared
+        _quiz_cache.move_to_end(key)
+        while len(_quiz_cache) > QUIZ_CACHE_SIZE:
+            _quiz_cache.popitem(last=False)
+
+
+@kuku_bp.route('/api/quiz', methods=['GET', 'POST'])
+def get_quiz():
+    """
+    出題リストをサーバーで生成
+
+    GET /kuku/api/quiz?levels=2,3,5&mode=random&seed=42&count=20
+    POST /kuku/api/quiz
+    {
+        "levels": [2, 3, 5],
+        "mode": "sequential" or "random" or "weighted",
+        "seed": 42,
+        "count": 20,
+        "error_rates": {"7x8": 0.5}
+    }
+
+    同じ条件（シードを含む）からは常に同じ出題リストを返します。
+    random / weighted でシードを省略した場合は、サーバーで決めたシードを応答に含めます。
+    """
+    try:
+        levels, mode, seed, count, error_rates = _quiz_params()
+        if error_rates:
+            return jsonify(generate_quiz(levels, mode, seed, count, error_rates)), 200
+
+        # シードを省略した random は毎回異なるため、応答をキャッシュしない
+        cacheable = mode == 'sequential' or seed is not None
+        key = (parse_levels(levels), mode, seed, count)
+        prepared = _get_cached_quiz(key) if cacheable else None
+        if cacheable:
+            record_cache('kuku_quiz', prepared is not None)
+        if prepared is None:
+            quiz = generate_quiz(levels, mode, seed, count)
+            prepared = PreparedBody.from_json(
+                quiz, f"kuku-quiz-{mode}-{'.'.join(map(str, quiz['levels']))}"
+                      f"-{quiz['seed']}-{quiz['total_count']}"
+            )
+            if not cacheable:
+                return send_prepared(prepared, cache_control='no-store')
+            _set_cached_quiz(key, prepared)
+        return send_prepared(prepared, cache_control=QUIZ_CACHE_CONTROL)
+    except QuizRequestError as e:
+        return jsonify({'error': str(e)}), 400
+
+
 @kuku_bp.route('/api/result', methods=['POST'])
 def save_result():
     """
@@ -61,8 +165,14 @@ def save_result():
         "session_id": "...",
         "correct_count": 8,
         "total_count": 9,
-        "correct_rate": 88
+        "correct_rate": 88,
+        "answers": [
+            {"multiplicand": 7, "multiplier": 8, "user_answer": 54, "response_ms": 3200},
+            ...
+        ]
     }
+    
+    answers（省略可）は1つの BLOB にまとめて保存します（app.kuku.answers）。
     """
     data = request.get_json()
     
@@ -84,14 +194,42 @@ def save_result():
     if correct_count > total_count or correct_count < 0 or total_count <= 0:
         return jsonify({'error': 'Invalid counts'}), 400
     
-    # セッション取得と結果更新
-    session = QuizSession.get_by_id(session_id)
-    if not session:
-        return jsonify({'error': 'Session not found'}), 404
+    # 正答率は整数（パーセント）で保存。不正な値は正答数から計算し直す
+    if not isinstance(correct_rate, (int, float)) or isinstance(correct_rate, bool) \
+            or not 0 <= correct_rate <= 100:
+        correct_rate = correct_count * 100 / total_count
+    correct_rate = int(round(correct_rate))
+    
+    answers = None
+    if data.get('answers') is not None:
+        try:
+            answers = encode_answers(normalize_answers(data['answers']))
+        except AnswerLogError as e:
+            return jsonify({'error': str(e)}), 400
     
-    # 結果をセッションに保存
-    session.update_result(correct_count, total_count, correct_rate)
-    session.mark_completed()
+    if QuizSession.is_token(session_id):
+        # 署名付きトークンを検証し、完了済みの行を1回の INSERT で保存
+        try:
+            session = QuizSession.from_token(session_id)
+        except ExpiredSessionToken:
+            return jsonify({'error': 'Session expired'}), 410
+        except InvalidSessionToken:
+            return jsonify({'error': 'Session not found'}), 404
+        
+        session.update_result(correct_count, total_count, correct_rate, answers)
+        try:
+            session.save_completed()
+        except DuplicateResult:
+            return jsonify({'error': 'Result already saved'}), 409
+    else:
+        # セッション取得と結果更新
+        session = QuizSession.get_by_id(session_id)
+        if not session:
+            return jsonify({'error': 'Session not found'}), 404
+        
+        # 結果をセッションに保存
+        session.update_result(correct_count, total_count, correct_rate, answers)
+        session.mark_completed()
     
     current_app.logger.info(
         f'Result saved: {session_id} - {correct_count}/{total_count}'
@@ -103,6 +241,24 @@ def save_result():
         'session_id': session_id
     }), 200
 
+@kuku_bp.route('/api/fact-stats', methods=['GET'])
+def get_fact_stats():
+    """
+    回答ログから九九ごとの正答率・平均回答時間を集計
+
+    GET /kuku/api/fact-stats?days=30&levels=6,7,8
+
+    応答の error_rates は /kuku/api/quiz（mode=weighted）の error_rates にそのまま渡せます。
+    """
+    try:
+        days = int(request.args.get('days') or 30)
+    except ValueError:
+        return jsonify({'error': 'Invalid days'}), 400
+    try:
+        return jsonify(fact_stats(days, request.args.get('levels'))), 200
+    except (AnswerLogError, QuizRequestError) as e:
+        return jsonify({'error': str(e)}), 400
+
 @kuku_bp.errorhandler(404)
 def not_found(error):
     """404エラーハンドラ"""
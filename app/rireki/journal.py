@@ -0,0 +1,231 @@
+"""
+学習履歴のジャーナル（追記専用ログ）
+
+リクエスト処理では SQLite を開かず、1件の JSON 行をジャーナルファイルへ
+追記するだけにします（O_APPEND による1回の write）。
+ファイルは一定時間ごとに切り替わり、書き込みが終わったセグメントを
+compact() でまとめて SQLite に取り込みます。
+
+取り込みは record_id で重複を無視するため、取り込み後・削除前に
+停止しても再実行で二重登録されません。
+"""
+import glob
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows（開発環境）
+    fcntl = None
+
+SEGMENT_PREFIX = 'history-'
+SEGMENT_SUFFIX = '.jsonl'
+
+# セグメント切り替え後、処理中の追記を待つ猶予（秒）
+CLOSE_GRACE_SECONDS = 2
+
+# ロックファイルが残った場合に無効とみなす時間（fcntl がない環境用）
+STALE_LOCK_SECONDS = 300
+
+
+class JournalLock:
+    """取り込み処理の排他ロック（取得できなければ待たずに諦める）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        if fcntl is not None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+
+        try:
+            if time.time() - os.path.getmtime(self.path) > STALE_LOCK_SECONDS:
+                os.remove(self.path)
+        except OSError:
+            pass
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            return False
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        else:
+            os.close(self._fd)
+            os.remove(self.path)
+        self._fd = None
+
+
+class HistoryJournal:
+    """時間単位でローテーションする学習履歴ジャーナル"""
+
+    def __init__(self, directory, rotate_seconds=60):
+        self.directory = directory
+        self.rotate_seconds = max(1, int(rotate_seconds))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config['HISTORY_JOURNAL_DIR'],
+            config.get('HISTORY_JOURNAL_ROTATE_SECONDS', 60)
+        )
+
+    def segment_path(self, now=None):
+        """現在（now）の書き込み先セグメント"""
+        now = time.time() if now is None else now
+        bucket = int(now // self.rotate_seconds) * self.rotate_seconds
+        return os.path.join(self.directory, f'{SEGMENT_PREFIX}{bucket:012d}{SEGMENT_SUFFIX}')
+
+    def append(self, entry, now=None):
+        """
+        1件を追記（O(1)）
+
+        O_APPEND で1行を1回の write で書き込むため、複数プロセスから
+        同時に追記しても行が混ざりません。
+        """
+        self.append_many([entry], now)
+
+    def append_many(self, entries, now=None):
+        """複数件をまとめて追記（全行を1回の write で書き込む）"""
+        if not entries:
+            return
+        data = ''.join(
+            json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+            for entry in entries
+        ).encode('utf-8')
+        path = self.segment_path(now)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        except FileNotFoundError:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            # 通常は1回で書き終わる（途中までの場合も残りを続けて書き、行は壊さない）
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+
+    def _bucket_of(self, path):
+        name = os.path.basename(path)
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def closed_segments(self, now=None):
+        """書き込みが終わったセグメント（古い順）"""
+        now = time.time() if now is None else now
+        pattern = os.path.join(self.directory, f'{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}')
+        segments = []
+        for path in sorted(glob.glob(pattern)):
+            try:
+                bucket = self._bucket_of(path)
+            except ValueError:
+                continue
+            if bucket + self.rotate_seconds + CLOSE_GRACE_SECONDS <= now:
+                segments.append(path)
+        return segments
+
+    @staticmethod
+    def read_segment(path):
+        """
+        セグメントを読み込む
+
+        Returns:
+            tuple: (エントリのリスト, 読み飛ばした不正行の数)
+        """
+        entries = []
+        skipped = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    # 書き込み途中で停止した行など
+                    skipped += 1
+        return entries, skipped
+
+    def compact(self, ingest, now=None, max_segments=None):
+        """
+        書き込みが終わったセグメントを ingest(entries) で取り込み、削除する
+
+        Args:
+            ingest: エントリのリストを1トランザクションで保存する関数
+            max_segments: 1回で処理するセグメント数の上限
+
+        Returns:
+            dict | None: 処理結果（他のプロセスが処理中の場合は None）
+        """
+        if not os.path.isdir(self.directory):
+            return {'segments': 0, 'entries': 0, 'inserted': 0, 'skipped': 0}
+
+        lock = JournalLock(os.path.join(self.directory, '.compact.lock'))
+        if not lock.acquire():
+            return None
+
+        result = {'segments': 0, 'entries': 0, 'inserted': 0, 'skipped': 0}
+        try:
+            segments = self.closed_segments(now)
+            if max_segments is not None:
+                segments = segments[:max_segments]
+            for path in segments:
+                entries, skipped = self.read_segment(path)
+                if entries:
+                    result['inserted'] += ingest(entries)
+                # コミット後に削除（ここで停止しても再取り込みは重複として無視される）
+                os.remove(path)
+                result['segments'] += 1
+                result['entries'] += len(entries)
+                result['skipped'] += skipped
+        finally:
+            lock.release()
+        return result
+
+    def pending_bytes(self, now=None):
+        """書き込みが終わったセグメントの合計サイズ（バイト）"""
+        total = 0
+        for path in self.closed_segments(now):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def maybe_compact(self, ingest, min_interval, min_bytes=0, now=None):
+        """
+        取り込み待ちのセグメントが min_bytes 以上溜まっていれば取り込む
+
+        リクエスト処理の中から呼び出す想定のため、前回から min_interval 秒
+        経過していない場合、溜まった量が少ない場合、ロックが取れない場合は何もしません。
+        """
+        now = time.time() if now is None else now
+        marker = os.path.join(self.directory, '.last_compact')
+        try:
+            if now - os.path.getmtime(marker) < min_interval:
+                return None
+        except OSError:
+            pass
+
+        pending = self.pending_bytes(now)
+        if not pending or pending < min_bytes:
+            return None
+
+        try:
+            with open(marker, 'a'):
+                pass
+            os.utime(marker, (now, now))
+        except OSError:
+            return None
+        return self.compact(ingest, now=now, max_segments=10)
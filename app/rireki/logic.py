@@ -1,31 +1,468 @@
 """
 履歴管理ロジック
-将来的なデータベース連携、集計機能を担当
+学習履歴の保存（ジャーナル経由）、集計機能を担当
 """
+import csv
+import io
+import json
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+
+from app.common.cache import cached, invalidate_tags
+from app.common.storage import get_storage
+from app.rireki.journal import HistoryJournal
+
+# app_id の最大長
+MAX_APP_ID_LENGTH = 32
+
+# 統計の既定の集計期間（日数）
+DEFAULT_STATS_DAYS = 30
+
+# エクスポート時に1回で読み込む行数
+EXPORT_CHUNK_SIZE = 500
+
+# エクスポートする列（payload は NDJSON のみ）
+EXPORT_COLUMNS = (
+    'record_id', 'user_id', 'app_id', 'date', 'time', 'timestamp',
+    'correct_count', 'total_count', 'correct_rate', 'time_spent',
+)
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# 同期で1回に受け付けるレコード数・返す差分の件数
+MAX_SYNC_RECORDS = 500
+SYNC_PAGE_SIZE = 200
+
+# SQLite の変数上限（999）を超えないための IN 句の分割サイズ
+IN_CLAUSE_CHUNK = 500
+
+# 統計の共有キャッシュの有効期限（秒）。取り込み時にアプリ単位で無効化する
+STATS_CACHE_TTL = 600
+
+
+def stats_cache_tags(app_id):
+    return ('history', f'history:{app_id}')
+
+
+class InvalidRecord(ValueError):
+    """保存できない学習結果"""
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _rate(correct, total):
+    return round(correct / total * 100) if total else None
+
+
+def normalize_record(app_id, record, user_id=None, now=None):
+    """
+    クライアントの学習結果をジャーナル・DB 用のエントリに変換
+
+    Args:
+        app_id: アプリID（kuku, shisoku, tankanji 等）
+        record: historyManager.js が保存するレコード
+        user_id: 利用者・端末の識別子（任意）
+    """
+    if not isinstance(app_id, str) or not app_id or len(app_id) > MAX_APP_ID_LENGTH:
+        raise InvalidRecord('不正なアプリIDです')
+    if not isinstance(record, dict):
+        raise InvalidRecord('不正なレコードです')
+
+    now = time.time() if now is None else now
+    local = datetime.fromtimestamp(now)
+    correct_count = _to_int(record.get('correctCount'))
+    total_count = _to_int(record.get('totalCount'))
+    if total_count < 0 or correct_count < 0 or correct_count > total_count:
+        raise InvalidRecord('不正な正答数です')
+
+    correct_rate = record.get('correctRate')
+    if correct_rate is None and total_count:
+        correct_rate = round(correct_count / total_count * 100)
+
+    return {
+        'record_id': str(record.get('id') or uuid.uuid4()),
+        'user_id': str(user_id) if user_id else None,
+        'app_id': app_id,
+        'date': str(record.get('date') or local.strftime('%Y-%m-%d')),
+        'time': str(record.get('time') or local.strftime('%H:%M:%S')),
+        'timestamp': _to_int(record.get('timestamp'), int(now)),
+        'correct_count': correct_count,
+        'total_count': total_count,
+        'correct_rate': _to_int(correct_rate, None),
+        'time_spent': _to_int(record.get('timeSpent')),
+        'payload': json.dumps(record, ensure_ascii=False, separators=(',', ':')),
+    }
+
 
 class HistoryLogic:
     """学習履歴のサーバー側ロジック"""
 
+    INSERT_SQL = """
+        INSERT OR IGNORE INTO history_records
+        (record_id, user_id, app_id, date, time, timestamp,
+         correct_count, total_count, correct_rate, time_spent, payload)
+        VALUES (:record_id, :user_id, :app_id, :date, :time, :timestamp,
+                :correct_count, :total_count, :correct_rate, :time_spent, :payload)
+    """
+
     def __init__(self):
-        pass
+        self._journal = None
+
+    @property
+    def journal(self):
+        """設定されたジャーナル（ディレクトリが変わった場合は作り直す）"""
+        directory = current_app.config['HISTORY_JOURNAL_DIR']
+        if self._journal is None or self._journal.directory != directory:
+            self._journal = HistoryJournal.from_config(current_app.config)
+        return self._journal
 
-    def save_to_db(self, app_id, record):
+    def save_to_db(self, app_id, record, user_id=None):
         """
-        学習結果をデータベースに保存
-        将来実装予定
+        学習結果を保存
+
+        ジャーナルへの1行追記のみを行い、DB への反映は compact_journal() で
+        まとめて行います。
+
+        Returns:
+            str: 保存したレコードのID
         """
-        pass
+        entry = normalize_record(app_id, record, user_id)
+        self.journal.append(entry)
+        return entry['record_id']
+
+    ROLLUP_INIT_SQL = """
+        INSERT OR IGNORE INTO history_daily_rollups (app_id, date) VALUES (?, ?)
+    """
+
+    # 2つの値の大きい方: SQLite は MAX(a, b)、MySQL は GREATEST(a, b)
+    ROLLUP_UPDATE_SQL = {
+        dialect: f"""
+            UPDATE history_daily_rollups
+            SET attempts = attempts + ?,
+                correct_sum = correct_sum + ?,
+                total_sum = total_sum + ?,
+                best_rate = {greatest}(best_rate, ?),
+                time_spent = time_spent + ?
+            WHERE app_id = ? AND date = ?
+        """
+        for dialect, greatest in (('sqlite', 'MAX'), ('mysql', 'GREATEST'))
+    }
+
+    def ingest_records(self, entries):
+        """
+        エントリを1トランザクションで DB に保存し、日別集計を更新
+
+        record_id が保存済み（またはバッチ内で重複）のものは無視するため、
+        同じエントリを何度取り込んでも結果は変わりません。
+
+        Returns:
+            int: 新たに保存した件数
+        """
+        with get_storage().transaction() as conn:
+            new_entries = self._exclude_existing(conn, entries)
+            if not new_entries:
+                return 0
+            conn.executemany(self.INSERT_SQL, new_entries)
+            self._update_rollups(conn, new_entries)
+
+        # 更新したアプリの統計のキャッシュを無効化（コミット後）
+        app_ids = sorted({entry['app_id'] for entry in new_entries})
+        invalidate_tags(*[f'history:{app_id}' for app_id in app_ids])
+        return len(new_entries)
+
+    @staticmethod
+    def _exclude_existing(conn, entries):
+        """保存済み・バッチ内重複の record_id を除外"""
+        unique = {}
+        for entry in entries:
+            unique.setdefault(entry['record_id'], entry)
+
+        ids = list(unique)
+        for start in range(0, len(ids), IN_CLAUSE_CHUNK):
+            chunk = ids[start:start + IN_CLAUSE_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT record_id FROM history_records WHERE record_id IN ({placeholders})',
+                chunk
+            )
+            for row in rows:
+                unique.pop(row['record_id'], None)
+        return list(unique.values())
+
+    def _update_rollups(self, conn, entries):
+        """(アプリ, 日付) ごとに集計してから日別集計行へ加算"""
+        totals = {}
+        for entry in entries:
+            key = (entry['app_id'], entry['date'])
+            attempts, correct, total, best, spent = totals.get(key, (0, 0, 0, 0, 0))
+            totals[key] = (
+                attempts + 1,
+                correct + entry['correct_count'],
+                total + entry['total_count'],
+                max(best, entry['correct_rate'] or 0),
+                spent + entry['time_spent'],
+            )
+
+        conn.executemany(self.ROLLUP_INIT_SQL, list(totals))
+        conn.executemany(self.ROLLUP_UPDATE_SQL[get_storage().dialect], [
+            values + key for key, values in totals.items()
+        ])
+
+    def rebuild_rollups(self):
+        """日別集計を履歴の全件から作り直す"""
+        with get_storage().transaction() as conn:
+            conn.execute('DELETE FROM history_daily_rollups')
+            conn.execute("""
+                INSERT INTO history_daily_rollups
+                (app_id, date, attempts, correct_sum, total_sum, best_rate, time_spent)
+                SELECT app_id, date, COUNT(*), SUM(correct_count), SUM(total_count),
+                       MAX(COALESCE(correct_rate, 0)), SUM(time_spent)
+                FROM history_records
+                GROUP BY app_id, date
+            """)
+            count = conn.execute('SELECT COUNT(*) FROM history_daily_rollups').fetchone()[0]
+        invalidate_tags('history')
+        return count
+
+    def compact_journal(self, now=None):
+        """書き込みが終わったジャーナルを DB に取り込む"""
+        result = self.journal.compact(self.ingest_records, now=now)
+        if result and result['segments']:
+            current_app.logger.info(f'History journal compacted: {result}')
+        return result
+
+    def maybe_compact_journal(self):
+        """
+        取り込み待ちのジャーナルが閾値を超えていれば取り込む（リクエスト処理用）
+
+        通常の取り込みは cron の manage.py compact-journal で行い、
+        これは cron が止まった場合にジャーナルが溜まり続けないための予備です。
+        """
+        min_bytes = current_app.config.get('HISTORY_COMPACT_MIN_BYTES', 0)
+        if min_bytes <= 0:
+            return None
+        interval = current_app.config.get('HISTORY_COMPACT_INTERVAL', 0)
+        try:
+            result = self.journal.maybe_compact(self.ingest_records, interval, min_bytes)
+        except Exception as e:
+            # 取り込みに失敗してもジャーナルは残るため、次回に再試行される
+            current_app.logger.error(f'History journal compaction failed: {e}')
+            return None
+        if result and result['segments']:
+            current_app.logger.info(f'History journal compacted: {result}')
+        return result
 
     def get_stats_from_db(self, app_id, date_range=None):
         """
         アプリ別の成績統計をDBから取得
-        将来実装予定
+
+        日別集計行のみを読むため、期間の日数に比例したコストで済みます。
+        結果は共有キャッシュに保存し、履歴の取り込み時に無効化します。
+
+        Args:
+            app_id: アプリID
+            date_range: (開始日, 終了日) の 'YYYY-MM-DD' 文字列。省略時は直近30日
+
+        Returns:
+            dict: 期間合計と日別の統計
+        """
+        if date_range is None:
+            today = date.today()
+            date_range = (
+                (today - timedelta(days=DEFAULT_STATS_DAYS - 1)).isoformat(),
+                today.isoformat()
+            )
+        return self._stats_for_range(app_id, *date_range)
+
+    @cached('history_stats', ttl=STATS_CACHE_TTL,
+            tags=lambda self, app_id, start, end: stats_cache_tags(app_id),
+            key=lambda self, app_id, start, end: f'{app_id}:{start}:{end}')
+    def _stats_for_range(self, app_id, start, end):
+        rows = get_storage().query(
+            """
+            SELECT date, attempts, correct_sum, total_sum, best_rate, time_spent
+            FROM history_daily_rollups
+            WHERE app_id = ? AND date BETWEEN ? AND ?
+            ORDER BY date
+            """,
+            (app_id, start, end)
+        )
+
+        days = []
+        summary = {'attempts': 0, 'correct': 0, 'total': 0, 'best_rate': 0, 'time_spent': 0}
+        for row in rows:
+            days.append({
+                'date': row['date'],
+                'attempts': row['attempts'],
+                'correct': row['correct_sum'],
+                'total': row['total_sum'],
+                'correct_rate': _rate(row['correct_sum'], row['total_sum']),
+                'best_rate': row['best_rate'],
+                'time_spent': row['time_spent'],
+            })
+            summary['attempts'] += row['attempts']
+            summary['correct'] += row['correct_sum']
+            summary['total'] += row['total_sum']
+            summary['best_rate'] = max(summary['best_rate'], row['best_rate'])
+            summary['time_spent'] += row['time_spent']
+
+        summary['correct_rate'] = _rate(summary['correct'], summary['total'])
+        summary.update({'app_id': app_id, 'from': start, 'to': end, 'days': days})
+        return summary
+
+    def sync(self, user_id, cursor, items):
+        """
+        クライアントとの差分同期
+
+        1. クライアントが送った未同期のレコードをジャーナルへ追記（save_to_db と同じく O(1)）
+        2. サーバー側で cursor（前回返した最後の id）より新しいレコードを返す
+
+        送られたレコードの DB への取り込みは compact_journal()（cron）で行うため、
+        他の端末への差分に含まれるのは取り込み後です（応答の ingestDeferred）。
+        レコードは作成後に変更されないため、同じ record_id は同じレコードとして
+        扱います（取り込み時に先に保存された方が残る）。
+
+        Args:
+            user_id: 利用者・端末の識別子
+            cursor: 前回の応答の cursor（初回は 0）
+            items: [{"appId": ..., "record": {...}}, ...]
+
+        Returns:
+            dict: {"accepted", "rejected", "records", "cursor", "hasMore", "ingestDeferred"}
         """
-        pass
+        if not user_id:
+            raise InvalidRecord('userId が必要です')
+        if len(items) > MAX_SYNC_RECORDS:
+            raise InvalidRecord(f'1回に送信できるのは {MAX_SYNC_RECORDS} 件までです')
+        cursor = _to_int(cursor)
+        if cursor < 0:
+            raise InvalidRecord('不正な cursor です')
+
+        entries = []
+        rejected = []
+        for item in items:
+            record = item.get('record') if isinstance(item, dict) else None
+            try:
+                entries.append(normalize_record(item.get('appId'), record, user_id))
+            except (InvalidRecord, AttributeError):
+                rejected.append(record.get('id') if isinstance(record, dict) else None)
+        self.journal.append_many(entries)
+
+        rows = get_storage().query(
+            """
+            SELECT id, record_id, app_id, payload FROM history_records
+            WHERE user_id = ? AND id > ?
+            ORDER BY id LIMIT ?
+            """,
+            (user_id, cursor, SYNC_PAGE_SIZE + 1)
+        )
+        has_more = len(rows) > SYNC_PAGE_SIZE
+        rows = rows[:SYNC_PAGE_SIZE]
 
-    def export_history(self, user_id=None):
+        # 今回送られてきたレコードはクライアントが持っているため返さない
+        pushed = {entry['record_id'] for entry in entries}
+        records = [
+            {'appId': row['app_id'], 'record': json.loads(row['payload'])}
+            for row in rows if row['record_id'] not in pushed
+        ]
+
+        return {
+            'accepted': len(entries),
+            'rejected': rejected,
+            'records': records,
+            'cursor': rows[-1]['id'] if rows else cursor,
+            'hasMore': has_more,
+            # 送ったレコードはジャーナルの取り込み後に差分（records）に含まれる
+            'ingestDeferred': True,
+        }
+
+    def iter_history_rows(self, user_id=None, app_id=None, date_range=None,
+                          chunk_size=EXPORT_CHUNK_SIZE):
         """
-        履歴をエクスポート（CSV/JSON）
-        将来実装予定
+        条件に合う履歴行を ID 順に列挙
+
+        「id > 前回の最後の id」で chunk_size 件ずつ問い合わせるため、
+        読み取りを長時間保持しません。各問い合わせの行は storage.iterate で
+        少しずつ読み込むため（MySQL は SSCursor）、メモリ使用量も一定です。
         """
-        pass
+        conditions = ['id > ?']
+        params = []
+        if user_id:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if app_id:
+            conditions.append('app_id = ?')
+            params.append(app_id)
+        if date_range:
+            conditions.append('date BETWEEN ? AND ?')
+            params.extend(date_range)
+
+        sql = (
+            f'SELECT id, {", ".join(EXPORT_COLUMNS)}, payload FROM history_records '
+            f'WHERE {" AND ".join(conditions)} ORDER BY id LIMIT ?'
+        )
+        storage = get_storage()
+        last_id = 0
+        while True:
+            count = 0
+            for row in storage.iterate(sql, [last_id] + params + [chunk_size], chunk_size):
+                count += 1
+                last_id = row['id']
+                yield row
+            if count < chunk_size:
+                return
+
+    def export_history(self, user_id=None, fmt='csv', app_id=None, date_range=None):
+        """
+        履歴をエクスポート（CSV/NDJSON）
+
+        行をまとめて読み込むたびに文字列のチャンクを返すジェネレーターです。
+        ストリーミング応答にそのまま渡せます。
+
+        Args:
+            fmt: 'csv'（Excel 用に BOM 付き）または 'ndjson'（1行1レコード、元データを含む）
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'Unsupported format: {fmt}')
+
+        rows = self.iter_history_rows(user_id, app_id, date_range)
+        if fmt == 'csv':
+            return self._iter_csv(rows)
+        return self._iter_ndjson(rows)
+
+    @staticmethod
+    def _iter_csv(rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        buffer.write('\ufeff')
+        writer.writerow(EXPORT_COLUMNS)
+
+        for i, row in enumerate(rows, 1):
+            writer.writerow([row[column] for column in EXPORT_COLUMNS])
+            if i % EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    @staticmethod
+    def _iter_ndjson(rows):
+        lines = []
+        for row in rows:
+            item = {column: row[column] for column in EXPORT_COLUMNS}
+            item['record'] = json.loads(row['payload'])
+            lines.append(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+            if len(lines) >= EXPORT_CHUNK_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
@@ -1,9 +1,59 @@
-from flask import render_template, jsonify, request, current_app
+import hmac
+import json
+import zlib
+from datetime import datetime
+
+from flask import Response, abort, render_template, jsonify, request, current_app, stream_with_context
+from app.common.responses import iter_gzip
 from app.rireki import rireki_bp
-from app.rireki.logic import HistoryLogic
+from app.rireki.logic import EXPORT_FORMATS, HistoryLogic, InvalidRecord
 
 history_logic = HistoryLogic()
 
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+# 同期リクエストの本文の上限（展開後）
+MAX_SYNC_BODY = 2 * 1024 * 1024
+
+
+def read_json_body(max_size=MAX_SYNC_BODY):
+    """
+    リクエスト本文を JSON として読み込む（Content-Encoding: gzip に対応）
+
+    展開後のサイズが max_size を超える場合や不正な場合は ValueError
+    """
+    data = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(31)
+        try:
+            data = decompressor.decompress(data, max_size + 1)
+        except zlib.error:
+            raise ValueError('invalid gzip body')
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError('body too large or truncated')
+    if len(data) > max_size:
+        raise ValueError('body too large')
+    return json.loads(data.decode('utf-8'))
+
+
+def parse_date_range(args):
+    """
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD を (開始日, 終了日) に変換
+
+    どちらも省略された場合は None、形式が不正な場合は ValueError
+    """
+    start = args.get('from')
+    end = args.get('to')
+    if not start and not end:
+        return None
+    start = datetime.strptime(start or '0001-01-01', '%Y-%m-%d').date().isoformat()
+    end = datetime.strptime(end or '9999-12-31', '%Y-%m-%d').date().isoformat()
+    return start, end
+
 @rireki_bp.route('/', methods=['GET'])
 def calendar():
     """
@@ -15,8 +65,11 @@ def calendar():
 @rireki_bp.route('/api/save', methods=['POST'])
 def save_record():
     """
-    学習結果をサーバーに保存（将来のDB連携用）
-    Request: {"appId": "kuku", "record": {...}}
+    学習結果をサーバーに保存
+    Request: {"appId": "kuku", "record": {...}, "userId": "..."}
+
+    ジャーナルへ追記して応答します。DB への取り込みは cron の manage.py compact-journal で
+    まとめて行います（溜まりすぎた場合のみ、このリクエストの中で取り込みます）。
     """
     try:
         data = request.get_json()
@@ -26,12 +79,19 @@ def save_record():
         if not app_id or not record:
             return jsonify({'status': 'error', 'message': '不正なリクエスト'}), 400
 
-        # 将来的にDBに保存する処理
-        # result = history_logic.save_to_db(app_id, record)
+        try:
+            record_id = history_logic.save_to_db(app_id, record, data.get('userId'))
+        except InvalidRecord as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        # CGI ではプロセスが終了するまで応答が完了しない（call_on_close で後回しにしても利用者を待たせる）ため、
+        # 取り込みは cron に任せ、ジャーナルが閾値を超えて溜まった場合のみここで取り込む
+        history_logic.maybe_compact_journal()
 
         return jsonify({
             'status': 'success',
-            'message': '結果を保存しました'
+            'message': '結果を保存しました',
+            'recordId': record_id
         }), 200
 
     except Exception as e:
@@ -39,18 +99,63 @@ def save_record():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@rireki_bp.route('/api/sync', methods=['POST'])
+def sync_records():
+    """
+    ローカルの履歴とサーバーの差分同期
+    Request: {"userId": "...", "cursor": 0, "records": [{"appId": "kuku", "record": {...}}, ...]}
+             （Content-Encoding: gzip で圧縮して送信可）
+    Response: {"status": "success", "records": [...], "cursor": 123, "hasMore": false,
+               "accepted": 1, "ingestDeferred": true, ...}
+
+    クライアントは未同期のレコードだけを送り、サーバーは cursor より新しい
+    レコードだけを返すため、通信量は履歴全体ではなく新しいレコード数に比例します。
+    送られたレコードはジャーナルへ追記するだけで、差分（records）に含まれるのは
+    cron の manage.py compact-journal で取り込んだ後です（クライアントは id で重複を除く）。
+    """
+    try:
+        data = read_json_body()
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '不正なリクエスト'}), 400
+    if not isinstance(data, dict) or not isinstance(data.get('records', []), list):
+        return jsonify({'status': 'error', 'message': '不正なリクエスト'}), 400
+
+    try:
+        result = history_logic.sync(
+            data.get('userId'),
+            data.get('cursor', 0),
+            data.get('records', [])
+        )
+    except InvalidRecord as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f'Error syncing records: {str(e)}')
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    # save_record と同じく、ジャーナルが閾値を超えて溜まった場合のみここで取り込む
+    history_logic.maybe_compact_journal()
+
+    result['status'] = 'success'
+    return jsonify(result), 200
+
+
 @rireki_bp.route('/api/stats/<app_id>', methods=['GET'])
 def get_stats(app_id):
     """
-    アプリ別の成績統計を取得（将来のDB連携用）
+    アプリ別の成績統計を取得
+    Query: ?from=YYYY-MM-DD&to=YYYY-MM-DD（省略時は直近30日）
     """
     try:
-        # 将来的にDBから取得する処理
-        # stats = history_logic.get_stats_from_db(app_id)
+        try:
+            date_range = parse_date_range(request.args)
+        except ValueError:
+            return jsonify({'status': 'error', 'message': '日付の形式が不正です'}), 400
+
+        stats = history_logic.get_stats_from_db(app_id, date_range)
 
         return jsonify({
             'status': 'success',
-            'data': {}
+            'data': stats
         }), 200
 
     except Exception as e:
@@ -58,6 +163,53 @@ def get_stats(app_id):
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@rireki_bp.route('/api/export', methods=['GET'])
+def export_history():
+    """
+    学習履歴をストリーミングでエクスポート
+    Query: ?format=csv|ndjson&app_id=&user_id=&from=&to=&gzip=0|1
+
+    全利用者の履歴を含むため、HISTORY_EXPORT_TOKEN の Bearer 認証（または ?token=）が必要です
+    （未設定の場合は 404）。
+    一定件数ごとに読み込み・出力するため、件数に関係なくメモリ使用量は一定です。
+    gzip は Accept-Encoding が gzip を含む場合に逐次圧縮します（gzip=0 で無効）。
+    """
+    token = current_app.config.get('HISTORY_EXPORT_TOKEN')
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '')
+    supplied = supplied[len('Bearer '):] if supplied.startswith('Bearer ') else request.args.get('token', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': '不正な形式です'}), 400
+    try:
+        date_range = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '日付の形式が不正です'}), 400
+
+    chunks = history_logic.export_history(
+        user_id=request.args.get('user_id'),
+        fmt=fmt,
+        app_id=request.args.get('app_id'),
+        date_range=date_range
+    )
+    use_gzip = request.args.get('gzip') != '0' and request.accept_encodings['gzip']
+    if use_gzip:
+        chunks = iter_gzip(chunks)
+
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[fmt])
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    filename = f'history-{datetime.now():%Y%m%d}.{fmt}'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
 @rireki_bp.errorhandler(404)
 def not_found(error):
     """404エラーハンドラ"""
@@ -0,0 +1,293 @@
+"""
+四則演算練習アプリケーション - 問題の一括生成
+
+印刷用の宿題・再現可能なテスト用に、演算ごとに N 問をまとめて生成します。
+NumPy がある場合は、候補を配列でまとめて生成し、条件に合わないものを
+マスクで除く（ベクトル化した棄却サンプリング）ため、1万問でも数ミリ秒で済みます。
+NumPy がない環境では同じ条件を1問ずつ Python で生成します（乱数列は異なります）。
+
+条件:
+- digits1 / digits2: 左・右の数の桁数（1桁は 0～9、n桁は 10^(n-1)～10^n-1）
+- no_negative: ひき算の答えを 0 以上にする
+- exact_division: わり算を割り切れる問題のみにする（あまりなし）
+- no_carry: たし算の繰り上がり・ひき算の繰り下がりなし
+
+同じシード・条件からは同じ問題を生成します（演算ごとに独立した乱数列を使うため、
+演算の組み合わせを変えても各演算の問題は変わりません）。
+"""
+import random
+
+# NumPy は読み込みに時間がかかるため、問題を生成する時に初めて読み込む（get_engine）
+# （wsgi_app は CGI のリクエストごとにこのモジュールを読み込むため）
+np = None
+_engine = None
+
+OPERATIONS = ('add', 'subtract', 'multiply', 'divide')
+
+OPERATOR_SYMBOLS = {'add': '＋', 'subtract': '−', 'multiply': '×', 'divide': '÷'}
+
+# 1演算あたりの問題数・桁数の上限（積が int64 に収まる範囲）
+MAX_COUNT = 10000
+MAX_DIGITS = 6
+
+# シードの上限（JSON・JavaScript の安全な整数に収める）
+MAX_SEED = 2 ** 53 - 1
+
+# 棄却サンプリングの試行回数の上限（条件を満たす組み合わせがほぼない場合は打ち切る）
+MAX_ROUNDS = 50
+
+# 採択率がこれを下回る条件は作れないものとして扱う
+MIN_ACCEPT_RATE = 1e-3
+
+
+class GeneratorError(ValueError):
+    """生成条件が不正、または条件を満たす問題を作れない"""
+
+
+class ProblemSpec:
+    """生成条件"""
+
+    def __init__(self, digits1=1, digits2=1, no_negative=True, exact_division=True, no_carry=False):
+        for digits in (digits1, digits2):
+            if not isinstance(digits, int) or isinstance(digits, bool) or not 1 <= digits <= MAX_DIGITS:
+                raise GeneratorError('Invalid digits')
+        for flag in (no_negative, exact_division, no_carry):
+            if not isinstance(flag, bool):
+                raise GeneratorError('Invalid flag')
+        self.digits1 = digits1
+        self.digits2 = digits2
+        self.no_negative = no_negative
+        self.exact_division = exact_division
+        self.no_carry = no_carry
+
+    def to_dict(self):
+        return {
+            'digits1': self.digits1,
+            'digits2': self.digits2,
+            'no_negative': self.no_negative,
+            'exact_division': self.exact_division,
+            'no_carry': self.no_carry,
+        }
+
+
+def get_engine():
+    """
+    生成方法（'numpy' または 'python'）
+
+    初回の呼び出しで NumPy を読み込みます。NumPy がない場合は Python で1問ずつ生成します。
+    乱数列は生成方法ごとに異なるため、応答・ETag に含めます。
+    """
+    global np, _engine
+    if _engine is None:
+        try:
+            import numpy
+        except ImportError:
+            _engine = 'python'
+        else:
+            np = numpy
+            _engine = 'numpy'
+    return _engine
+
+
+def digit_range(digits):
+    """桁数 -> (最小値, 最大値)。1桁は 0 を含む"""
+    return (0 if digits == 1 else 10 ** (digits - 1)), 10 ** digits - 1
+
+
+# ---------------------------------------------------------------------------
+# NumPy（ベクトル化）
+# ---------------------------------------------------------------------------
+
+def _has_carry_np(a, b, digits, subtract=False):
+    """各桁で繰り上がり（ひき算は繰り下がり）があるか"""
+    carry = np.zeros(a.shape, dtype=bool)
+    for k in range(digits):
+        place = 10 ** k
+        da = (a // place) % 10
+        db = (b // place) % 10
+        carry |= (da < db) if subtract else (da + db >= 10)
+    return carry
+
+
+def _candidates_np(operation, spec, size, rng):
+    """候補を size 件生成し、条件を満たすもののみ (左, 右) で返す"""
+    lo1, hi1 = digit_range(spec.digits1)
+    lo2, hi2 = digit_range(spec.digits2)
+
+    if operation == 'divide':
+        b = rng.integers(max(lo2, 1), hi2 + 1, size=size, dtype=np.int64)
+        if spec.exact_division:
+            # 割られる数が桁数の範囲に入る商を直接選ぶ
+            q_lo = -(-lo1 // b)
+            q_hi = hi1 // b
+            ok = q_lo <= q_hi
+            b, q_lo, q_hi = b[ok], q_lo[ok], q_hi[ok]
+            q = q_lo + (rng.random(b.shape[0]) * (q_hi - q_lo + 1)).astype(np.int64)
+            return b * q, b
+        a = rng.integers(lo1, hi1 + 1, size=size, dtype=np.int64)
+        return a, b
+
+    a = rng.integers(lo1, hi1 + 1, size=size, dtype=np.int64)
+    b = rng.integers(lo2, hi2 + 1, size=size, dtype=np.int64)
+    ok = np.ones(size, dtype=bool)
+    if operation == 'subtract' and spec.no_negative:
+        ok &= a >= b
+    if spec.no_carry and operation in ('add', 'subtract'):
+        ok &= ~_has_carry_np(a, b, max(spec.digits1, spec.digits2), operation == 'subtract')
+    return a[ok], b[ok]
+
+
+def _generate_np(operation, spec, count, seed):
+    # 演算ごとに独立した乱数列（シード + 演算の番号）
+    rng = np.random.default_rng([seed, OPERATIONS.index(operation)])
+    parts_a, parts_b = [], []
+    found = sampled = 0
+    size = max(count, 1024)
+    for _ in range(MAX_ROUNDS):
+        a, b = _candidates_np(operation, spec, size, rng)
+        parts_a.append(a)
+        parts_b.append(b)
+        found += a.shape[0]
+        sampled += size
+        if found >= count:
+            break
+        # 採択率から次の候補数を見積もる
+        rate = found / float(sampled)
+        if rate < MIN_ACCEPT_RATE:
+            break
+        size = min(int((count - found) / rate * 1.2) + 64, 1 << 22)
+    if found < count:
+        raise GeneratorError(f'Too few problems satisfy the constraints: {operation}')
+
+    a = np.concatenate(parts_a)[:count]
+    b = np.concatenate(parts_b)[:count]
+    if operation == 'add':
+        answer, remainder = a + b, np.zeros(count, dtype=np.int64)
+    elif operation == 'subtract':
+        answer, remainder = a - b, np.zeros(count, dtype=np.int64)
+    elif operation == 'multiply':
+        answer, remainder = a * b, np.zeros(count, dtype=np.int64)
+    else:
+        answer, remainder = a // b, a % b
+    return {
+        'operand1': a.tolist(),
+        'operand2': b.tolist(),
+        'answer': answer.tolist(),
+        'remainder': remainder.tolist(),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Python（NumPy がない環境）
+# ---------------------------------------------------------------------------
+
+def _has_carry(a, b, subtract=False):
+    while a or b:
+        da, db = a % 10, b % 10
+        if (da < db) if subtract else (da + db >= 10):
+            return True
+        a //= 10
+        b //= 10
+    return False
+
+
+def _generate_py(operation, spec, count, seed):
+    rng = random.Random(seed * len(OPERATIONS) + OPERATIONS.index(operation))
+    lo1, hi1 = digit_range(spec.digits1)
+    lo2, hi2 = digit_range(spec.digits2)
+    columns = {'operand1': [], 'operand2': [], 'answer': [], 'remainder': []}
+    attempts = 0
+    while len(columns['answer']) < count:
+        attempts += 1
+        if attempts >= 1024 and len(columns['answer']) < attempts * MIN_ACCEPT_RATE:
+            raise GeneratorError(f'Too few problems satisfy the constraints: {operation}')
+        if operation == 'divide':
+            b = rng.randint(max(lo2, 1), hi2)
+            if spec.exact_division:
+                q_lo, q_hi = -(-lo1 // b), hi1 // b
+                if q_lo > q_hi:
+                    continue
+                a = b * rng.randint(q_lo, q_hi)
+            else:
+                a = rng.randint(lo1, hi1)
+            answer, remainder = divmod(a, b)
+        else:
+            a, b = rng.randint(lo1, hi1), rng.randint(lo2, hi2)
+            if operation == 'subtract' and spec.no_negative and a < b:
+                continue
+            if spec.no_carry and operation in ('add', 'subtract') \
+                    and _has_carry(a, b, operation == 'subtract'):
+                continue
+            answer = {'add': a + b, 'subtract': a - b, 'multiply': a * b}[operation]
+            remainder = 0
+        columns['operand1'].append(a)
+        columns['operand2'].append(b)
+        columns['answer'].append(answer)
+        columns['remainder'].append(remainder)
+    return columns
+
+
+def parse_operations(operations):
+    """演算の指定（リストまたはカンマ区切り）を OPERATIONS の順のタプルに変換"""
+    if isinstance(operations, str):
+        operations = [operation.strip() for operation in operations.split(',') if operation.strip()]
+    if not operations or not isinstance(operations, list) \
+            or any(operation not in OPERATIONS for operation in operations):
+        raise GeneratorError('Invalid operations')
+    return tuple(operation for operation in OPERATIONS if operation in operations)
+
+
+def generate_problems(operations, count, spec=None, seed=None):
+    """
+    演算ごとに count 問を生成
+
+    Args:
+        operations: 演算のリスト（またはカンマ区切りの文字列）
+        count: 1演算あたりの問題数
+        spec: 生成条件（ProblemSpec。省略時は1桁・負の答えなし・割り切れる問題のみ）
+        seed: 乱数のシード（省略した場合はサーバーで決めて返す）
+
+    Returns:
+        dict: {"seed": ..., "engine": "numpy" | "python", "spec": {...},
+               "problems": {演算: {"operand1": [...], "operand2": [...], "answer": [...], "remainder": [...]}}}
+    """
+    operations = parse_operations(operations)
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_COUNT:
+        raise GeneratorError('Invalid count')
+    if seed is None:
+        seed = random.randint(0, MAX_SEED)
+    if not isinstance(seed, int) or isinstance(seed, bool) or not 0 <= seed <= MAX_SEED:
+        raise GeneratorError('Invalid seed')
+    spec = spec or ProblemSpec()
+
+    engine = get_engine()
+    generate = _generate_np if engine == 'numpy' else _generate_py
+    problems = {}
+    for operation in operations:
+        problems[operation] = generate(operation, spec, count, seed)
+    return {
+        'seed': seed,
+        'engine': engine,
+        'spec': spec.to_dict(),
+        'problems': problems,
+    }
+
+
+def to_rows(result):
+    """列形式の結果を、クライアント（shisokuLogic.js）の問題と同じ形式の行に変換"""
+    rows = []
+    requires_remainder = not result['spec']['exact_division']
+    for operation, columns in result['problems'].items():
+        for a, b, answer, remainder in zip(columns['operand1'], columns['operand2'],
+                                           columns['answer'], columns['remainder']):
+            rows.append({
+                'id': len(rows),
+                'operation': operation,
+                'operand1': a,
+                'operand2': b,
+                'correct_answer': answer,
+                'correct_remainder': remainder,
+                'requires_remainder': operation == 'divide' and requires_remainder,
+                'operator_symbol': OPERATOR_SYMBOLS[operation],
+            })
+    return rows
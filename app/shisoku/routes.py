@@ -1,8 +1,15 @@
 """
 四則演算練習アプリケーション - ルート定義
 """
-from flask import render_template, jsonify, current_app
+from flask import request, render_template, jsonify, current_app
+from app.common.responses import PreparedBody, not_modified, send_prepared
 from . import shisoku_bp
+from .generator import GeneratorError, ProblemSpec, generate_problems, get_engine, parse_operations, to_rows
+
+# シードを指定した問題セットは内容が変わらないため、ブラウザ・中継サーバーにキャッシュさせる
+PROBLEMS_CACHE_CONTROL = 'public, max-age=86400'
+
+PROBLEM_FORMATS = ('columns', 'rows')
 
 
 @shisoku_bp.route('/', methods=['GET'])
@@ -11,6 +18,110 @@ def index():
     return render_template('shisoku/index.html')
 
 
+def _flag(value, default):
+    """クエリ文字列・JSON の真偽値（true/false, 1/0, "true"/"false", "1"/"0"）"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        if value.lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if value.lower() in ('0', 'false', 'no', 'off'):
+            return False
+    raise GeneratorError('Invalid flag')
+
+
+def _problem_params():
+    """GET のクエリ文字列、または POST の JSON から生成の条件を取り出す"""
+    if request.method == 'GET':
+        args = request.args
+        try:
+            count = int(args.get('count') or 20)
+            seed = int(args['seed']) if args.get('seed') else None
+            digits = int(args.get('digits') or 1)
+            digits1 = int(args.get('digits1') or digits)
+            digits2 = int(args.get('digits2') or digits)
+        except ValueError:
+            raise GeneratorError('Invalid count, seed or digits')
+        spec = ProblemSpec(
+            digits1, digits2,
+            no_negative=_flag(args.get('no_negative'), True),
+            exact_division=_flag(args.get('exact_division'), True),
+            no_carry=_flag(args.get('no_carry'), False),
+        )
+        return (args.get('operations', ''), count, spec, seed,
+                args.get('format', 'columns'), seed is not None)
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise GeneratorError('No JSON data provided')
+    digits = data.get('digits', 1)
+    spec = ProblemSpec(
+        data.get('digits1', digits), data.get('digits2', digits),
+        no_negative=_flag(data.get('no_negative'), True),
+        exact_division=_flag(data.get('exact_division'), True),
+        no_carry=_flag(data.get('no_carry'), False),
+    )
+    # POST の応答はキャッシュされないため、条件付き GET の対象にしない
+    return (data.get('operations', []), data.get('count', 20), spec, data.get('seed'),
+            data.get('format', 'columns'), False)
+
+
+@shisoku_bp.route('/api/problems', methods=['GET', 'POST'])
+def get_problems():
+    """
+    問題セットをサーバーで一括生成（印刷用の宿題・再現可能なテスト）
+
+    GET /shisoku/api/problems?operations=add,divide&count=100&digits1=2&digits2=1&no_carry=1&seed=42
+    POST /shisoku/api/problems
+    {
+        "operations": ["add", "subtract", "multiply", "divide"],
+        "count": 100,
+        "digits1": 2,
+        "digits2": 1,
+        "no_negative": true,
+        "exact_division": true,
+        "no_carry": false,
+        "seed": 42,
+        "format": "columns" or "rows"
+    }
+
+    columns は演算ごとの配列（operand1 / operand2 / answer / remainder）、
+    rows は shisokuLogic.js の問題と同じ形式のリストで返します。
+    同じ条件（シードを含む）からは常に同じ問題セットを返します。
+    シードを省略した場合は、サーバーで決めたシードを応答に含めます。
+    """
+    try:
+        operations, count, spec, seed, output_format, cacheable = _problem_params()
+        if output_format not in PROBLEM_FORMATS:
+            raise GeneratorError('Invalid format')
+
+        etag = None
+        if cacheable:
+            # 生成前に条件から ETag を決め、再検証は生成せずに 304 を返す
+            flags = ''.join(str(int(value)) for value in
+                            (spec.no_negative, spec.exact_division, spec.no_carry))
+            etag = (f"shisoku-problems-{'.'.join(parse_operations(operations))}-{count}"
+                    f"-{spec.digits1}.{spec.digits2}.{flags}-{seed}-{output_format}-{get_engine()}")
+            response = not_modified(etag, PROBLEMS_CACHE_CONTROL)
+            if response is not None:
+                return response
+
+        result = generate_problems(operations, count, spec, seed)
+        if output_format == 'rows':
+            result['problems'] = to_rows(result)
+        if etag is None:
+            return send_prepared(PreparedBody.from_json(result, f"shisoku-problems-{result['seed']}"),
+                                 cache_control='no-store')
+        return send_prepared(PreparedBody.from_json(result, etag),
+                             cache_control=PROBLEMS_CACHE_CONTROL)
+    except GeneratorError as e:
+        return jsonify({'error': str(e)}), 400
+
+
 @shisoku_bp.errorhandler(404)
 def not_found(error):
     """404エラーハンドラ"""
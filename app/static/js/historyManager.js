@@ -1,20 +1,48 @@
 /**
  * 学習履歴管理モジュール
  * LocalStorageを使用して、全アプリ共通で履歴を管理します
+ *
+ * 保存のたびに履歴全体を書き直さないよう、新しいレコードは小さな追加分のリスト
+ * （study_history_recent）に追記し、一定件数ごと・ページを離れるときにまとめて
+ * 本体（study_history）へ反映します。読み込み時は両方を合わせて返します。
+ *
+ * サーバーとは差分同期します（/rireki/api/sync）
+ * - 未同期のレコードだけを保留キューから送信
+ * - サーバーからは前回の cursor より新しいレコードだけを受信
+ * - 同じ id のレコードは同じものとして扱い、重複しません
  */
 class HistoryManager {
   constructor() {
     this.storageKey = 'study_history';
+    this.recentKey = 'study_history_recent';    // 本体に未反映の追加分
+    this.pendingKey = 'study_history_pending';  // 未同期のレコード
+    this.cursorKey = 'study_history_cursor';    // サーバーが返した同期位置
+    this.clientIdKey = 'study_client_id';       // 端末の識別子
     this.maxRecordsPerApp = 50;  // アプリ別に最大50件保持
+    this.mergeThreshold = 20;    // 追加分がこの件数に達したら本体へ反映
+    this.syncUrl = '/rireki/api/sync';
+    this.syncBatchSize = 200;    // 1回の同期で送る最大件数
+    this.compressThreshold = 1024;  // これ以上の本文は gzip で送信
+    this._syncing = false;
+
+    this._assignLegacyIds();
+    window.addEventListener('online', () => this._syncToServer());
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'hidden') {
+        this._mergeRecent();
+      }
+    });
+    this._syncToServer();
   }
 
   /**
-   * 履歴データを取得
+   * 履歴データを取得（本体に未反映の追加分を含む）
    * @returns {Object} 履歴データ（{appId: [{...}, {...}], ...}）
    */
   getHistory() {
-    const data = localStorage.getItem(this.storageKey);
-    return data ? JSON.parse(data) : {};
+    const recent = this._getRecent();
+    const history = this._getStoredHistory();
+    return recent.length > 0 ? this._applyRecent(history, recent) : history;
   }
 
   /**
@@ -23,32 +51,29 @@ class HistoryManager {
    * @param {Object} record - 保存するレコード
    */
   saveRecord(appId, record) {
-    const history = this.getHistory();
-
-    if (!history[appId]) {
-      history[appId] = [];
-    }
-
-    // 新しいレコードを先頭に追加（メタデータ自動付加）
-    history[appId].unshift({
-      date: this.getTodayDate(),
-      time: this.getCurrentTime(),
-      timestamp: Math.floor(Date.now() / 1000),
-      ...record,
-      correctRate: Math.round(
-        (record.correctCount / record.totalCount) * 100
-      )
-    });
-
-    // 最大件数を超えた場合は古い順に削除
-    if (history[appId].length > this.maxRecordsPerApp) {
-      history[appId] = history[appId].slice(0, this.maxRecordsPerApp);
-    }
+    // メタデータを自動付加
+    const item = {
+      appId,
+      record: {
+        id: this._generateId(),
+        date: this.getTodayDate(),
+        time: this.getCurrentTime(),
+        timestamp: Math.floor(Date.now() / 1000),
+        ...record,
+        correctRate: Math.round(
+          (record.correctCount / record.totalCount) * 100
+        )
+      }
+    };
 
-    localStorage.setItem(this.storageKey, JSON.stringify(history));
+    // 履歴全体ではなく追加分のリストにだけ書き込む
+    this._addRecent([item]);
 
-    // サーバーに非同期で送信（将来のDB保存対応）
-    this._syncToServer(appId, history[appId][0]);
+    // 保留キューに追加してサーバーに非同期で送信
+    const pending = this._getPending();
+    pending.push(item);
+    this._setPending(pending);
+    this._syncToServer();
   }
 
   /**
@@ -125,11 +150,13 @@ class HistoryManager {
    */
   clearHistory(appId = null) {
     if (appId) {
-      const history = this.getHistory();
+      this._mergeRecent();
+      const history = this._getStoredHistory();
       history[appId] = [];
       localStorage.setItem(this.storageKey, JSON.stringify(history));
     } else {
       localStorage.removeItem(this.storageKey);
+      localStorage.removeItem(this.recentKey);
     }
   }
 
@@ -149,22 +176,219 @@ class HistoryManager {
     try {
       const data = JSON.parse(jsonData);
       localStorage.setItem(this.storageKey, JSON.stringify(data));
+      localStorage.removeItem(this.recentKey);
     } catch (error) {
       console.error('履歴のインポートに失敗しました:', error);
     }
   }
 
   /**
-   * サーバーに履歴を同期（将来のDB保存対応）
+   * サーバーと差分同期
+   * 保留キューを送信し、サーバー側の新しいレコードを取り込みます。
+   * オフラインの場合は保留キューを残し、次回（online イベント等）に再送します。
+   * @private
+   */
+  async _syncToServer() {
+    if (this._syncing || !navigator.onLine) {
+      return;
+    }
+    this._syncing = true;
+
+    try {
+      let hasMore = true;
+      while (hasMore) {
+        const batch = this._getPending().slice(0, this.syncBatchSize);
+        const result = await this._postSync({
+          userId: this._getClientId(),
+          cursor: Number(localStorage.getItem(this.cursorKey)) || 0,
+          records: batch
+        });
+
+        // 送信済みのレコードを保留キューから削除（保存・重複・不正のいずれも再送しない）
+        const sentIds = new Set(batch.map(item => item.record.id));
+        this._setPending(this._getPending().filter(item => !sentIds.has(item.record.id)));
+
+        this._mergeRecords(result.records);
+        localStorage.setItem(this.cursorKey, String(result.cursor));
+
+        hasMore = result.hasMore || this._getPending().length > 0;
+      }
+    } catch (err) {
+      console.log('オフライン（履歴はローカルに保存）');
+    } finally {
+      this._syncing = false;
+    }
+  }
+
+  /**
+   * 同期リクエストを送信（大きい本文は gzip で圧縮）
+   * @private
+   */
+  async _postSync(payload) {
+    const json = JSON.stringify(payload);
+    const headers = { 'Content-Type': 'application/json' };
+    let body = json;
+
+    if (json.length >= this.compressThreshold && typeof CompressionStream !== 'undefined') {
+      const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+      body = await new Response(stream).arrayBuffer();
+      headers['Content-Encoding'] = 'gzip';
+    }
+
+    const response = await fetch(this.syncUrl, { method: 'POST', headers, body });
+    if (!response.ok) {
+      throw new Error(`sync failed: ${response.status}`);
+    }
+    return response.json();
+  }
+
+  /**
+   * サーバーから受信したレコードを id で重複を除いて取り込む
+   * （自分が送ったレコードも取り込み後に返ってくるため、新しいものだけを追加分に書き込む）
+   * @private
+   */
+  _mergeRecords(items) {
+    if (!items || items.length === 0) {
+      return;
+    }
+
+    const known = new Set();
+    const history = this.getHistory();
+    Object.keys(history).forEach(appId => {
+      history[appId].forEach(r => known.add(r.id));
+    });
+
+    const added = items.filter(({ record }) => {
+      if (!record || known.has(record.id)) {
+        return false;
+      }
+      known.add(record.id);
+      return true;
+    });
+    this._addRecent(added);
+  }
+
+  /**
+   * 追加分のリストに追記し、一定件数に達したら本体へ反映
+   * @private
+   */
+  _addRecent(items) {
+    if (items.length === 0) {
+      return;
+    }
+    const recent = this._getRecent().concat(items);
+    localStorage.setItem(this.recentKey, JSON.stringify(recent));
+    if (recent.length >= this.mergeThreshold) {
+      this._mergeRecent();
+    }
+  }
+
+  /**
+   * 追加分を本体へ反映（履歴全体の書き直しはここだけ）
+   * @private
+   */
+  _mergeRecent() {
+    const recent = this._getRecent();
+    if (recent.length === 0) {
+      return;
+    }
+    const history = this._applyRecent(this._getStoredHistory(), recent);
+    localStorage.setItem(this.storageKey, JSON.stringify(history));
+    localStorage.removeItem(this.recentKey);
+  }
+
+  /**
+   * 追加分を履歴に重ねる（id の重複を除き、新しい順に最大件数まで）
    * @private
    */
-  _syncToServer(appId, record) {
-    // 将来的に、結果をサーバーに送信する処理を実装
-    // fetch('/rireki/api/save', {
-    //   method: 'POST',
-    //   headers: { 'Content-Type': 'application/json' },
-    //   body: JSON.stringify({ appId, record })
-    // }).catch(err => console.log('オフライン（履歴はローカルに保存）'));
+  _applyRecent(history, recent) {
+    const changed = new Set();
+
+    recent.forEach(({ appId, record }) => {
+      if (!history[appId]) {
+        history[appId] = [];
+      }
+      if (history[appId].some(r => r.id === record.id)) {
+        return;
+      }
+      history[appId].push(record);
+      changed.add(appId);
+    });
+
+    changed.forEach(appId => {
+      history[appId].sort((a, b) => (b.timestamp || 0) - (a.timestamp || 0));
+      history[appId] = history[appId].slice(0, this.maxRecordsPerApp);
+    });
+    return history;
+  }
+
+  /**
+   * id のない旧形式のレコードに id を付け、同期対象にする（初回のみ）
+   * @private
+   */
+  _assignLegacyIds() {
+    if (localStorage.getItem(this.clientIdKey)) {
+      return;
+    }
+
+    const history = this._getStoredHistory();
+    const pending = this._getPending();
+    let assigned = false;
+
+    Object.keys(history).forEach(appId => {
+      history[appId].forEach(record => {
+        if (!record.id) {
+          record.id = this._generateId();
+          pending.push({ appId, record });
+          assigned = true;
+        }
+      });
+    });
+
+    if (assigned) {
+      localStorage.setItem(this.storageKey, JSON.stringify(history));
+      this._setPending(pending);
+    }
+    this._getClientId();
+  }
+
+  _getStoredHistory() {
+    const data = localStorage.getItem(this.storageKey);
+    return data ? JSON.parse(data) : {};
+  }
+
+  _getRecent() {
+    const data = localStorage.getItem(this.recentKey);
+    return data ? JSON.parse(data) : [];
+  }
+
+  _getPending() {
+    const data = localStorage.getItem(this.pendingKey);
+    return data ? JSON.parse(data) : [];
+  }
+
+  _setPending(pending) {
+    if (pending.length > 0) {
+      localStorage.setItem(this.pendingKey, JSON.stringify(pending));
+    } else {
+      localStorage.removeItem(this.pendingKey);
+    }
+  }
+
+  _getClientId() {
+    let clientId = localStorage.getItem(this.clientIdKey);
+    if (!clientId) {
+      clientId = this._generateId();
+      localStorage.setItem(this.clientIdKey, clientId);
+    }
+    return clientId;
+  }
+
+  _generateId() {
+    if (window.crypto && crypto.randomUUID) {
+      return crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
   }
 
   // ヘルパー関数
@@ -267,6 +267,9 @@ class KukuApp {
 
         // フィードバッククリア
         document.getElementById('feedback').innerHTML = '';
+
+        // 回答時間の計測開始
+        this.questionShownAt = Date.now();
     }
 
     /**
@@ -310,7 +313,7 @@ class KukuApp {
         }
 
         const quiz = this.quizLogic.getCurrentQuiz();
-        const isCorrect = this.scorer.score(quiz, userAnswer);
+        const isCorrect = this.scorer.score(quiz, userAnswer, Date.now() - this.questionShownAt);
 
         // モーダルで結果を表示
         this.showResultModal(isCorrect, quiz);
@@ -6,7 +6,8 @@
 // Service Worker登録
 if ('serviceWorker' in navigator) {
     window.addEventListener('load', () => {
-        navigator.serviceWorker.register('/static/sw.js')
+        // 各アプリのページ・API も対象にするため、スコープをサイト全体にする
+        navigator.serviceWorker.register('/static/sw.js', { scope: '/' })
             .then(registration => {
                 console.log('Service Worker registered successfully:', registration);
             })
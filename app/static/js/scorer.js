@@ -13,9 +13,10 @@ class Scorer {
      * 回答を記録して採点
      * @param {object} quiz - 問題オブジェクト
      * @param {number} userAnswer - ユーザーの回答
+     * @param {number} [responseMs] - 問題を表示してから回答するまでの時間（ミリ秒）
      * @returns {boolean} - 正解したかどうか
      */
-    score(quiz, userAnswer) {
+    score(quiz, userAnswer, responseMs) {
         const isCorrect = this.checkAnswer(quiz, userAnswer);
         
         this.answers.push({
@@ -24,7 +25,8 @@ class Scorer {
             multiplier: quiz.multiplier,
             user_answer: userAnswer,
             correct_answer: quiz.correct_answer,
-            is_correct: isCorrect
+            is_correct: isCorrect,
+            response_ms: Math.max(0, Math.round(responseMs || 0))
         });
         
         if (isCorrect) {
@@ -20,8 +20,9 @@ class TankanjiBuddy {
     this.progressKey = (grade) => `tankanji_progress_${grade}_read`;
     this.historyKey = 'tankanji_history';
 
-    // キャッシュ
-    this.allKanjiData = null;
+    // Service Worker が保持する漢字データ（オフライン時の出題に使用）
+    this.kanjiDataUrl = '/tankanji/api/kanji-data';
+    this.kanjiCachePrefix = 'kanji-data-';
 
     this.init();
   }
@@ -81,6 +82,130 @@ class TankanjiBuddy {
 
     // 初期画面表示
     this.showScreen('settingScreen');
+
+    // オフライン用の漢字データを準備
+    this.prefetchKanjiData();
+  }
+
+  /**
+   * 漢字データをService Workerに取得・再検証させる（オフラインでも出題できるようにする）
+   * 保持済みの場合は、新しいバージョンとの差分だけを取得する
+   */
+  prefetchKanjiData() {
+    if (!('serviceWorker' in navigator)) {
+      return;
+    }
+    navigator.serviceWorker.ready
+      .then((registration) => {
+        if (registration.active) {
+          registration.active.postMessage({ type: 'REVALIDATE_KANJI_DATA' });
+        }
+      })
+      .catch((error) => console.log(`${this._debugPrefix} prefetch failed:`, error));
+  }
+
+  /**
+   * Service Workerのキャッシュから漢字データを読み込む（ない場合は null）
+   */
+  async loadCachedKanjiData() {
+    if (!('caches' in window)) {
+      return null;
+    }
+    const names = (await caches.keys()).filter((name) => name.startsWith(this.kanjiCachePrefix));
+    for (const name of names) {
+      const response = await (await caches.open(name)).match(this.kanjiDataUrl);
+      if (response) {
+        return response.json();
+      }
+    }
+    return null;
+  }
+
+  /**
+   * /tankanji/api/sample と同じ出題をキャッシュ済みの漢字データで行う（オフライン用）
+   *
+   * 出題済み状態はサーバーと同じ形式（学年・画数順の位置のビットマップを
+   * '<バージョン先頭8文字>.<base64url>' にしたもの）で更新するため、
+   * オンラインに戻った後もそのまま引き継げる
+   */
+  sampleOffline(dataset, request) {
+    const candidates = dataset.data
+      .filter((item) => request.grades.includes(Number(item.学年)))
+      .map((item, index) => ({ item, index }))
+      .sort((a, b) => (Number(a.item.学年) - Number(b.item.学年))
+        || (Number(a.item.画数) - Number(b.item.画数)) || (a.index - b.index))
+      .map(({ item }) => item);
+    const size = candidates.length;
+    if (size === 0) {
+      return { status: 'success', data: [], state: request.state || '', remaining: 0, total: 0, reset: false };
+    }
+
+    const prefix = dataset.version.slice(0, 8);
+    const bits = new Uint8Array(Math.ceil(size / 8));
+    let reset = false;
+    if (request.state) {
+      const [statePrefix, encoded] = request.state.split('.');
+      if (statePrefix === prefix) {
+        let binary = '';
+        try {
+          binary = atob((encoded || '').replace(/-/g, '+').replace(/_/g, '/'));
+        } catch (e) {
+          reset = true;
+        }
+        for (let i = 0; i < Math.min(binary.length, bits.length); i++) {
+          bits[i] = binary.charCodeAt(i);
+        }
+      } else {
+        reset = true;
+      }
+    } else if (request.used_ids) {
+      const usedIds = new Set(request.used_ids.map(String));
+      candidates.forEach((item, position) => {
+        if (usedIds.has(String(item.ID))) {
+          bits[position >> 3] |= 1 << (position & 7);
+        }
+      });
+    }
+    if (size % 8) {
+      bits[bits.length - 1] &= (1 << (size % 8)) - 1;
+    }
+
+    const isUsed = (position) => (bits[position >> 3] >> (position & 7)) & 1;
+    let free = [];
+    for (let position = 0; position < size; position++) {
+      if (!isUsed(position)) {
+        free.push(position);
+      }
+    }
+    // 全て出題済みの場合はリセット
+    if (free.length === 0) {
+      bits.fill(0);
+      free = candidates.map((_, position) => position);
+      reset = true;
+    }
+
+    const positions = request.order === 'stroke'
+      ? free.slice(0, request.count)
+      : this.shuffleArray(free).slice(0, request.count);
+    positions.forEach((position) => {
+      bits[position >> 3] |= 1 << (position & 7);
+    });
+
+    let length = bits.length;
+    while (length > 0 && bits[length - 1] === 0) {
+      length--;
+    }
+    const encoded = btoa(String.fromCharCode(...bits.subarray(0, length)))
+      .replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '');
+
+    return {
+      status: 'success',
+      data: positions.map((position) => candidates[position]),
+      state: `${prefix}.${encoded}`,
+      remaining: free.length - positions.length,
+      total: size,
+      reset
+    };
   }
 
   onGradeSelect(e) {
@@ -125,85 +250,67 @@ class TankanjiBuddy {
       alert('学年と出題の順序を選択してください');
       return;
     }
-    // 漢字データの取得
-    if (!this.allKanjiData) {
-      try {
-        const response = await fetch('/tankanji/api/kanji-data');
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const result = await response.json();
-        if (result.status === 'error') {
-          throw new Error(result.message);
-        }
-        this.allKanjiData = result.data;
-        console.log(`${this._debugPrefix} kanji dataset loaded: total=${this.allKanjiData.length}`);
-      } catch (error) {
+    // 出題済み状態（サーバーが返すビットマップ。旧形式はIDの配列）
+    const progressKey = this.progressKey(this.selectedGrade);
+    const storedProgress = localStorage.getItem(progressKey);
+    console.log(`${this._debugPrefix} progressKey=${progressKey}`);
+
+    const request = {
+      grades: [this.selectedGrade],
+      count: 10,
+      order: this.selectedOrder
+    };
+    if (storedProgress && storedProgress.startsWith('[')) {
+      request.used_ids = JSON.parse(storedProgress);
+    } else if (storedProgress) {
+      request.state = storedProgress;
+    }
+
+    // 未出題の漢字10問をサーバーで抽出
+    let result;
+    try {
+      const response = await fetch('/tankanji/api/sample', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(request)
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      result = await response.json();
+      if (result.status === 'error') {
+        throw new Error(result.message);
+      }
+    } catch (error) {
+      // オフライン等でサーバーに接続できない場合は、保持している漢字データから出題
+      const offline = error instanceof TypeError || !navigator.onLine;
+      const dataset = offline ? await this.loadCachedKanjiData().catch(() => null) : null;
+      if (!dataset) {
         console.error('漢字データ取得エラー:', error);
         alert('漢字データが読み込めません: ' + error.message);
         return;
       }
+      console.log(`${this._debugPrefix} sample offline (version=${dataset.version.slice(0, 8)}):`, error);
+      result = this.sampleOffline(dataset, request);
     }
 
-    // 学年別の漢字データを取得
-    const gradeKanjis = this.allKanjiData.filter(
-      (item) => item.学年 === this.selectedGrade.toString()
-    );
-    console.log(`${this._debugPrefix} gradeKanjis count=${gradeKanjis.length}`);
-
-    if (gradeKanjis.length === 0) {
+    if (result.data.length === 0) {
       alert('該当する漢字がありません');
       return;
     }
-
-    // 出題済みIDを取得
-    const progressKey = this.progressKey(this.selectedGrade);
-    const usedIds = JSON.parse(localStorage.getItem(progressKey) || '[]');
-    console.log(`${this._debugPrefix} progressKey=${progressKey}`);
-    console.log(`${this._debugPrefix} usedIds length=${usedIds.length} sample=`, usedIds.slice(0, 20));
-    if (usedIds.length > 0) {
-      console.log(`${this._debugPrefix} usedIds type sample=${typeof usedIds[0]}`);
+    if (result.reset) {
+      console.log(`${this._debugPrefix} all used for key=${progressKey}, progress reset`);
     }
 
-    // 出題対象の漢字を抽出
-    let availableKanjis = gradeKanjis.filter(
-      (item) => !usedIds.includes(item['ID'])
-    );
-    console.log(`${this._debugPrefix} availableKanjis before reset count=${availableKanjis.length}`);
-
-    // 全て出題済みの場合、リセット
-    if (availableKanjis.length === 0) {
-      localStorage.removeItem(progressKey);
-      availableKanjis = gradeKanjis;
-      usedIds.length = 0;
-      console.log(`${this._debugPrefix} all used for key=${progressKey}, progress reset. availableKanjis count=${availableKanjis.length}`);
-    }
-
-    // 順序でソート
-    if (this.selectedOrder === 'stroke') {
-      availableKanjis.sort((a, b) => parseInt(a.画数) - parseInt(b.画数));
-      console.log(`${this._debugPrefix} order=stroke (画数順) applied`);
-    } else if (this.selectedOrder === 'random') {
-      availableKanjis = this.shuffleArray(availableKanjis);
-      console.log(`${this._debugPrefix} order=random applied`);
-    }
-
-    // 10問を抽出
-    this.quizList = availableKanjis.slice(0, 10);
+    this.quizList = result.data;
     this.currentQuestionIndex = 0;
     this.sessionHistory = [];
-    const quizIds = this.quizList.map((item) => item['ID']);
-    console.log(`${this._debugPrefix} quizList selected count=${this.quizList.length} IDs=`, quizIds);
-    const dupCount = quizIds.filter((id) => usedIds.includes(id)).length;
-    console.log(`${this._debugPrefix} duplicates vs usedIds count=${dupCount}`);
-
-    // 出題済みIDリストを更新
-    const newUsedIds = usedIds.concat(
-      this.quizList.map((item) => item['ID'])
-    );
-    localStorage.setItem(progressKey, JSON.stringify(newUsedIds));
-    const verifyIds = JSON.parse(localStorage.getItem(progressKey) || '[]');
-    console.log(`${this._debugPrefix} newUsedIds length=${newUsedIds.length}, verify length=${verifyIds.length}`);
+    console.log(`${this._debugPrefix} quizList selected count=${this.quizList.length} IDs=`,
+      this.quizList.map((item) => item['ID']));
+
+    // 出題済み状態を更新
+    localStorage.setItem(progressKey, result.state);
+    console.log(`${this._debugPrefix} remaining=${result.remaining}/${result.total}`);
 
     // クイズ画面に遷移
     this.showQuiz();
@@ -14,6 +14,166 @@ const ASSETS_TO_CACHE = [
     // 各アプリのキャッシュは個別に管理
 ];
 
+// 漢字データセット（バージョンごとのキャッシュに保持し、差分で更新する）
+const KANJI_DATA_URL = '/tankanji/api/kanji-data';
+const KANJI_VERSION_URL = '/tankanji/api/kanji-version';
+const KANJI_DIFF_URL = '/tankanji/api/kanji-diff';
+const KANJI_CACHE_PREFIX = 'kanji-data-';
+// バックグラウンドでの再検証の最短間隔（ミリ秒）
+const KANJI_REVALIDATE_INTERVAL = 5 * 60 * 1000;
+
+let kanjiRevalidatedAt = 0;
+let kanjiRevalidating = null;
+
+/**
+ * 保持している漢字データのキャッシュ（ない場合は null）
+ */
+async function openKanjiCache() {
+    const names = (await caches.keys()).filter((name) => name.startsWith(KANJI_CACHE_PREFIX));
+    for (const name of names) {
+        const cache = await caches.open(name);
+        const response = await cache.match(KANJI_DATA_URL);
+        if (response) {
+            return { version: name.slice(KANJI_CACHE_PREFIX.length), cache, response };
+        }
+    }
+    return null;
+}
+
+/**
+ * 漢字データを新しいバージョンのキャッシュに保存し、古いバージョンを削除
+ */
+async function storeKanjiData(payload) {
+    const name = KANJI_CACHE_PREFIX + payload.version;
+    const cache = await caches.open(name);
+    await cache.put(KANJI_DATA_URL, new Response(JSON.stringify(payload), {
+        headers: { 'Content-Type': 'application/json; charset=utf-8' }
+    }));
+    const names = await caches.keys();
+    await Promise.all(names
+        .filter((other) => other.startsWith(KANJI_CACHE_PREFIX) && other !== name)
+        .map((other) => caches.delete(other)));
+    return payload;
+}
+
+async function fetchFullKanjiData() {
+    const response = await fetch(KANJI_DATA_URL, { cache: 'no-cache' });
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const payload = await response.json();
+    if (payload.status !== 'success') {
+        throw new Error(payload.message);
+    }
+    return storeKanjiData(payload);
+}
+
+/**
+ * 差分（upserts / removed）を適用して新しいバージョンのデータを作る
+ */
+function applyKanjiDiff(payload, diff) {
+    const records = new Map(payload.data.map((record) => [String(record.ID), record]));
+    diff.upserts.forEach((record) => records.set(String(record.ID), record));
+    diff.removed.forEach((id) => records.delete(String(id)));
+    const data = Array.from(records.values()).sort((a, b) => Number(a.ID) - Number(b.ID));
+    return { status: 'success', data, total: data.length, version: diff.version };
+}
+
+async function notifyKanjiUpdated(version) {
+    const clientList = await self.clients.matchAll();
+    clientList.forEach((client) => client.postMessage({ type: 'KANJI_DATA_UPDATED', version }));
+}
+
+/**
+ * 保持している漢字データを再検証し、新しいバージョンがあれば差分で更新
+ * 差分を作れない場合（古すぎるバージョン等）は全データを取得し直す
+ */
+async function revalidateKanjiData(force = false) {
+    if (!force && Date.now() - kanjiRevalidatedAt < KANJI_REVALIDATE_INTERVAL) {
+        return null;
+    }
+    const cached = await openKanjiCache();
+    if (!cached) {
+        const payload = await fetchFullKanjiData();
+        kanjiRevalidatedAt = Date.now();
+        return payload;
+    }
+
+    const versionResponse = await fetch(KANJI_VERSION_URL, { cache: 'no-cache' });
+    const current = await versionResponse.json();
+    kanjiRevalidatedAt = Date.now();
+    if (current.status !== 'success' || current.version === cached.version) {
+        return null;
+    }
+
+    const params = new URLSearchParams({ from: cached.version, to: current.version });
+    const diffResponse = await fetch(`${KANJI_DIFF_URL}?${params}`);
+    let payload;
+    if (diffResponse.ok) {
+        const diff = await diffResponse.json();
+        payload = applyKanjiDiff(await cached.response.json(), diff);
+        if (payload.total !== diff.total) {
+            payload = null;
+        }
+    }
+    payload = payload ? await storeKanjiData(payload) : await fetchFullKanjiData();
+    console.log('Kanji data updated:', cached.version.slice(0, 8), '->', payload.version.slice(0, 8));
+    await notifyKanjiUpdated(payload.version);
+    return payload;
+}
+
+function scheduleKanjiRevalidation(force = false) {
+    if (!kanjiRevalidating) {
+        kanjiRevalidating = revalidateKanjiData(force)
+            .catch((error) => console.log('Kanji data revalidation failed:', error))
+            .finally(() => {
+                kanjiRevalidating = null;
+            });
+    }
+    return kanjiRevalidating;
+}
+
+/**
+ * 漢字データはキャッシュから即座に返し、バックグラウンドで再検証する
+ */
+async function respondKanjiData(event) {
+    const cached = await openKanjiCache();
+    if (cached) {
+        event.waitUntil(scheduleKanjiRevalidation());
+        return cached.response;
+    }
+    const payload = await fetchFullKanjiData();
+    kanjiRevalidatedAt = Date.now();
+    return new Response(JSON.stringify(payload), {
+        headers: { 'Content-Type': 'application/json; charset=utf-8' }
+    });
+}
+
+/**
+ * ページの取得（ネットワークファースト）
+ * 取得できたページはオフライン用にキャッシュし、オフライン時のみキャッシュから返す
+ */
+async function respondNavigation(request) {
+    try {
+        const response = await fetch(request);
+        if (response && response.status === 200 && response.type === 'basic') {
+            const responseToCache = response.clone();
+            caches.open(CACHE_NAME).then((cache) => cache.put(request, responseToCache));
+        }
+        return response;
+    } catch (err) {
+        const cached = await caches.match(request);
+        if (cached) {
+            return cached;
+        }
+        return new Response('Offline - Page not available', {
+            status: 503,
+            statusText: 'Service Unavailable',
+            headers: new Headers({ 'Content-Type': 'text/plain; charset=utf-8' })
+        });
+    }
+}
+
 // インストール時
 self.addEventListener('install', (event) => {
     console.log('Service Worker installing...');
@@ -37,7 +197,8 @@ self.addEventListener('activate', (event) => {
             .then((cacheNames) => {
                 return Promise.all(
                     cacheNames.map((cacheName) => {
-                        if (cacheName !== CACHE_NAME) {
+                        // 漢字データセットはバージョンごとに別途管理
+                        if (cacheName !== CACHE_NAME && !cacheName.startsWith(KANJI_CACHE_PREFIX)) {
                             console.log('Deleting old cache:', cacheName);
                             return caches.delete(cacheName);
                         }
@@ -52,6 +213,25 @@ self.addEventListener('activate', (event) => {
 
 // フェッチイベント処理
 self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    if (event.request.method === 'GET' && url.origin === self.location.origin
+            && url.pathname === KANJI_DATA_URL) {
+        event.respondWith(
+            respondKanjiData(event).catch(() => new Response(
+                JSON.stringify({ status: 'error', message: 'Offline - Kanji data not available' }),
+                { status: 503, headers: { 'Content-Type': 'application/json; charset=utf-8' } }
+            ))
+        );
+        return;
+    }
+
+    // ページ（ナビゲーション）はネットワークファースト
+    // スコープがサイト全体のため、キャッシュファーストにするとテンプレートだけの更新が反映されない
+    if (event.request.mode === 'navigate') {
+        event.respondWith(respondNavigation(event.request));
+        return;
+    }
+
     // APIリクエストはネットワークファースト
     if (event.request.url.includes('/api/')) {
         event.respondWith(
@@ -103,4 +283,8 @@ self.addEventListener('message', (event) => {
     if (event.data && event.data.type === 'SKIP_WAITING') {
         self.skipWaiting();
     }
+    // ページからの漢字データの取得・再検証の依頼
+    if (event.data && event.data.type === 'REVALIDATE_KANJI_DATA') {
+        event.waitUntil(scheduleKanjiRevalidation(Boolean(event.data.force)));
+    }
 });
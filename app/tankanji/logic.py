@@ -0,0 +1,380 @@
+"""
+単漢字練習 - 漢字データの検索・出題ロジック
+
+KanjiLoader のインデックス（学年、(学年, 画数)、ID）を使って
+条件に合うレコードだけを取り出します。全件を走査することはありません。
+"""
+import base64
+import random
+from bisect import bisect_right
+from itertools import islice
+
+from app.common.kanji_loader import COLUMNS, KanjiLoader
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+
+
+class QueryError(ValueError):
+    """検索条件が不正"""
+
+
+def parse_int_list(value, name):
+    """カンマ区切りの整数リストを解析"""
+    if not value:
+        return None
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise QueryError(f'Invalid {name}')
+
+
+def parse_int(value, name, default=None):
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(f'Invalid {name}')
+
+
+def parse_fields(value):
+    """射影する列名のリストを解析（省略時は全列）"""
+    if not value:
+        return COLUMNS
+    fields = tuple(field.strip() for field in value.split(',') if field.strip())
+    unknown = [field for field in fields if field not in COLUMNS]
+    if unknown:
+        raise QueryError(f'Unknown fields: {",".join(unknown)}')
+    return fields
+
+
+def encode_cursor(version, offset):
+    return f'{version[:8]}.{offset}'
+
+
+def decode_cursor(cursor, version):
+    """カーソルを解析してオフセットを返す（データ更新後のカーソルは無効）"""
+    if not cursor:
+        return 0
+    prefix, _, offset = cursor.partition('.')
+    if prefix != version[:8]:
+        raise QueryError('Cursor expired')
+    try:
+        offset = int(offset)
+    except ValueError:
+        raise QueryError('Invalid cursor')
+    if offset < 0:
+        raise QueryError('Invalid cursor')
+    return offset
+
+
+def iter_matching_groups(store, grades=None, min_strokes=None, max_strokes=None):
+    """条件に合う (学年, 画数) グループを学年・画数の昇順に列挙"""
+    grades = sorted(set(grades)) if grades else store.grades
+    for grade in grades:
+        for strokes in store.strokes_by_grade.get(grade, ()):
+            if min_strokes is not None and strokes < min_strokes:
+                continue
+            if max_strokes is not None and strokes > max_strokes:
+                break
+            yield store.by_grade_strokes[(grade, strokes)]
+
+
+def find_kanji(grades=None, min_strokes=None, max_strokes=None, ids=None):
+    """
+    条件に合うレコードの列と件数を返す
+
+    IDを指定した場合は指定順、それ以外は学年・画数・CSVの順に並びます。
+    列はスライスでページを取り出せます（先頭から数え直さない）。
+
+    Returns:
+        tuple: (レコードの列, 件数)
+    """
+    store = KanjiLoader.get_store()
+
+    if ids is not None:
+        matched = []
+        for kanji_id in ids:
+            record = store.by_id.get(kanji_id)
+            if record is None:
+                continue
+            if grades and record.grade not in grades:
+                continue
+            if min_strokes is not None and record.strokes < min_strokes:
+                continue
+            if max_strokes is not None and record.strokes > max_strokes:
+                continue
+            matched.append(record)
+        return matched, len(matched)
+
+    records = CandidateIndex(list(iter_matching_groups(store, grades, min_strokes, max_strokes)))
+    return records, len(records)
+
+
+def query_kanji(args):
+    """
+    クエリパラメータから漢字データを検索
+
+    パラメータ:
+        grades: 学年（カンマ区切り）
+        min_strokes / max_strokes: 画数の範囲
+        ids: ID（カンマ区切り）
+        fields: 返す列（カンマ区切り、例: ID,漢字,音読み）
+        cursor: 前のページの next_cursor
+        limit: 1ページの件数（最大 MAX_LIMIT）
+
+    Returns:
+        dict: APIの応答データ
+    """
+    version = KanjiLoader.version()
+    grades = parse_int_list(args.get('grades'), 'grades')
+    ids = parse_int_list(args.get('ids'), 'ids')
+    min_strokes = parse_int(args.get('min_strokes'), 'min_strokes')
+    max_strokes = parse_int(args.get('max_strokes'), 'max_strokes')
+    fields = parse_fields(args.get('fields'))
+    limit = parse_int(args.get('limit'), 'limit', DEFAULT_LIMIT)
+    offset = decode_cursor(args.get('cursor'), version)
+
+    if not 1 <= limit <= MAX_LIMIT:
+        raise QueryError('Invalid limit')
+
+    records, total = find_kanji(grades, min_strokes, max_strokes, ids)
+    page = records[offset:offset + limit]
+
+    indexes = [COLUMNS.index(field) for field in fields]
+    data = []
+    for record in page:
+        values = record.values()
+        data.append({COLUMNS[i]: values[i] for i in indexes})
+
+    next_offset = offset + len(page)
+    return {
+        'status': 'success',
+        'data': data,
+        'total': total,
+        'next_cursor': encode_cursor(version, next_offset) if next_offset < total else None,
+        'version': version
+    }
+
+
+# ---------------------------------------------------------------------------
+# データセットの差分
+# ---------------------------------------------------------------------------
+
+def diff_kanji(from_version, to_version=None):
+    """
+    2つのバージョン間で変わった漢字レコードを返す
+
+    クライアントは upserts をIDで置き換え（追加）し、removed のIDを削除して、
+    ID順に並べると to_version の全データと一致します。
+
+    Returns:
+        dict: APIの応答データ（from_version のスナップショットがない場合は None）
+    """
+    current = KanjiLoader.get_store()
+    to_version = to_version or current.version
+    if to_version != current.version:
+        raise QueryError('Unknown target version')
+
+    previous = KanjiLoader.load_snapshot(from_version)
+    if previous is None:
+        return None
+
+    upserts = []
+    for record in current.records:
+        old = previous.by_id.get(record.id)
+        if old is None or old.values() != record.values():
+            upserts.append(record.to_dict())
+    removed = sorted(kanji_id for kanji_id in previous.by_id if kanji_id not in current.by_id)
+
+    return {
+        'status': 'success',
+        'from': from_version,
+        'version': to_version,
+        'upserts': upserts,
+        'removed': removed,
+        'total': len(current)
+    }
+
+
+# ---------------------------------------------------------------------------
+# 出題のサンプリング
+# ---------------------------------------------------------------------------
+
+MAX_SAMPLE_COUNT = 100
+
+
+class CandidateIndex:
+    """
+    検索結果・出題候補（学年・画数順）の位置 -> レコードの対応
+
+    (学年, 画数) グループの累積件数だけを保持し、位置からレコードを
+    二分探索で引くため、候補リストを組み立てる必要がありません。
+    スライスは開始位置のグループから必要な件数だけを取り出します（ページング用）。
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.offsets = []
+        total = 0
+        for group in groups:
+            self.offsets.append(total)
+            total += len(group)
+        self.size = total
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return self._slice(position)
+        i = bisect_right(self.offsets, position) - 1
+        return self.groups[i][position - self.offsets[i]]
+
+    def _slice(self, span):
+        start, stop, step = span.indices(self.size)
+        if step != 1:
+            raise ValueError('Slice step is not supported')
+        result = []
+        i = bisect_right(self.offsets, start) - 1
+        while start < stop and i < len(self.groups):
+            begin = start - self.offsets[i]
+            chunk = self.groups[i][begin:begin + stop - start]
+            result.extend(chunk)
+            start += len(chunk)
+            i += 1
+        return result
+
+    def position_of(self, record):
+        """レコードの位置（候補にない場合は None）"""
+        for offset, group in zip(self.offsets, self.groups):
+            if group and group[0].grade == record.grade and group[0].strokes == record.strokes:
+                return offset + group.index(record)
+        return None
+
+
+def encode_state(version, mask):
+    """出題済みビットマップを '<バージョン>.<base64url>' 形式に変換"""
+    raw = mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+    return f"{version[:8]}.{base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')}"
+
+
+def decode_state(state, version):
+    """
+    出題済み状態を解析してビットマップ（整数）を返す
+
+    データセットのバージョンが異なる場合は位置がずれるため None を返します。
+    """
+    if not state:
+        return 0
+    prefix, _, encoded = state.partition('.')
+    if prefix != version[:8]:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    except (ValueError, TypeError):
+        raise QueryError('Invalid state')
+    return int.from_bytes(raw, 'little')
+
+
+def iter_set_bits(mask):
+    """立っているビットの位置を下位から列挙"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def pick_positions(size, mask, count, order, rng):
+    """
+    未出題の位置を count 件選ぶ
+
+    - stroke: 未出題のうち先頭（画数の少ない順）から count 件
+    - random: 未出題から一様ランダムに非復元抽出
+      抽出後も未出題が半数以上残る場合は棄却サンプリング（期待試行回数 2*count 以下）、
+      それ以外は未出題の位置を列挙して抽出します。
+    """
+    free_mask = ~mask & ((1 << size) - 1)
+
+    if order == 'stroke':
+        return list(islice(iter_set_bits(free_mask), count))
+
+    free = size - bin(mask).count('1')
+    if (free - count) * 2 >= size:
+        picked = []
+        chosen = 0
+        while len(picked) < count:
+            position = rng.randrange(size)
+            bit = 1 << position
+            if (mask | chosen) & bit:
+                continue
+            chosen |= bit
+            picked.append(position)
+        return picked
+
+    return rng.sample(list(iter_set_bits(free_mask)), count)
+
+
+def sample_kanji(grades, count, order='random', state=None, used_ids=None, rng=None):
+    """
+    未出題の漢字を count 件選び、更新後の出題済み状態とともに返す
+
+    Args:
+        grades: 学年のリスト
+        count: 出題数
+        order: 'random' または 'stroke'
+        state: 前回返した出題済み状態（ビットマップ）
+        used_ids: 旧形式（出題済みIDの配列）からの移行用
+        rng: 乱数生成器（テスト・再現用）
+
+    Returns:
+        dict: APIの応答データ
+    """
+    if not grades:
+        raise QueryError('Invalid grades')
+    if not isinstance(count, int) or not 1 <= count <= MAX_SAMPLE_COUNT:
+        raise QueryError('Invalid count')
+    if order not in ('random', 'stroke'):
+        raise QueryError('Invalid order')
+
+    rng = rng or random
+    store = KanjiLoader.get_store()
+    version = store.version
+    candidates = CandidateIndex(list(iter_matching_groups(store, grades)))
+    size = len(candidates)
+    if size == 0:
+        raise QueryError('No kanji for grades')
+
+    mask = decode_state(state, version)
+    reset = mask is None
+    if mask is None:
+        mask = 0
+    elif not state and used_ids:
+        # 旧形式の出題済みID配列をビットマップに変換
+        for kanji_id in used_ids:
+            record = store.by_id.get(int(kanji_id))
+            if record is not None:
+                position = candidates.position_of(record)
+                if position is not None:
+                    mask |= 1 << position
+    mask &= (1 << size) - 1
+
+    # 全て出題済みの場合はリセット
+    if bin(mask).count('1') >= size:
+        mask = 0
+        reset = True
+
+    free = size - bin(mask).count('1')
+    positions = pick_positions(size, mask, min(count, free), order, rng)
+    for position in positions:
+        mask |= 1 << position
+
+    return {
+        'status': 'success',
+        'data': [candidates[position].to_dict() for position in positions],
+        'state': encode_state(version, mask),
+        'remaining': free - len(positions),
+        'total': size,
+        'reset': reset
+    }
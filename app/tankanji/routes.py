@@ -1,10 +1,53 @@
 """
 単漢字練習 - ルート定義
 """
-import json
-from flask import render_template, jsonify
+import hashlib
+
+from flask import current_app, render_template, jsonify, request
+from app.common.cache import cached_view
 from app.common.kanji_loader import KanjiLoader
+from app.common.metrics import record_cache
+from app.common.responses import PreparedBody, not_modified, send_prepared
 from . import tankanji_bp
+from .logic import QueryError, diff_kanji, query_kanji, sample_kanji
+
+# データセットのバージョンごとにシリアライズ済みの応答本文を保持
+_payload_cache = {}
+
+# (差分元のバージョン, 現在のバージョン) -> シリアライズ済みの差分
+_diff_cache = {}
+
+# 差分の応答本文を保持する件数（差分元のバージョンごと）
+DIFF_CACHE_SIZE = 8
+
+# 共有キャッシュの有効期限（秒）。キーにCSVの更新日時・サイズを含むため、更新後は別のキーになる
+KANJI_CACHE_TTL = 24 * 60 * 60
+
+
+def kanji_cache_key(*args, **kwargs):
+    return KanjiLoader.source_signature()
+
+
+def kanji_etag(version):
+    """漢字データセットのバージョンから ETag を生成"""
+    return f'kanji-{version[:20]}'
+
+
+def get_kanji_payload(version):
+    """全漢字データの応答本文（バージョンごとに一度だけシリアライズ）"""
+    prepared = _payload_cache.get(version)
+    record_cache('kanji_payload', prepared is not None)
+    if prepared is None:
+        data = KanjiLoader.load()
+        prepared = PreparedBody.from_json({
+            'status': 'success',
+            'data': [record.to_dict() for record in data],
+            'total': len(data),
+            'version': version
+        }, kanji_etag(version))
+        _payload_cache.clear()
+        _payload_cache[version] = prepared
+    return prepared
 
 
 @tankanji_bp.route('/', methods=['GET'])
@@ -14,15 +57,160 @@ def index():
 
 
 @tankanji_bp.route('/api/kanji-data', methods=['GET'])
+@cached_view('kanji_data', ttl=KANJI_CACHE_TTL, tags=('kanji',), key=kanji_cache_key)
 def get_kanji_data():
-    """全漢字データをJSON形式で返す"""
+    """
+    全漢字データをJSON形式で返す
+
+    データセットのバージョンを ETag とし、If-None-Match が一致すれば 304 を返します。
+    本文はシリアライズ・圧縮済みのものを Accept-Encoding に応じて返します。
+    """
     try:
-        data = KanjiLoader.load()
+        version = KanjiLoader.version()
+        response = not_modified(kanji_etag(version))
+        record_cache('kanji_etag', response is not None)
+        if response is not None:
+            return response
+        return send_prepared(get_kanji_payload(version))
+    except Exception as e:
         return jsonify({
-            'status': 'success',
-            'data': data,
-            'total': len(data)
-        })
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+def get_diff_payload(from_version, version):
+    """差分の応答本文（差分元のスナップショットがない場合は None）"""
+    key = (from_version, version)
+    prepared = _diff_cache.get(key)
+    record_cache('kanji_diff', prepared is not None)
+    if prepared is None:
+        payload = diff_kanji(from_version, version)
+        if payload is None:
+            return None
+        prepared = PreparedBody.from_json(payload, f'{kanji_etag(version)}-from-{from_version[:12]}')
+        if len(_diff_cache) >= DIFF_CACHE_SIZE or any(v != version for _, v in _diff_cache):
+            _diff_cache.clear()
+        _diff_cache[key] = prepared
+    return prepared
+
+
+@tankanji_bp.route('/api/kanji-version', methods=['GET'])
+def get_kanji_version():
+    """
+    漢字データセットの現在のバージョンを返す
+
+    Service Worker がキャッシュしたデータの再検証に使います（本文は数十バイト）。
+    """
+    try:
+        store = KanjiLoader.get_store()
+        try:
+            # 以前のバージョンからの差分を作れるよう、現在のスナップショットを保存
+            KanjiLoader.save_snapshot(store)
+        except OSError as e:
+            current_app.logger.warning(f'Failed to save kanji snapshot: {e}')
+        response = jsonify({'status': 'success', 'version': store.version, 'total': len(store)})
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@tankanji_bp.route('/api/kanji-diff', methods=['GET'])
+def get_kanji_diff():
+    """
+    2つのバージョン間で変わった漢字レコードだけを返す
+
+    例: /tankanji/api/kanji-diff?from=<保持しているバージョン>&to=<現在のバージョン>
+    差分元のスナップショットがない場合は 410 を返すため、全データを取得し直してください。
+    差分の内容は変わらないため、長期間キャッシュさせます。
+    """
+    from_version = request.args.get('from', '')
+    try:
+        version = KanjiLoader.version()
+        to_version = request.args.get('to') or version
+        if to_version != version:
+            # 取得中にデータが更新された場合は、バージョンの取得からやり直させる
+            return jsonify({'status': 'error', 'message': 'Version changed', 'version': version}), 409
+        if from_version == version:
+            return jsonify({'status': 'success', 'from': from_version, 'version': version,
+                            'upserts': [], 'removed': [], 'total': len(KanjiLoader.load())})
+
+        prepared = get_diff_payload(from_version, version)
+        if prepared is None:
+            return jsonify({'status': 'error', 'message': 'Unknown version', 'version': version}), 410
+        return send_prepared(prepared, cache_control='public, max-age=31536000, immutable')
+    except QueryError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@tankanji_bp.route('/api/kanji', methods=['GET'])
+@cached_view('kanji_query', ttl=KANJI_CACHE_TTL, tags=('kanji',), key=kanji_cache_key)
+def search_kanji():
+    """
+    条件を指定して漢字データを返す
+
+    例: /tankanji/api/kanji?grades=1&fields=ID,漢字,音読み&limit=50
+    パラメータは app/tankanji/logic.py の query_kanji を参照。
+    """
+    try:
+        version = KanjiLoader.version()
+        query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items()))
+        etag = kanji_etag(version) + '-' + hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]
+
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        return send_prepared(PreparedBody.from_json(query_kanji(request.args), etag))
+    except QueryError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@tankanji_bp.route('/api/sample', methods=['POST'])
+def sample():
+    """
+    未出題の漢字を指定数だけ選んで返す
+
+    リクエスト:
+    {
+        "grades": [1],
+        "count": 10,
+        "order": "random" or "stroke",
+        "state": "<前回返した出題済み状態>"
+    }
+    旧形式の出題済みID配列は "used_ids" で渡すと state に変換します。
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'status': 'error', 'message': 'No JSON data provided'}), 400
+
+    grades = data.get('grades')
+    if not isinstance(grades, list) or not all(isinstance(g, int) for g in grades):
+        return jsonify({'status': 'error', 'message': 'Invalid grades'}), 400
+
+    try:
+        return jsonify(sample_kanji(
+            grades,
+            data.get('count', 10),
+            order=data.get('order', 'random'),
+            state=data.get('state'),
+            used_ids=data.get('used_ids')
+        ))
+    except (QueryError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+漢字データ読み込み時間の比較（CSV解析 vs コンパイル済みデータ）
+
+使い方:
+    python benchmarks/bench_kanji_load.py --repeat 50
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.common.kanji_loader import KanjiLoader, KanjiStore  # noqa: E402
+
+
+def measure(func, repeat):
+    """関数を repeat 回実行し、(最小, 平均) のミリ秒を返す"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings), sum(timings) / len(timings)
+
+
+def load_from_csv():
+    """
+    CSV の読み込み・解析・インデックス作成のみ
+
+    _load_store(force=True) はコンパイル済みデータとスナップショットの書き込みを含むため使わない
+    """
+    with open(KanjiLoader.csv_path(), 'rb') as f:
+        raw = f.read()
+    records = KanjiLoader.parse_csv(raw.decode('utf-8-sig'))
+    KanjiStore(records, version=hashlib.sha1(raw).hexdigest())
+
+
+def load_from_artifact():
+    KanjiLoader._store = None
+    KanjiLoader.get_store()
+    assert KanjiLoader.last_source == 'artifact'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='漢字データ読み込みベンチマーク')
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    # コンパイル済みデータは計測前に1回だけ作成し、計測中は読み込みのみ行う
+    KanjiLoader.build_artifact()
+
+    results = [
+        ('csv', measure(load_from_csv, args.repeat)),
+        ('artifact', measure(load_from_artifact, args.repeat)),
+    ]
+
+    print(f"{'source':<10}{'min(ms)':>10}{'avg(ms)':>10}")
+    for name, (best, avg) in results:
+        print(f'{name:<10}{best:>10.2f}{avg:>10.2f}')
+    print(f'speedup: x{results[0][1][1] / results[1][1][1]:.1f}')
+
+
+if __name__ == '__main__':
+    main()
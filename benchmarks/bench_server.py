@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CGI 実行と常駐サーバー（serve.py）の起動時間・スループット比較
+
+使い方:
+    python benchmarks/bench_server.py --requests 200 --concurrency 8
+
+CGI 側は index.cgi を CGI 環境変数付きで 1 リクエスト 1 プロセスとして起動し、
+常駐側は serve.py を起動して同じパスへ HTTP リクエストを送ります。
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PATHS = ['/', '/kuku/', '/tankanji/api/kanji-data']
+
+
+def cgi_environ(path):
+    """index.cgi 実行用の CGI 環境変数"""
+    env = dict(os.environ)
+    env.update({
+        'GATEWAY_INTERFACE': 'CGI/1.1',
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'FLASK_CONFIG': 'production',
+    })
+    return env
+
+
+def run_cgi_request(path):
+    """CGI として 1 リクエストを処理し、所要時間（秒）を返す"""
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT_DIR, 'index.cgi')],
+        cwd=ROOT_DIR,
+        env=cgi_environ(path),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=30.0):
+    """サーバーが応答するまで待機し、待機時間（秒）を返す"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return time.perf_counter() - started
+        except OSError:
+            time.sleep(0.02)
+    raise RuntimeError('server did not start in time')
+
+
+def run_http_request(port, path):
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('GET', path)
+    conn.getresponse().read()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+        'p50_ms': round(latencies[count // 2] * 1000, 2),
+        'p95_ms': round(latencies[min(count - 1, int(count * 0.95))] * 1000, 2),
+    }
+
+
+def bench(label, func, paths, total, concurrency):
+    jobs = [paths[i % len(paths)] for i in range(total)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(func, jobs))
+    result = summarize(latencies, time.perf_counter() - started)
+    result['mode'] = label
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CGI と常駐サーバーの比較')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--path', action='append', dest='paths')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args(argv)
+    paths = args.paths or DEFAULT_PATHS
+
+    results = []
+
+    # CGI: 全リクエストがコールドスタート
+    results.append(bench('cgi', run_cgi_request, paths, args.requests, args.concurrency))
+
+    # 常駐サーバー
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, 'serve.py'),
+         '--port', str(port), '--workers', str(args.workers),
+         '--threads', str(args.threads)],
+        cwd=ROOT_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        startup = wait_until_ready(port)
+        result = bench(
+            'serve', lambda path: run_http_request(port, path),
+            paths, args.requests, args.concurrency
+        )
+        result['startup_ms'] = round(startup * 1000, 2)
+        results.append(result)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'mode':<8}{'requests':>10}{'req/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'startup(ms)':>13}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['requests']:>10}{r['throughput_rps']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r.get('startup_ms', '-'):>13}")
+
+
+if __name__ == '__main__':
+    main()
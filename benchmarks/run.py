@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク一式（エンドポイント・データ層）
+
+Flask のテストクライアントと create_app('testing') で各処理を計測し、
+結果を JSON で出力します。基準値（baseline.json）と比較して、
+しきい値を超えて遅くなった項目があれば終了コード 1 を返します。
+
+使い方:
+    python benchmarks/run.py                          # 計測して基準値と比較
+    python benchmarks/run.py --output result.json     # 結果を保存
+    python benchmarks/run.py --save-baseline          # 現在の結果を基準値として保存
+    python benchmarks/run.py --only kuku_lifecycle --repeat 200
+
+基準値は計測したマシンに依存するため、比較する環境で作成してください。
+"""
+import argparse
+import compileall
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, 'benchmarks', 'baseline.json')
+
+# 比較に使う統計値（共有サーバー等の揺らぎに強い最小値を既定とする）
+DEFAULT_STAT = 'min'
+
+# 基準値からの許容増加率（baseline.json の thresholds で項目ごとに上書き可）
+DEFAULT_THRESHOLD = 0.3
+
+# これより小さい差（ミリ秒）は誤差として扱う
+MIN_DELTA_MS = 0.05
+
+# 名前 -> (関数, 既定の繰り返し回数)
+BENCHMARKS = {}
+
+
+def benchmark(name, repeat=100):
+    """ベンチマークを登録するデコレーター（関数は ctx を受け取り、1回分の処理を返す）"""
+    def decorator(func):
+        BENCHMARKS[name] = (func, repeat)
+        return func
+    return decorator
+
+
+def summarize(timings):
+    """ミリ秒の計測値を集計"""
+    ordered = sorted(timings)
+    return {
+        'unit': 'ms',
+        'iterations': len(ordered),
+        'min': round(ordered[0], 4),
+        'median': round(statistics.median(ordered), 4),
+        'mean': round(statistics.mean(ordered), 4),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+    }
+
+
+def measure(func, repeat, warmup=3):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+
+class Context:
+    """ベンチマーク共通の環境（一時ディレクトリの DB とテストクライアント）"""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.env = dict(
+            os.environ,
+            FLASK_CONFIG='testing',
+            DATABASE=os.path.join(workdir, 'study.db'),
+            HISTORY_JOURNAL_DIR=os.path.join(workdir, 'journal'),
+            METRICS_BACKEND='memory',
+            STAMP_DIR=os.path.join(workdir, 'stamps'),
+        )
+        os.environ.update(self.env)
+
+        from flask.logging import default_handler
+
+        from app import create_app
+        self.app = create_app('testing')
+        # 標準エラーへのログ出力で計測結果が埋もれないようにする（ファイルへの出力は残す）
+        self.app.logger.removeHandler(default_handler)
+        self.client = self.app.test_client()
+
+    def post_json(self, path, payload, expected=200):
+        response = self.client.post(path, json=payload)
+        if response.status_code != expected:
+            raise RuntimeError(f'{path}: {response.status_code} {response.get_data(as_text=True)[:200]}')
+        return response.get_json()
+
+    def get(self, path, expected=200, **kwargs):
+        response = self.client.get(path, **kwargs)
+        if response.status_code != expected:
+            raise RuntimeError(f'{path}: {response.status_code}')
+        return response
+
+
+# ---------------------------------------------------------------------------
+# ベンチマーク
+# ---------------------------------------------------------------------------
+
+@benchmark('cold_start_wsgi_import', repeat=5)
+def bench_cold_start(ctx):
+    """新しいプロセスで wsgi_app を import するまでの時間（CGI の1リクエストの固定費）"""
+    code = (
+        'import time; started = time.perf_counter(); import wsgi_app; '
+        'print((time.perf_counter() - started) * 1000)'
+    )
+
+    def run():
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], cwd=ROOT_DIR, env=ctx.env, stderr=subprocess.DEVNULL
+        )
+        return float(output.decode().strip().splitlines()[-1])
+
+    # 本番と同じくバイトコードのキャッシュがある状態で計測する
+    # （PYTHONDONTWRITEBYTECODE の環境では毎回のコンパイル時間が混ざるため）
+    compileall.compile_dir(os.path.join(ROOT_DIR, 'app'), quiet=1)
+    for name in ('wsgi_app.py', 'config.py'):
+        compileall.compile_file(os.path.join(ROOT_DIR, name), quiet=1)
+
+    # プロセス起動自体の時間を含めないよう、子プロセス内で計測した値を使う
+    return run
+
+
+@benchmark('kanji_load', repeat=50)
+def bench_kanji_load(ctx):
+    from app.common.kanji_loader import KanjiLoader
+
+    # コンパイル済みデータは準備として1回だけ作成し、読み込みのみを計測する
+    KanjiLoader.build_artifact()
+
+    def run():
+        KanjiLoader._store = None
+        KanjiLoader.load()
+        assert KanjiLoader.last_source == 'artifact'
+    return run
+
+
+@benchmark('kanji_get_by_grade', repeat=500)
+def bench_kanji_get_by_grade(ctx):
+    from app.common.kanji_loader import KanjiLoader
+
+    KanjiLoader.get_store()
+
+    def run():
+        for grade in range(1, 7):
+            KanjiLoader.get_by_grade(grade)
+    return run
+
+
+@benchmark('tankanji_kanji_data_serialize', repeat=30)
+def bench_kanji_data_serialize(ctx):
+    """応答キャッシュを空にした状態での /tankanji/api/kanji-data（シリアライズ・圧縮込み）"""
+    from app.tankanji import routes
+
+    def run():
+        routes._payload_cache.clear()
+        ctx.get('/tankanji/api/kanji-data', headers={'Accept-Encoding': 'gzip'})
+    return run
+
+
+@benchmark('tankanji_kanji_data_cached', repeat=200)
+def bench_kanji_data_cached(ctx):
+    ctx.get('/tankanji/api/kanji-data', headers={'Accept-Encoding': 'gzip'})
+
+    def run():
+        ctx.get('/tankanji/api/kanji-data', headers={'Accept-Encoding': 'gzip'})
+    return run
+
+
+@benchmark('kuku_lifecycle', repeat=200)
+def bench_kuku_lifecycle(ctx):
+    """/kuku/api/session -> /kuku/api/result"""
+    def run():
+        session = ctx.post_json('/kuku/api/session', {'levels': [2, 3, 5], 'mode': 'random'})
+        ctx.post_json('/kuku/api/result', {
+            'session_id': session['session_id'],
+            'correct_count': 25,
+            'total_count': 27,
+            'correct_rate': 93,
+        })
+    return run
+
+
+@benchmark('kuku_quiz_generate', repeat=500)
+def bench_kuku_quiz_generate(ctx):
+    """出題エンジンのみ（2～9の段、random、毎回異なるシード）"""
+    from itertools import count
+
+    from app.kuku.engine import generate_quiz
+
+    seeds = count()
+
+    def run():
+        generate_quiz([2, 3, 4, 5, 6, 7, 8, 9], 'random', seed=next(seeds))
+    return run
+
+
+@benchmark('kuku_quiz_api', repeat=300)
+def bench_kuku_quiz_api(ctx):
+    """/kuku/api/quiz（同じ条件の2回目以降。クラス全員が同時に開始する場合）"""
+    path = '/kuku/api/quiz?levels=2,3,4,5,6,7,8,9&mode=random&seed=1'
+    ctx.get(path)
+
+    def run():
+        ctx.get(path)
+    return run
+
+
+@benchmark('kuku_fact_stats', repeat=20)
+def bench_kuku_fact_stats(ctx):
+    """回答ログ 3000セッション（1セッション 20問）から九九ごとの集計（キャッシュなし）"""
+    import random
+    import time
+    import uuid
+
+    from app.common.storage import get_storage
+    from app.kuku.answers import _fact_stats, encode_answers
+    from app.kuku.engine import FACTS
+
+    rng = random.Random(0)
+    now = int(time.time())
+    rows = []
+    for i in range(3000):
+        answers = []
+        for _ in range(20):
+            position = rng.randrange(len(FACTS))
+            correct = rng.random() < 0.8
+            answers.append((position, FACTS[position][2] if correct else 0, correct,
+                            rng.randrange(1000, 8000)))
+        rows.append((uuid.uuid4().bytes, now - i * 600, now - i * 600 + 120,
+                     encode_answers(answers)))
+    with ctx.app.app_context():
+        with get_storage().transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO quiz_sessions
+                (id, app_type, levels, mode, status, correct_count, total_count,
+                 correct_rate, answers, created_at, completed_at)
+                VALUES (?, 1, 511, 1, 1, 16, 20, 80, ?, ?, ?)
+                """,
+                [(key, blob, created, completed) for key, created, completed, blob in rows]
+            )
+
+    def run():
+        with ctx.app.app_context():
+            _fact_stats.uncached(30, 511)
+    return run
+
+
+@benchmark('shisoku_batch_generate', repeat=100)
+def bench_shisoku_batch_generate(ctx):
+    """四則演算の問題 1万問（4演算 x 2500問、2桁と1桁、繰り上がりなし、毎回異なるシード）"""
+    from itertools import count
+
+    from app.shisoku.generator import OPERATIONS, ProblemSpec, generate_problems
+
+    spec = ProblemSpec(2, 1, no_carry=True)
+    seeds = count()
+
+    def run():
+        generate_problems(list(OPERATIONS), 2500, spec, seed=next(seeds))
+    return run
+
+
+@benchmark('rireki_save', repeat=200)
+def bench_rireki_save(ctx):
+    def run():
+        ctx.post_json('/rireki/api/save', {
+            'appId': 'kuku',
+            'userId': 'bench',
+            'record': {'correctCount': 8, 'totalCount': 10, 'timeSpent': 42},
+        })
+    return run
+
+
+@benchmark('rireki_stats', repeat=200)
+def bench_rireki_stats(ctx):
+    """1年分（1日10件）の履歴がある状態で30日分の統計を取得"""
+    from datetime import date, timedelta
+
+    from app.rireki.logic import normalize_record
+    from app.rireki.routes import history_logic
+
+    start = date(2025, 1, 1)
+    entries = []
+    for day in range(365):
+        for i in range(10):
+            entries.append(normalize_record('shisoku', {
+                'id': f'bench-{day}-{i}',
+                'date': (start + timedelta(days=day)).isoformat(),
+                'correctCount': i,
+                'totalCount': 10,
+                'timeSpent': 30,
+            }, user_id='bench'))
+    with ctx.app.app_context():
+        history_logic.ingest_records(entries)
+
+    def run():
+        ctx.get('/rireki/api/stats/shisoku?from=2025-06-01&to=2025-06-30')
+    return run
+
+
+# ---------------------------------------------------------------------------
+# 実行・比較
+# ---------------------------------------------------------------------------
+
+def git_revision():
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        )
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names, repeat=None):
+    workdir = tempfile.mkdtemp(prefix='study-bench-')
+    try:
+        ctx = Context(workdir)
+        results = {}
+        for name in names:
+            func, default_repeat = BENCHMARKS[name]
+            target = func(ctx)
+            count = repeat or default_repeat
+            if name == 'cold_start_wsgi_import':
+                results[name] = summarize([target() for _ in range(count)])
+            else:
+                results[name] = measure(target, count)
+            print(f"  {name:<32}{results[name]['min']:>10.3f} ms (min)"
+                  f"{results[name]['median']:>10.3f} ms (median)", file=sys.stderr)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, default_threshold=DEFAULT_THRESHOLD, stat=DEFAULT_STAT):
+    """
+    基準値と統計値 stat で比較
+
+    Returns:
+        dict: 項目名 -> {baseline, current, change, threshold, regression}
+    """
+    thresholds = baseline.get('thresholds', {})
+    report = {}
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        threshold = thresholds.get(name, default_threshold)
+        base = previous[stat]
+        now = current[stat]
+        change = (now - base) / base if base else 0.0
+        report[name] = {
+            'baseline': base,
+            'current': now,
+            'change': round(change, 4),
+            'threshold': threshold,
+            'regression': change > threshold and now - base > MIN_DELTA_MS,
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ベンチマーク一式')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help='実行する項目（複数指定可）')
+    parser.add_argument('--repeat', type=int, help='繰り返し回数（既定は項目ごと）')
+    parser.add_argument('--output', help='結果の JSON を保存するパス（既定は標準出力）')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='比較する基準値')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='許容する増加率（既定 0.3 = 30%%）')
+    parser.add_argument('--stat', default=DEFAULT_STAT, choices=('min', 'median', 'mean', 'p95'),
+                        help='比較に使う統計値（既定 min）')
+    parser.add_argument('--save-baseline', action='store_true', help='結果を基準値として保存')
+    args = parser.parse_args(argv)
+
+    names = args.only or list(BENCHMARKS)
+    results = run_benchmarks(names, args.repeat)
+
+    document = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': int(time.time()),
+        },
+        'results': results,
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        document['comparison'] = compare(results, baseline, args.threshold, args.stat)
+
+    output = json.dumps(document, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.save_baseline:
+        previous = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                previous = json.load(f)
+        saved = {
+            'meta': document['meta'],
+            'thresholds': previous.get('thresholds', {}),
+            'results': results,
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(saved, ensure_ascii=False, indent=2) + '\n')
+        print(f'baseline saved: {args.baseline}', file=sys.stderr)
+        return 0
+
+    regressions = [name for name, item in document.get('comparison', {}).items() if item['regression']]
+    for name in regressions:
+        item = document['comparison'][name]
+        print(f"REGRESSION {name}: {item['baseline']:.3f} -> {item['current']:.3f} ms "
+              f"(+{item['change'] * 100:.0f}% > {item['threshold'] * 100:.0f}%)", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
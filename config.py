@@ -1,5 +1,7 @@
 import os
 
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
 class Config:
     """共通設定"""
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-key-change-in-production')
@@ -13,6 +15,75 @@ class Config:
     
     # ログ設定
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.getenv('LOG_FILE', os.path.join(BASE_DIR, 'logs', 'app.log'))
+    # 'queue'（バックグラウンドで JSON 行を書き込む）/ 'file'（同期書き込み・テキスト形式）
+    LOG_MODE = os.getenv('LOG_MODE', 'queue')
+    # INFO 以下のログの間引き（例: "app.kuku=0.1,app.rireki.routes=0.5"）
+    LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')
+    
+    # データベース: 'sqlite'（DATABASE のファイル）/ 'mysql'（PyMySQL、接続はプールで再利用）
+    DB_BACKEND = os.getenv('DB_BACKEND', 'sqlite')
+    DATABASE = os.getenv('DATABASE', os.path.join(BASE_DIR, 'data', 'study.db'))
+    MYSQL_HOST = os.getenv('MYSQL_HOST', 'localhost')
+    MYSQL_PORT = int(os.getenv('MYSQL_PORT', 3306))
+    MYSQL_USER = os.getenv('MYSQL_USER', '')
+    MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
+    MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', '')
+    DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+    # プールの接続数の上限・空きを待つ秒数・死活確認（ping）の間隔・接続を作り直す間隔
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL', 30))
+    DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 3600))
+    
+    # 起動時のチェック（スキーマの作成・更新等）が済んだことを記録するスタンプファイルの置き場所
+    # （空文字で無効化し、プロセスごとに確認する）
+    STAMP_DIR = os.getenv('STAMP_DIR', os.path.join(BASE_DIR, 'data', 'cache', 'stamps'))
+    
+    # 九九セッション: 'signed'（署名付きトークン、作成時のDB書き込みなし）/ 'database'
+    KUKU_SESSION_MODE = os.getenv('KUKU_SESSION_MODE', 'signed')
+    KUKU_SESSION_MAX_AGE = int(os.getenv('KUKU_SESSION_MAX_AGE', 24 * 60 * 60))
+    
+    # 学習履歴ジャーナル（追記 -> 定期的に SQLite へ取り込み）
+    HISTORY_JOURNAL_DIR = os.getenv(
+        'HISTORY_JOURNAL_DIR', os.path.join(BASE_DIR, 'data', 'journal')
+    )
+    HISTORY_JOURNAL_ROTATE_SECONDS = int(os.getenv('HISTORY_JOURNAL_ROTATE_SECONDS', 60))
+    # 取り込みは cron の manage.py compact-journal で行う。取り込み待ちがこのサイズ（バイト）を
+    # 超えた場合のみリクエスト処理中にも取り込む（0 以下で無効）
+    HISTORY_COMPACT_MIN_BYTES = int(os.getenv('HISTORY_COMPACT_MIN_BYTES', 256 * 1024))
+    # リクエスト処理中に取り込みを試みる最小間隔（秒）
+    HISTORY_COMPACT_INTERVAL = int(os.getenv('HISTORY_COMPACT_INTERVAL', 30))
+    # /rireki/api/export の Bearer トークン（または ?token=）。未設定の場合 /rireki/api/export は 404
+    HISTORY_EXPORT_TOKEN = os.getenv('HISTORY_EXPORT_TOKEN', '')
+    
+    # テンプレートのバイトコードキャッシュ（空文字で無効化）
+    TEMPLATE_CACHE_DIR = os.getenv(
+        'TEMPLATE_CACHE_DIR', os.path.join(BASE_DIR, 'data', 'cache', 'jinja')
+    )
+    
+    # メトリクス: 'memory'（プロセス内）/ 'sqlite'（複数プロセス・CGI で集計）/ ''（無効）
+    METRICS_BACKEND = os.getenv('METRICS_BACKEND', 'memory')
+    METRICS_DATABASE = os.getenv('METRICS_DATABASE', os.path.join(BASE_DIR, 'data', 'metrics.db'))
+    # sqlite: プロセス内にためた値を書き込む間隔（秒）。プロセス終了時にも書き込む
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+    # /metrics の Bearer トークン（または ?token=）。未設定の場合 /metrics は 404
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    
+    # 共有キャッシュ: 'sqlite'（複数プロセス・CGI で共有）/ 'memory'（プロセス内）/ ''（無効）
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+    CACHE_DATABASE = os.getenv('CACHE_DATABASE', os.path.join(BASE_DIR, 'data', 'cache', 'shared_cache.db'))
+    # 容量の上限（バイト）。超えた場合は最終参照の古いものから削除
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    # 有効期限の既定値（秒）
+    CACHE_DEFAULT_TTL = int(os.getenv('CACHE_DEFAULT_TTL', 300))
+    
+    # 事前レンダリングしたページの出力先（.htaccess のルールと合わせる）
+    PRERENDER_DIR = os.getenv('PRERENDER_DIR', os.path.join(BASE_DIR, 'prerendered'))
+    # 起動時にテンプレート等の変更を検出して書き出し直す（既定は無効。manage.py の migrate・build-assets・
+    # build-templates が変更を検出して書き出し直す）
+    # 有効にすると CGI の各プロセスの起動時にテンプレート等のファイルを stat で確認する
+    PRERENDER_AUTO = os.getenv('PRERENDER_AUTO', '0') == '1'
 
 class DevelopmentConfig(Config):
     """開発環境設定"""
@@ -26,6 +97,9 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """テスト環境設定"""
     TESTING = True
+    METRICS_BACKEND = os.getenv('METRICS_BACKEND', 'memory')
+    PRERENDER_AUTO = False
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', '')
 
 # 設定マップ
 config_map = {
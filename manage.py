@@ -0,0 +1,244 @@
+#!/usr/local/bin/python3.7
+# -*- coding: utf-8 -*-
+"""
+管理コマンド
+
+使い方:
+    python manage.py <command> [options]
+    python manage.py --help
+
+環境変数:
+    FLASK_CONFIG: 設定名（既定: production）
+"""
+import argparse
+import os
+import sys
+
+# コマンド名 -> (関数, ヘルプ, 引数定義)
+COMMANDS = {}
+
+
+def command(name, help, arguments=()):
+    """管理コマンドを登録するデコレーター"""
+    def decorator(func):
+        COMMANDS[name] = (func, help, arguments)
+        return func
+    return decorator
+
+
+def get_app(config_name):
+    """コマンド実行用のアプリを生成"""
+    # 事前レンダリングは prerender コマンドと refresh_prerendered で行う（起動時の自動更新はしない）
+    os.environ.setdefault('PRERENDER_AUTO', '0')
+    from app import create_app
+    return create_app(config_name)
+
+
+def refresh_prerendered(app):
+    """
+    書き出し済みのページが古ければ書き出し直す（一度も書き出していない場合は何もしない）
+
+    テンプレート・アセット・ポータルのアプリ一覧を更新するデプロイの手順（build-templates、
+    build-assets、migrate）から呼び出し、prerender の実行し忘れで古い HTML が残らないようにする
+    """
+    from app.common.prerender import refresh_if_stale
+
+    manifest = refresh_if_stale(app)
+    if manifest is not None:
+        print(f"prerendered {len(manifest['pages'])} pages -> {app.config['PRERENDER_DIR']}")
+    return manifest
+
+
+@command('build-templates', 'テンプレートを事前コンパイルしてバイトコードキャッシュに保存', [
+    (('--clear',), {'action': 'store_true', 'help': '既存のキャッシュを削除してから再生成'}),
+])
+def build_templates(app, args):
+    from app.common.template_cache import precompile_templates
+
+    if app.jinja_env.bytecode_cache is None:
+        print('TEMPLATE_CACHE_DIR が無効のため、バイトコードキャッシュは使用されません')
+        return 1
+
+    names = precompile_templates(app, clear=args.clear)
+    for name in names:
+        print(f'  compiled: {name}')
+    print(f'{len(names)} templates -> {app.config["TEMPLATE_CACHE_DIR"]}')
+    refresh_prerendered(app)
+    return 0
+
+
+@command('build-kanji', '漢字CSVをコンパイル済みデータ（data/cache/es_kanji.marshal）に変換')
+def build_kanji(app, args):
+    from app.common.cache import invalidate_tags
+    from app.common.kanji_loader import KanjiLoader
+
+    store = KanjiLoader.build_artifact()
+    invalidate_tags('kanji')
+    print(f'{len(store)} records (version {store.version[:12]}) -> {KanjiLoader.artifact_path()}')
+    return 0
+
+
+@command('build-assets', 'JS / CSS を縮小・ハッシュ付きファイル名・事前圧縮して app/static/dist に出力')
+def build_assets(app, args):
+    from app.common.assets import build_assets as build
+
+    manifest = build(app.static_folder)
+    for name, hashed in sorted(manifest['assets'].items()):
+        print(f'  {name} -> {hashed}')
+    print(f"{len(manifest['assets'])} assets (version {manifest['version']})")
+    # 読み込み済みのマニフェストを捨て、書き出すページに新しいアセットの URL を使う
+    app.extensions.pop('assets', None)
+    refresh_prerendered(app)
+    return 0
+
+
+@command('prune-assets', '古いビルドのハッシュ付きアセットを削除（直近・保持期間内のビルドが参照するものは残す）', [
+    (('--keep',), {'type': int, 'default': None, 'help': '残す直近のビルド数（既定 5）'}),
+    (('--min-age-days',), {'type': float, 'default': None, 'help': 'この日数以内のビルドは残す（既定 7）'}),
+])
+def prune_assets(app, args):
+    from app.common.assets import PRUNE_KEEP_BUILDS, PRUNE_MIN_AGE, prune_assets as prune
+
+    keep = PRUNE_KEEP_BUILDS if args.keep is None else args.keep
+    min_age = PRUNE_MIN_AGE if args.min_age_days is None else args.min_age_days * 24 * 60 * 60
+    result = prune(app.static_folder, keep=keep, min_age=min_age)
+    print(f"builds={result['builds']} removed_builds={result['removed_builds']} "
+          f"removed_files={result['removed_files']}")
+    return 0
+
+
+@command('prerender', 'ポータル・各アプリのメイン画面を静的な HTML に書き出す（Apache が直接配信）', [
+    (('--check',), {'action': 'store_true', 'help': '書き出さずに、書き出し済みのページが古いかだけを表示'}),
+])
+def prerender(app, args):
+    from app.common.prerender import is_stale, prerender as render
+
+    if args.check:
+        stale = is_stale(app)
+        print('stale' if stale else 'up to date')
+        return 1 if stale else 0
+
+    manifest = render(app)
+    for url_path, relative in sorted(manifest['pages'].items()):
+        print(f'  {url_path} -> {relative}')
+    print(f"{len(manifest['pages'])} pages -> {app.config['PRERENDER_DIR']}")
+    return 0
+
+
+@command('clear-cache', '共有キャッシュを削除', [
+    (('--tag',), {'action': 'append', 'help': '指定したタグのエントリのみ削除（例: kanji, history:kuku）'}),
+])
+def clear_cache(app, args):
+    from app.common.cache import get_cache
+
+    cache = get_cache()
+    if cache is None:
+        print('CACHE_BACKEND が無効のため、共有キャッシュは使用されません')
+        return 1
+    if args.tag:
+        print(f'{cache.invalidate_tags(*args.tag)} entries deleted')
+    else:
+        cache.clear()
+        print('cache cleared')
+    stats = cache.stats()
+    print(f"entries={stats['entries']} bytes={stats['bytes']}")
+    return 0
+
+
+@command('compact-journal', '学習履歴ジャーナルを SQLite に取り込む')
+def compact_journal(app, args):
+    from app.rireki.routes import history_logic
+
+    result = history_logic.compact_journal()
+    if result is None:
+        print('他のプロセスが取り込み中のためスキップしました')
+        return 0
+    print(f"segments={result['segments']} entries={result['entries']} "
+          f"inserted={result['inserted']} skipped={result['skipped']}")
+    return 0
+
+
+@command('rebuild-rollups', '学習履歴の日別集計を全件から再作成')
+def rebuild_rollups(app, args):
+    from app.rireki.routes import history_logic
+
+    count = history_logic.rebuild_rollups()
+    print(f'{count} rollup rows rebuilt')
+    return 0
+
+
+@command('purge-sessions', '放置された九九セッション（未完了）を削除して領域を返却', [
+    (('--older-than',), {'type': int, 'help': '作成からの経過秒数（既定: KUKU_SESSION_MAX_AGE）'}),
+    (('--batch-size',), {'type': int, 'default': 1000, 'help': '1回のトランザクションで削除する件数'}),
+    (('--max-batches',), {'type': int, 'help': '実行するバッチ数の上限'}),
+])
+def purge_sessions(app, args):
+    from app.common import db
+    from app.common.storage import get_storage
+    from app.kuku.models import QuizSession
+
+    sqlite = get_storage().dialect == 'sqlite'
+    if sqlite and db.get_db().execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        # 既存の DB は一度だけ VACUUM して incremental モードに切り替える
+        print('auto_vacuum を INCREMENTAL に変更します（VACUUM を実行）')
+        db.get_db().execute('PRAGMA auto_vacuum=INCREMENTAL')
+        db.get_db().execute('VACUUM')
+
+    older_than = args.older_than or app.config['KUKU_SESSION_MAX_AGE']
+    deleted = QuizSession.purge_abandoned(older_than, args.batch_size, args.max_batches)
+    if sqlite:
+        free_pages = db.get_db().execute('PRAGMA freelist_count').fetchone()[0]
+        print(f'{deleted} sessions deleted (older than {older_than}s), free pages: {free_pages}')
+    else:
+        print(f'{deleted} sessions deleted (older than {older_than}s)')
+    return 0
+
+
+@command('migrate', 'データベース（DB_BACKEND）のスキーマを作成・更新（デプロイ後に実行）')
+def migrate(app, args):
+    from app.common.storage import get_storage
+
+    storage = get_storage()
+    if not storage.init(app, force=True):
+        print('スキーマの作成・更新に失敗しました（ログを確認してください）')
+        return 1
+    print(f'schema is up to date ({storage.dialect})')
+    refresh_prerendered(app)
+    return 0
+
+
+@command('check-db', 'データベース（DB_BACKEND）への接続とスキーマを確認')
+def check_db(app, args):
+    from app.common.storage import get_storage
+
+    storage = get_storage()
+    for table in ('quiz_sessions', 'history_records', 'history_daily_rollups'):
+        count = storage.query_one(f'SELECT COUNT(*) FROM {table}')[0]
+        print(f'  {table}: {count} rows')
+    print(' '.join(f'{key}={value}' for key, value in storage.stats().items()))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='学習アプリ 管理コマンド')
+    parser.add_argument('--config', default=os.getenv('FLASK_CONFIG', 'production'))
+    subparsers = parser.add_subparsers(dest='command')
+
+    for name, (func, help_text, arguments) in COMMANDS.items():
+        sub = subparsers.add_parser(name, help=help_text)
+        for flags, options in arguments:
+            sub.add_argument(*flags, **options)
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    func = COMMANDS[args.command][0]
+    app = get_app(args.config)
+    with app.app_context():
+        return func(app, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/local/bin/python3.7
+"""
+常駐 WSGI サーバー（プリフォーク + スレッドプール）
+
+index.cgi はリクエストごとにインタプリタ起動・Flask 読み込み・
+Blueprint 登録・CSV 読み込みを繰り返します。本スクリプトは
+app.create_app で生成したアプリを一度だけ初期化し、
+キャッシュを温めたうえで複数ワーカーに fork して待ち受けます。
+
+使い方:
+    python serve.py --host 0.0.0.0 --port 8000 --workers 4 --threads 8 --queue 32
+
+環境変数:
+    FLASK_CONFIG: 設定名（既定: production）
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+# ワーカーが短時間に連続で異常終了した場合の再起動待ち（秒）
+RESPAWN_BACKOFF = 1.0
+
+# 待ち行列が一杯のときに返す応答（処理スレッドを使わずに受け付けスレッドから送る）
+_BUSY_BODY = 'サーバーが混み合っています。しばらくしてから再度お試しください。\n'.encode('utf-8')
+BUSY_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Content-Type: text/plain; charset=utf-8\r\n'
+    b'Content-Length: ' + str(len(_BUSY_BODY)).encode('ascii') + b'\r\n'
+    b'Retry-After: 1\r\n'
+    b'Connection: close\r\n'
+    b'\r\n' + _BUSY_BODY
+)
+
+# 503 を送る際の送信タイムアウト（秒）
+BUSY_SEND_TIMEOUT = 1.0
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    同時処理数を上限付きスレッドプールで制御する WSGI サーバー
+
+    werkzeug の ThreadedWSGIServer は接続ごとにスレッドを生成するため、
+    ワーカーあたりのスレッド数を固定できるよう置き換えています。
+
+    処理中と待ち行列の合計が threads + max_queue に達した場合は、
+    待ち行列に積まずにすぐ 503 を返します（遅延とメモリが際限なく増えないようにする）。
+    """
+    multithread = True
+    daemon_threads = True
+
+    def __init__(self, host, port, app, threads, fd=None, max_queue=None):
+        super().__init__(host, port, app, fd=fd)
+        if max_queue is None:
+            max_queue = threads * 4
+        self._pool = ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix='wsgi-worker'
+        )
+        self._slots = threading.BoundedSemaphore(threads + max(0, max_queue))
+        self.rejected = 0
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            self._reject_request(request)
+            return
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            # 終了処理中（プールの停止後）
+            self._slots.release()
+            self._reject_request(request)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _reject_request(self, request):
+        """503 を返して接続を閉じる"""
+        try:
+            # 受信済みのリクエストを読み捨てる（未読のまま閉じると RST となり、応答が届かない場合がある）
+            request.setblocking(False)
+            try:
+                request.recv(65536)
+            except OSError:
+                pass
+            request.settimeout(BUSY_SEND_TIMEOUT)
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            pool.shutdown(wait=True)
+        super().server_close()
+
+
+def build_app(config_name):
+    """アプリを生成してプロセス共有キャッシュを温める"""
+    from app import create_app
+    from app.common.warmup import warm_up
+
+    app = create_app(config_name)
+    app.config['APPLICATION_ROOT'] = '/'
+    warm_up(app)
+    return app
+
+
+def create_listen_socket(host, port, backlog):
+    """全ワーカーで共有する待ち受けソケットを作成"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, threads, max_queue=None):
+    """ワーカープロセスの本体（SIGTERM で処理中リクエスト完了後に終了）"""
+    host, port = sock.getsockname()[:2]
+    server = PooledWSGIServer(host, port, app, threads, fd=sock.fileno(), max_queue=max_queue)
+
+    def handle_term(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_term)
+    signal.signal(signal.SIGINT, handle_term)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # os._exit で終了するため atexit は実行されない。ためたメトリクスをここで書き込む
+        from app.common.metrics import flush_metrics
+        try:
+            flush_metrics(app)
+        except Exception:
+            app.logger.warning('Failed to flush metrics on worker exit', exc_info=True)
+
+
+def spawn_worker(app, sock, threads, max_queue=None):
+    """ワーカーを fork して PID を返す"""
+    pid = os.fork()
+    if pid == 0:
+        # 子プロセス（fork 後フックは os.register_at_fork 経由で実行済み）
+        exit_code = 0
+        try:
+            run_worker(app, sock, threads, max_queue)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def run_prefork(app, sock, workers, threads, max_queue=None):
+    """マスタープロセス: ワーカーを起動・監視し、異常終了時は再起動"""
+    children = {}
+    stopping = []
+
+    def handle_stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    for _ in range(workers):
+        children[spawn_worker(app, sock, threads, max_queue)] = time.time()
+
+    app.logger.info(f'Prefork server started: workers={workers}, threads={threads}')
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            break
+
+        started_at = children.pop(pid, None)
+        if started_at is None or stopping:
+            continue
+
+        app.logger.warning(f'Worker {pid} exited (status={status}), respawning')
+        if time.time() - started_at < RESPAWN_BACKOFF:
+            time.sleep(RESPAWN_BACKOFF)
+        children[spawn_worker(app, sock, threads, max_queue)] = time.time()
+
+    sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='常駐 WSGI サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='ワーカープロセス数（1 の場合は fork しない）')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='ワーカーあたりのスレッド数')
+    parser.add_argument('--queue', type=int, default=None,
+                        help='ワーカーあたりの待ち行列の上限（超えた分は 503。既定: threads の 4 倍）')
+    parser.add_argument('--backlog', type=int, default=128)
+    parser.add_argument('--config', default=os.getenv('FLASK_CONFIG', 'production'))
+    args = parser.parse_args(argv)
+
+    app = build_app(args.config)
+    sock = create_listen_socket(args.host, args.port, args.backlog)
+    print(f'Serving on http://{args.host}:{args.port} '
+          f'(workers={args.workers}, threads={args.threads})', file=sys.stderr)
+
+    if args.workers <= 1 or not hasattr(os, 'fork'):
+        # Windows など fork できない環境は単一プロセスで動作
+        run_worker(app, sock, args.threads, args.queue)
+    else:
+        run_prefork(app, sock, args.workers, args.threads, args.queue)
+
+
+if __name__ == '__main__':
+    main()
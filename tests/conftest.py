@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """DB・ジャーナル・共有キャッシュを一時ディレクトリに置いたテスト用のアプリ"""
+    from app import create_app
+    from app.common.cache import init_cache
+    from app.common.storage import init_storage
+
+    app = create_app('testing')
+    app.config.update(
+        DATABASE=str(tmp_path / 'study.db'),
+        HISTORY_JOURNAL_DIR=str(tmp_path / 'journal'),
+        CACHE_DATABASE=str(tmp_path / 'cache.db'),
+        STAMP_DIR=str(tmp_path / 'stamps'),
+        HISTORY_COMPACT_MIN_BYTES=0,
+    )
+    init_storage(app)
+    init_cache(app)
+    return app
@@ -0,0 +1,48 @@
+"""
+アセットのビルド（以前のハッシュを残す）と古いビルドの削除
+"""
+import os
+
+from app.common.assets import DIST_DIR, build_assets, prune_assets
+
+
+def make_static(tmp_path, source):
+    static = tmp_path / 'static'
+    (static / 'js').mkdir(parents=True, exist_ok=True)
+    (static / 'js' / 'main.js').write_text(source, encoding='utf-8')
+    return str(static)
+
+
+def test_rebuild_keeps_previous_fingerprints(tmp_path):
+    static = make_static(tmp_path, 'const a = 1;\n')
+    first = build_assets(static)['assets']['js/main.js']
+
+    make_static(tmp_path, 'const a = 2;\n')
+    second = build_assets(static)['assets']['js/main.js']
+
+    assert first != second
+    assert os.path.exists(os.path.join(static, first))
+    assert os.path.exists(os.path.join(static, first + '.gz'))
+    assert os.path.exists(os.path.join(static, second))
+
+
+def test_prune_removes_only_old_builds(tmp_path):
+    static = make_static(tmp_path, 'const a = 1;\n')
+    manifest = build_assets(static)
+    first = manifest['assets']['js/main.js']
+    make_static(tmp_path, 'const a = 2;\n')
+    second = build_assets(static)['assets']['js/main.js']
+
+    # 保持期間内のビルドは残す
+    assert prune_assets(static, keep=1)['removed_files'] == 0
+    assert os.path.exists(os.path.join(static, first))
+
+    # 保持期間を過ぎ、直近 keep 回にも入らないビルドだけを削除する
+    os.utime(os.path.join(static, DIST_DIR, 'manifests', f"{manifest['version']}.json"), (1, 1))
+    os.utime(os.path.join(static, first), (1, 1))
+    os.utime(os.path.join(static, first + '.gz'), (1, 1))
+    result = prune_assets(static, keep=1)
+    assert result['removed_builds'] == 1
+    assert not os.path.exists(os.path.join(static, first))
+    assert not os.path.exists(os.path.join(static, first + '.gz'))
+    assert os.path.exists(os.path.join(static, second))
@@ -0,0 +1,32 @@
+"""
+共有キャッシュの SQLite ストア（スキーマ作成のスタンプ）
+"""
+import os
+import time
+
+from app.common.cache import SQLiteStore
+
+
+def test_sqlite_store_schema_stamp(tmp_path):
+    path = str(tmp_path / 'cache' / 'shared_cache.db')
+    stamp_dir = str(tmp_path / 'stamps')
+    now = time.time()
+
+    store = SQLiteStore(path, 1024 * 1024, stamp_dir)
+    store.set('a', b'value', None, ('tag',), now)
+    assert os.path.exists(os.path.join(stamp_dir, 'cache-schema.stamp'))
+    assert store._stamp_key() is not None
+
+    # 別のプロセスと同じ状態（スタンプが一致するためスキーマを作らずに使う）
+    other = SQLiteStore(path, 1024 * 1024, stamp_dir)
+    assert other.get('a', now) == b'value'
+
+    # DB ファイルを削除した場合はスキーマを作り直す
+    store._local.conn.close()
+    other._local.conn.close()
+    for name in os.listdir(os.path.dirname(path)):
+        os.remove(os.path.join(os.path.dirname(path), name))
+    fresh = SQLiteStore(path, 1024 * 1024, stamp_dir)
+    assert fresh.get('a', now) is None
+    fresh.set('b', b'value', None, (), now)
+    assert fresh.get('b', now) == b'value'
@@ -0,0 +1,108 @@
+"""
+quiz_sessions のマイグレーション（バージョン 5: コンパクトな形式への変換）
+"""
+import sqlite3
+import uuid
+
+from app.common import db
+
+# docs/06_server_architecture.md の初期のスキーマ（completed_at がない）
+BASELINE_SCHEMA = """
+CREATE TABLE quiz_sessions (
+    id TEXT PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    app_type TEXT NOT NULL,
+    levels TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    correct_count INTEGER DEFAULT 0,
+    total_count INTEGER DEFAULT 0,
+    status TEXT DEFAULT 'active'
+)
+"""
+
+
+def _baseline_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_SCHEMA)
+    conn.executemany(
+        'INSERT INTO quiz_sessions (id, created_at, app_type, levels, mode,'
+        ' correct_count, total_count, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_baseline_schema(tmp_path):
+    path = str(tmp_path / 'study.db')
+    session_id = str(uuid.uuid4())
+    _baseline_db(path, [
+        (session_id, '2024-04-01 10:00:00', 'kuku', '[2, 3]', 'random', 8, 10, 'completed'),
+        # NOT NULL の列に移す際に 0 になる
+        (str(uuid.uuid4()), '2024-04-01 11:00:00', 'kuku', '[5]', 'sequential', None, None, 'active'),
+        # 壊れた行は移行せずに飛ばす
+        ('not-a-uuid', '2024-04-01 12:00:00', 'kuku', '[2]', 'random', 0, 0, 'active'),
+        (str(uuid.uuid4()), '2024-04-01 13:00:00', 'kuku', 'broken', 'random', 0, 0, 'active'),
+    ])
+
+    conn = db.connect(path)
+    try:
+        assert db.migrate(conn) == db.MIGRATIONS[-1][0]
+        rows = conn.execute(
+            'SELECT id, app_type, levels, mode, status, correct_count, total_count,'
+            ' created_at, completed_at FROM quiz_sessions ORDER BY created_at'
+        ).fetchall()
+    finally:
+        conn.close()
+
+    assert len(rows) == 2
+    first, second = rows
+    assert first['id'] == uuid.UUID(session_id).bytes
+    assert first['app_type'] == 1
+    assert first['levels'] == 0b110
+    assert first['mode'] == 1
+    assert first['status'] == 1
+    assert (first['correct_count'], first['total_count']) == (8, 10)
+    assert first['created_at'] == 1711965600
+    assert first['completed_at'] is None
+    assert (second['correct_count'], second['total_count']) == (0, 0)
+    assert second['levels'] == 0b10000
+
+
+def test_migrate_new_database(tmp_path):
+    conn = db.connect(str(tmp_path / 'study.db'))
+    try:
+        assert db.migrate(conn) == db.MIGRATIONS[-1][0]
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(quiz_sessions)')}
+    finally:
+        conn.close()
+    assert {'completed_at', 'correct_rate', 'answers'} <= columns
+
+
+def test_init_db_skips_when_stamped(tmp_path, monkeypatch):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config['DATABASE'] = str(tmp_path / 'study.db')
+    app.config['STAMP_DIR'] = str(tmp_path / 'stamps')
+    monkeypatch.setattr(db, '_initialized', set())
+
+    assert db.init_db(app)
+    assert (tmp_path / 'stamps' / 'sqlite-schema.stamp').exists()
+    db.close_db(app.config['DATABASE'])
+
+    # 新しいプロセスと同じ状態（スタンプが一致すれば DB を開かない）
+    monkeypatch.setattr(db, '_initialized', set())
+    opened = []
+    monkeypatch.setattr(db, 'get_db', lambda *args: opened.append(args))
+    assert db.init_db(app)
+    assert opened == []
+
+    # DB ファイルを置き換えた場合は確認し直す
+    monkeypatch.undo()
+    monkeypatch.setattr(db, '_initialized', set())
+    (tmp_path / 'study.db').rename(tmp_path / 'old.db')
+    assert db.init_db(app)
+    conn = db.get_db(app.config['DATABASE'])
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == db.MIGRATIONS[-1][0]
+    db.close_db(app.config['DATABASE'])
@@ -0,0 +1,20 @@
+"""
+九九の回答ログの正規化
+"""
+import pytest
+
+from app.kuku.answers import AnswerLogError, encode_answers, iter_answers, normalize_answers
+
+
+def test_null_fields_use_defaults():
+    answers = normalize_answers([
+        {'multiplicand': 7, 'multiplier': 8, 'user_answer': 56, 'response_ms': None},
+        {'multiplicand': 2, 'multiplier': 3, 'user_answer': None, 'response_ms': 1500},
+    ])
+    assert answers == [(61, 56, True, 0), (11, None, False, 1500)]
+    assert list(iter_answers(encode_answers(answers))) == answers
+
+
+def test_null_required_field_is_rejected():
+    with pytest.raises(AnswerLogError):
+        normalize_answers([{'multiplicand': None, 'multiplier': 8, 'user_answer': 56}])
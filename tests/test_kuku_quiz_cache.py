@@ -0,0 +1,30 @@
+"""
+/kuku/api/quiz の出題リストのキャッシュ（複数スレッドからの参照・追い出し）
+"""
+import threading
+
+from app.kuku import routes
+
+
+def test_quiz_cache_concurrent_eviction(monkeypatch):
+    monkeypatch.setattr(routes, 'QUIZ_CACHE_SIZE', 4)
+    monkeypatch.setattr(routes, '_quiz_cache', routes.OrderedDict())
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(2000):
+                key = (offset + i) % 16
+                if routes._get_cached_quiz(key) is None:
+                    routes._set_cached_quiz(key, object())
+        except Exception as e:  # KeyError など
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(routes._quiz_cache) <= 4
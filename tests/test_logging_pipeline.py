@@ -0,0 +1,33 @@
+"""
+キュー経由のログ出力の設定
+"""
+import logging
+
+from app.common import logging_pipeline
+from app.common.logging_pipeline import NonBlockingQueueHandler, install_queue_logging
+
+
+def queue_handlers(logger):
+    return [handler for handler in logger.handlers if isinstance(handler, NonBlockingQueueHandler)]
+
+
+def test_install_queue_logging_is_idempotent(tmp_path):
+    logger = logging.getLogger('test_logging_pipeline')
+    filename = str(tmp_path / 'app.log')
+    try:
+        first = install_queue_logging(logger, filename, sampling={'app.kuku': 0.5})
+        second = install_queue_logging(logger, filename, sampling={'app.kuku': 0.5})
+        assert second is first
+        assert first._thread is not None
+        assert len(queue_handlers(logger)) == 1
+
+        # 設定が変わった場合は作り直す
+        third = install_queue_logging(logger, str(tmp_path / 'other.log'))
+        assert third is not first
+        assert first._thread is None
+        assert len(queue_handlers(logger)) == 1
+        assert queue_handlers(logger)[0].queue is third.queue
+    finally:
+        logging_pipeline._stop_listener()
+        for handler in queue_handlers(logger):
+            logger.removeHandler(handler)
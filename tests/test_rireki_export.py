@@ -0,0 +1,20 @@
+"""
+学習履歴のエクスポート（HISTORY_EXPORT_TOKEN による公開の制御）
+"""
+
+
+def test_export_is_hidden_without_token(app):
+    assert app.test_client().get('/rireki/api/export').status_code == 404
+
+
+def test_export_requires_token(app):
+    app.config['HISTORY_EXPORT_TOKEN'] = 'secret'
+    client = app.test_client()
+
+    assert client.get('/rireki/api/export').status_code == 401
+    assert client.get('/rireki/api/export?token=wrong').status_code == 401
+
+    response = client.get('/rireki/api/export?gzip=0', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert response.get_data(as_text=True).lstrip('\ufeff').startswith('record_id')
@@ -0,0 +1,45 @@
+"""
+学習履歴ジャーナルの取り込み（閾値によるリクエスト内の取り込み）
+"""
+from app.rireki.journal import HistoryJournal
+
+
+def make_journal(tmp_path, count, now):
+    journal = HistoryJournal(str(tmp_path), rotate_seconds=60)
+    for i in range(count):
+        journal.append({'record_id': f'r{i}', 'pad': 'x' * 100}, now=now - 120)
+    return journal
+
+
+def test_maybe_compact_skips_below_threshold(tmp_path):
+    now = 1_000_000
+    journal = make_journal(tmp_path, 3, now)
+    ingested = []
+
+    def ingest(entries):
+        ingested.extend(entries)
+        return len(entries)
+
+    assert journal.pending_bytes(now) > 0
+    assert journal.maybe_compact(ingest, 0, min_bytes=1024 * 1024, now=now) is None
+    assert ingested == []
+    assert journal.closed_segments(now)
+
+
+def test_maybe_compact_runs_above_threshold(tmp_path):
+    now = 1_000_000
+    journal = make_journal(tmp_path, 20, now)
+    ingested = []
+
+    def ingest(entries):
+        ingested.extend(entries)
+        return len(entries)
+
+    result = journal.maybe_compact(ingest, 30, min_bytes=1024, now=now)
+    assert result['entries'] == 20
+    assert len(ingested) == 20
+    assert journal.closed_segments(now) == []
+
+    # 最小間隔内は溜まっていても取り込まない
+    make_journal(tmp_path, 20, now + 10)
+    assert journal.maybe_compact(ingest, 30, min_bytes=1024, now=now + 10) is None
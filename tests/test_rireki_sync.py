@@ -0,0 +1,36 @@
+"""
+学習履歴の差分同期（送信分はジャーナルへ追記し、取り込み後に差分へ含める）
+"""
+import time
+
+from app.common.storage import get_storage
+from app.rireki.routes import history_logic
+
+
+def record(record_id):
+    return {'id': record_id, 'date': '2026-10-18', 'correctCount': 4, 'totalCount': 5, 'timeSpent': 30}
+
+
+def test_sync_appends_to_journal(app):
+    client = app.test_client()
+    response = client.post('/rireki/api/sync', json={
+        'userId': 'device-1', 'cursor': 0,
+        'records': [{'appId': 'kuku', 'record': record('r1')}, {'appId': 'kuku', 'record': 'bad'}],
+    })
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['accepted'] == 1 and data['rejected'] == [None]
+    assert data['ingestDeferred'] is True
+    assert data['records'] == []
+
+    with app.app_context():
+        # 応答の時点では DB に書き込まない
+        assert get_storage().query_one('SELECT COUNT(*) AS n FROM history_records')['n'] == 0
+        assert history_logic.journal.pending_bytes(time.time() + 3600) > 0
+        history_logic.compact_journal(now=time.time() + 3600)
+        assert get_storage().query_one('SELECT COUNT(*) AS n FROM history_records')['n'] == 1
+
+    # 取り込み後は差分に含まれる
+    data = client.post('/rireki/api/sync', json={'userId': 'device-1', 'cursor': 0}).get_json()
+    assert [item['record']['id'] for item in data['records']] == ['r1']
+    assert data['cursor'] > 0
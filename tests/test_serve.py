@@ -0,0 +1,64 @@
+"""
+常駐サーバーの待ち行列の上限
+"""
+import socket
+import threading
+import time
+
+from serve import PooledWSGIServer
+
+
+def send_request(port):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+    sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+    return sock
+
+
+def read_response(sock):
+    chunks = []
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        chunks.append(data)
+    sock.close()
+    return b''.join(chunks)
+
+
+def test_full_queue_returns_503():
+    started = threading.Event()
+    release = threading.Event()
+
+    def app(environ, start_response):
+        started.set()
+        release.wait(5)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    server = PooledWSGIServer('127.0.0.1', 0, app, threads=1, max_queue=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        busy = send_request(server.server_port)
+        assert started.wait(5)
+
+        # 処理中の1件で上限に達しているため、次の接続はすぐに 503
+        response = read_response(send_request(server.server_port))
+        assert response.startswith(b'HTTP/1.1 503 ')
+        assert b'Retry-After: 1' in response
+        assert server.rejected == 1
+
+        release.set()
+        assert b' 200 ' in read_response(busy).split(b'\r\n', 1)[0]
+
+        # 処理が終わると枠が空き、再び受け付ける（枠の返却は応答の送信後）
+        deadline = time.time() + 5
+        while not server._slots.acquire(blocking=False):
+            assert time.time() < deadline
+            time.sleep(0.01)
+        server._slots.release()
+        assert b' 200 ' in read_response(send_request(server.server_port)).split(b'\r\n', 1)[0]
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
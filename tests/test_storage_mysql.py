@@ -0,0 +1,261 @@
+"""
+MySQL バックエンド（プール・SQL の変換）
+
+PyMySQL の代わりに、接続・カーソルの動作をまねた FakePyMySQL を使います。
+"""
+import types
+
+import pytest
+
+from app.common import storage
+from app.common.storage import ConnectionPool, MySQLBackend, PoolTimeout, translate_sql
+
+
+class OperationalError(Exception):
+    pass
+
+
+class InterfaceError(Exception):
+    pass
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class MySQLError(Exception):
+    pass
+
+
+class SSCursor:
+    pass
+
+
+class FakeCursor:
+    def __init__(self, conn, unbuffered=False):
+        self.conn = conn
+        self.unbuffered = unbuffered
+        self.rowcount = 0
+        self.lastrowid = None
+        self.description = None
+        self._rows = []
+        self.closed = False
+
+    def execute(self, sql, params=()):
+        if self.conn.dropped:
+            raise OperationalError(2013, 'Lost connection to MySQL server during query')
+        self.conn.executed.append((sql, params))
+        if sql.startswith('SELECT'):
+            self.description = (('id',), ('name',))
+            self._rows = list(self.conn.rows)
+            self.rowcount = len(self._rows)
+        else:
+            self.rowcount = 1
+
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, params)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size):
+        self.conn.fetch_sizes.append(size)
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.dropped = False
+        self.closed = False
+        self.executed = []
+        self.fetch_sizes = []
+        self.cursors = []
+        self.rows = [(1, 'a'), (2, 'b'), (3, 'c')]
+
+    def cursor(self, cursor_class=None):
+        cursor = FakeCursor(self, cursor_class is SSCursor)
+        self.cursors.append(cursor)
+        return cursor
+
+    def ping(self, reconnect=False):
+        if self.dropped:
+            raise OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def fake_pymysql(monkeypatch):
+    module = types.SimpleNamespace(
+        err=types.SimpleNamespace(
+            OperationalError=OperationalError,
+            InterfaceError=InterfaceError,
+            IntegrityError=IntegrityError,
+            MySQLError=MySQLError,
+        ),
+        cursors=types.SimpleNamespace(SSCursor=SSCursor),
+    )
+    monkeypatch.setattr(storage, 'pymysql', module)
+    return module
+
+
+def make_connector():
+    created = []
+
+    def connect():
+        conn = FakeConnection(len(created))
+        created.append(conn)
+        return conn
+    return connect, created
+
+
+def test_translate_sql():
+    assert translate_sql('SELECT * FROM t WHERE a = ? AND b = ?') == \
+        'SELECT * FROM t WHERE a = %s AND b = %s'
+    assert translate_sql('UPDATE t SET a = :a WHERE id = :id') == \
+        'UPDATE t SET a = %(a)s WHERE id = %(id)s'
+    # 文字列リテラル内の ? / :name と、% はそのまま送られる
+    assert translate_sql("SELECT '?', ':x', a FROM t WHERE b LIKE '10%' AND c = ?") == \
+        "SELECT '?', ':x', a FROM t WHERE b LIKE '10%%' AND c = %s"
+    assert translate_sql('INSERT OR IGNORE INTO t (a) VALUES (?)') == 'INSERT IGNORE INTO t (a) VALUES (%s)'
+    assert translate_sql('INSERT OR REPLACE INTO t (a) VALUES (?)') == 'REPLACE INTO t (a) VALUES (%s)'
+
+
+def test_pool_checkout_and_return():
+    connect, created = make_connector()
+    pool = ConnectionPool(connect, size=2, timeout=0.05)
+
+    first = pool.acquire()
+    second = pool.acquire()
+    assert pool.stats() == {'size': 2, 'open': 2, 'idle': 0}
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    # 返却した接続を次の取り出しで再利用する
+    pool.release(second)
+    assert pool.acquire() is second
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats() == {'size': 2, 'open': 2, 'idle': 2}
+    assert len(created) == 2
+
+
+def test_pool_discard():
+    connect, created = make_connector()
+    pool = ConnectionPool(connect, size=1, timeout=0.05)
+
+    entry = pool.acquire()
+    pool.release(entry, discard=True)
+    assert entry.conn.closed
+    assert pool.stats()['open'] == 0
+    assert pool.acquire().conn is created[1]
+
+
+def test_pool_reconnects_dropped_connection():
+    connect, created = make_connector()
+    pool = ConnectionPool(connect, size=1, timeout=0.05, ping_interval=0)
+
+    entry = pool.acquire()
+    pool.release(entry)
+    entry.conn.dropped = True
+
+    # ping に失敗した接続は閉じて作り直す
+    replacement = pool.acquire()
+    assert replacement.conn is created[1]
+    assert created[0].closed
+    assert pool.stats()['open'] == 1
+
+
+def test_pool_recycles_old_connection():
+    connect, created = make_connector()
+    pool = ConnectionPool(connect, size=1, timeout=0.05, recycle=0)
+
+    pool.release(pool.acquire())
+    assert pool.acquire().conn is created[1]
+    assert created[0].closed
+
+
+def test_backend_discards_connection_lost_during_query(fake_pymysql):
+    connect, created = make_connector()
+    backend = MySQLBackend(ConnectionPool(connect, size=1, timeout=0.05))
+
+    assert [row['name'] for row in backend.query('SELECT id, name FROM t WHERE id > ?', (0,))] == \
+        ['a', 'b', 'c']
+    assert created[0].executed[-1] == ('SELECT id, name FROM t WHERE id > %s', (0,))
+
+    created[0].dropped = True
+    with pytest.raises(OperationalError):
+        backend.query('SELECT id, name FROM t')
+    assert created[0].closed
+
+    # 次の問い合わせは新しい接続で実行する
+    assert backend.query_one('SELECT id, name FROM t')['id'] == 1
+    assert len(created) == 2
+    assert backend.pool.stats() == {'size': 1, 'open': 1, 'idle': 1}
+
+
+def test_backend_iterate_uses_unbuffered_cursor(fake_pymysql):
+    connect, created = make_connector()
+    backend = MySQLBackend(ConnectionPool(connect, size=1, timeout=0.05))
+
+    rows = backend.iterate('SELECT id, name FROM t', (), size=2)
+    assert next(rows)['name'] == 'a'
+    # 列挙中は接続を使用している
+    assert backend.pool.stats()['idle'] == 0
+    assert [row[0] for row in rows] == [2, 3]
+
+    cursor = created[0].cursors[-1]
+    assert cursor.unbuffered and cursor.closed
+    assert created[0].fetch_sizes == [2, 2, 2]
+    assert backend.pool.stats()['idle'] == 1
+
+
+def test_backend_iterate_closed_early_returns_connection(fake_pymysql):
+    connect, created = make_connector()
+    backend = MySQLBackend(ConnectionPool(connect, size=1, timeout=0.05))
+
+    rows = backend.iterate('SELECT id, name FROM t', (), size=1)
+    next(rows)
+    rows.close()
+    assert created[0].cursors[-1].closed
+    assert backend.pool.stats()['idle'] == 1
+
+
+def test_backend_init_is_stamped(fake_pymysql, tmp_path):
+    from flask import Flask
+
+    connect, created = make_connector()
+    backend = MySQLBackend(ConnectionPool(connect, size=1, timeout=0.05),
+                           str(tmp_path / 'stamps'), 'localhost:3306/study')
+    app = Flask(__name__)
+
+    assert backend.init(app)
+    assert len(created) == 1
+    executed = len(created[0].executed)
+    assert any('schema_version' in sql for sql, _ in created[0].executed)
+
+    # スタンプが一致すれば接続しない（force=True の場合は確認し直す）
+    other = MySQLBackend(ConnectionPool(connect, size=1, timeout=0.05),
+                         str(tmp_path / 'stamps'), 'localhost:3306/study')
+    assert other.init(app)
+    assert len(created) == 1
+    assert other.init(app, force=True)
+    assert len(created) == 2
+    assert len(created[1].executed) >= executed
@@ -0,0 +1,28 @@
+"""
+単漢字の検索結果のページング
+"""
+from itertools import chain
+
+from app.common.kanji_loader import KanjiLoader
+from app.tankanji.logic import CandidateIndex, find_kanji, iter_matching_groups
+
+
+def test_candidate_index_slice():
+    index = CandidateIndex([(1, 2, 3), (4,), (5, 6)])
+    assert index[0:2] == [1, 2]
+    assert index[2:5] == [3, 4, 5]
+    assert index[5:10] == [6]
+    assert index[10:20] == []
+    assert CandidateIndex([])[0:5] == []
+
+
+def test_find_kanji_pages_match_full_listing():
+    store = KanjiLoader.get_store()
+    records, total = find_kanji(grades=[1, 2], min_strokes=3)
+    expected = list(chain.from_iterable(iter_matching_groups(store, [1, 2], 3)))
+
+    assert total == len(expected)
+    pages = []
+    for offset in range(0, total, 37):
+        pages.extend(records[offset:offset + 37])
+    assert pages == expected
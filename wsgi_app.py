@@ -15,6 +15,10 @@ app = Flask(__name__,
             template_folder=os.path.join(os.path.dirname(__file__), 'app', 'templates'),
             static_folder=os.path.join(os.path.dirname(__file__), 'app', 'static'))
 
+# 設定の読み込み（CGI 本番環境では production）
+from config import get_config
+app.config.from_object(get_config(os.getenv('FLASK_CONFIG', 'production')))
+
 # CGI環境でのパス問題を解決するため APPLICATION_ROOT を設定
 app.config['APPLICATION_ROOT'] = '/'
 
@@ -28,6 +32,31 @@ try:
     from app.shisoku import shisoku_bp
     from app.tankanji import tankanji_bp
     from app.rireki import register_blueprint as register_rireki
+    from app.common.template_cache import init_template_cache
+    from app.common.storage import init_storage
+    from app.common.metrics import init_metrics
+    from app.common.cache import init_cache
+    from app.common.assets import init_assets
+    from app.common.prerender import init_prerender
+    from app.common.utils import init_logger
+    
+    # ロギング初期化
+    init_logger(app)
+    
+    # テンプレートのバイトコードキャッシュ
+    init_template_cache(app)
+    
+    # データベース（DB_BACKEND）の選択とスキーマ作成・更新
+    init_storage(app)
+    
+    # リクエストのメトリクス計測（/metrics）
+    init_metrics(app)
+    
+    # プロセスをまたいで共有するキャッシュ
+    init_cache(app)
+    
+    # ハッシュ付きアセットの配信と asset_url（manage.py build-assets でビルド）
+    init_assets(app)
     
     # ポータル画面（ルート）
     app.register_blueprint(portal_bp, url_prefix='/')
@@ -60,6 +89,9 @@ try:
         app.logger.error(f'Internal server error: {error}')
         return jsonify({'error': 'Internal Server Error'}), 500
     
+    # 事前レンダリングしたページの更新（manage.py prerender）
+    init_prerender(app)
+    
 except Exception as e:
     # エラーログを出力
     import traceback